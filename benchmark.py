@@ -0,0 +1,210 @@
+"""Benchmarks for QC15's Statemaker tool.
+
+Generates synthetic statefiles of increasing size, and times each stage of
+building them separately, so that anything that scales badly stands out.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from intelhex import IntelHex
+
+from qc15_game import dot
+from qc15_game.game_state import *
+from qc15_game.synthetic import write_sheet, DEFAULT_EVENT_MIX
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+STAGES = ['read_rows', 'read_states_and_validate', 'read_actions',
+          'cull_nops', 'state_graph', 'merge_actions', 'assign_ids',
+          'check_action_graph', 'pack_structs', 'write_state_dot',
+          'write_action_dot', 'write_hex']
+
+# How long statemaker can take to start up and validate a tiny statefile, as
+#  it does for every save in an editor hook, in seconds.
+STARTUP_BUDGET = 0.1
+
+def fits_in_image(build):
+    # Every ID in the image is 16 bits, and 0xFFFF means NULL.
+    return max(len(build.action_table), len(build.text_table),
+               len(build.state_table)) < NULL
+
+def time_build(path, cull_nops, merge_actions):
+    # Runs every stage of a build of path, in the same order that
+    #  GameBuild.read_state_data() and statemaker do. Returns the build and
+    #  {stage: seconds}, leaving out stages that were skipped.
+    timings = dict()
+    def timed(stage, function, *args):
+        start = timeit.default_timer()
+        result = function(*args)
+        timings[stage] = timeit.default_timer() - start
+        return result
+
+    build = GameBuild(path, warn_on_wrap=False)
+    rows = timed('read_rows', build.read_rows)
+    timed('read_states_and_validate', build.read_states_and_validate, rows)
+    timed('read_actions', build.read_actions, rows)
+    if cull_nops:
+        timed('cull_nops', build.cull_nops)
+    timed('state_graph', build.analyze_states)
+    if merge_actions:
+        timed('merge_actions', build.merge_actions)
+    timed('assign_ids', build.assign_ids)
+    timed('check_action_graph', build.check_action_graph)
+    timed('write_state_dot', dot.write_state_dot, build, StringIO())
+    timed('write_action_dot', dot.write_action_dot, build, StringIO())
+
+    if fits_in_image(build):
+        binary_data = timed('pack_structs', build.pack_structs)
+        def write_hex():
+            flash = IntelHex()
+            flash.puts(0x310000, binary_data['text'])
+            flash.puts(0x300000, binary_data['actions'])
+            flash.puts(0x320000, binary_data['states'])
+            flash.write_hex_file(StringIO())
+        timed('write_hex', write_hex)
+
+    return build, timings
+
+def time_startup(directory, repeat):
+    # Returns the fastest of repeat runs of statemaker validating a tiny
+    #  statefile (which is nearly all startup), and of Python doing nothing,
+    #  in seconds.
+    path = os.path.join(directory, 'synthetic_startup.csv')
+    write_sheet(path, 20, states=1)
+    statemaker = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'statemaker.py')
+    def fastest(command):
+        best = None
+        with open(os.devnull, 'w') as devnull:
+            for i in range(repeat):
+                start = timeit.default_timer()
+                subprocess.call(command, stdout=devnull, stderr=devnull)
+                seconds = timeit.default_timer() - start
+                best = seconds if best is None else min(best, seconds)
+        return best
+    return (fastest([sys.executable, statemaker, '--statefile', path,
+                     '--no-warn-wrap']),
+            fastest([sys.executable, '-c', 'pass']))
+
+def parse_event_mix(text):
+    # e.g. TIMER=2,TIMER_R=1,USER_IN=4,NET=1
+    event_mix = dict()
+    for item in text.split(','):
+        input_type, weight = item.split('=')
+        event_mix[input_type.strip().upper()] = float(weight)
+    return event_mix
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark statemaker on synthetic statefiles.")
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help="Approximate number of rows in each statefile to"
+                             " benchmark (e.g. 1000 10000 100000 1000000).")
+    parser.add_argument('--rows-per-state', type=int, default=20,
+                        help="Average number of rows per state.")
+    parser.add_argument('--choice-width', type=int, default=2,
+                        help="Number of choices for each event.")
+    parser.add_argument('--extra-columns', type=int, default=2,
+                        help="Number of extra text choice columns after"
+                             " Result_detail.")
+    parser.add_argument('--event-mix', type=parse_event_mix,
+                        default=DEFAULT_EVENT_MIX,
+                        help="Relative weights of each event type, e.g."
+                             " TIMER=2,TIMER_R=1,USER_IN=4,NET=1")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Build each statefile this many times, and report"
+                             " the fastest time for each stage.")
+    parser.add_argument('--cull-nops', action='store_true',
+                        help="Also time cull_nops.")
+    parser.add_argument('--merge-actions', action='store_true',
+                        help="Also time merge_actions.")
+    parser.add_argument('--startup', action='store_true',
+                        help="Also time statemaker validating a tiny"
+                             " statefile from the command line, and fail if"
+                             " it takes longer than %d ms." % (
+                                 STARTUP_BUDGET * 1000))
+    parser.add_argument('--keep', type=str, default='',
+                        help="Directory to keep the generated statefiles in.")
+    parser.add_argument('--json', type=str, default='',
+                        help="Path to write the results to, as JSON.")
+
+    args = parser.parse_args()
+
+    directory = args.keep or tempfile.mkdtemp(prefix='qc15_bench')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    results = []
+    over_budget = False
+    try:
+        if args.startup:
+            startup, python = time_startup(directory, max(args.repeat, 5))
+            over_budget = startup > STARTUP_BUDGET
+            print("Startup: %d ms, of which %d ms is starting Python (budget"
+                  " %d ms%s)" % (startup * 1000, python * 1000,
+                                 STARTUP_BUDGET * 1000,
+                                 '; OVER' if over_budget else ''))
+            sys.stdout.flush()
+        for rows in args.rows:
+            path = os.path.join(directory, 'synthetic_%d.csv' % rows)
+            write_sheet(path, rows,
+                        states=max(1, rows // args.rows_per_state),
+                        choice_width=args.choice_width,
+                        extra_columns=args.extra_columns,
+                        event_mix=args.event_mix, seed=args.seed)
+
+            best = dict()
+            for i in range(args.repeat):
+                build, timings = time_build(path, args.cull_nops,
+                                            args.merge_actions)
+                for stage, seconds in timings.items():
+                    best[stage] = min(seconds, best.get(stage, seconds))
+
+            result = dict(rows=rows, states=len(build.all_states),
+                          actions=len(build.all_actions),
+                          text=len(build.main_text) + len(build.aux_text),
+                          locality=build.action_locality(),
+                          timings=best)
+            results.append(result)
+
+            print("%d rows: %d states, %d actions, %d text, %d%% of"
+                  " next actions contiguous" % (
+                rows, result['states'], result['actions'], result['text'],
+                100 * result['locality']
+            ))
+            for stage in STAGES:
+                if stage in best:
+                    print("  %-26s %10.4f s" % (stage, best[stage]))
+            print("  %-26s %10.4f s" % ('total', sum(best.values())))
+            if not fits_in_image(build):
+                print("  (Too many IDs for a 16-bit image; not packed.)")
+            sys.stdout.flush()
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump(results, outfile, indent=1, sort_keys=True)
+    if over_budget:
+        exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 """Tool to assemble statemaker output and ID numbers to a QC15 flash image."""
 
+from __future__ import print_function
+
 import math
 import argparse
 import os, os.path
+import multiprocessing
 
 import struct
 from intelhex import IntelHex
@@ -18,41 +21,186 @@ def put_bytes_at(ih, position, bts):
     for i in range(len(bts)):
         ih[position + i] = bts[i]
     return position + len(bts)
-            
-def main():
-    parser = argparse.ArgumentParser("Create the flash data for a queercon 15 badge.")
-    
-    parser.add_argument('-o', '--hexpath', action='store', type=str, default='a.bin', help='Output file path')
-    parser.add_argument('-b', '--badge-name', action='store', type=str, default='Skippy')
-    parser.add_argument('game_hex', type=str, action='store')
-    parser.add_argument('id', type=int, action='store')
-    
-    args = parser.parse_args()
-        
+
+def load_game_image(game_hex):
     flash = IntelHex()
 
-    flash.loadhex(args.game_hex)
-    
+    if game_hex.endswith('.hex'):
+        flash.loadhex(game_hex)
+    else:
+        flash.loadbin(game_hex)
+
     # The sentinel word:
     flash.puts(0, '\xab\xba')
-    
+
+    return flash
+
+def stamp_badge(flash, badge_id, badge_name):
     # OK. The badge will handle the main and backup confs.
     # All we need along those lines is to give it the ID.
-    flash.puts(0x010000, struct.pack('<H', args.id))
-    flash.puts(0x040000, struct.pack('<H', args.id))
-    
+    flash.puts(0x010000, struct.pack('<H', badge_id))
+    flash.puts(0x040000, struct.pack('<H', badge_id))
+
     # Badge name goes here:
-    # TODO: get it out of the badge file instead.
-    flash.puts(0x030000, struct.pack('11s', args.badge_name))
-    flash.puts(0x060000, struct.pack('11s', args.badge_name))
-    
-    # TODO: Add ALL the badge names, reading them from a file.
-    # flash.puts
-    
-    if args.hexpath.endswith('.hex'):
-        flash.write_hex_file(args.hexpath)
+    flash.puts(0x030000, struct.pack('11s', badge_name))
+    flash.puts(0x060000, struct.pack('11s', badge_name))
+
+def write_image(flash, path):
+    if path.endswith('.hex'):
+        flash.write_hex_file(path)
+    else:
+        flash.tobinfile(path)
+
+def dirty_sectors(flash, reference, sector_size):
+    # A sector has to be erased before any of it can be rewritten, and bytes
+    #  that an image leaves out are erased (0xFF) on the badge. So, compare
+    #  the two images with that in mind, and return the start address of every
+    #  sector that differs, in order.
+    new_bytes = flash.todict()
+    old_bytes = reference.todict()
+    new_bytes.pop('start_addr', None)
+    old_bytes.pop('start_addr', None)
+
+    dirty = set()
+    for addr in set(new_bytes) | set(old_bytes):
+        if new_bytes.get(addr, 0xFF) != old_bytes.get(addr, 0xFF):
+            dirty.add(addr - addr % sector_size)
+    return sorted(dirty)
+
+def sector_patch(flash, sectors, sector_size):
+    # A sparse image containing only the given sectors of flash.
+    patch = IntelHex()
+    for start in sectors:
+        patch.merge(flash[start:start+sector_size], overlap='replace')
+    return patch
+
+def read_badge_names(names_path):
+    # One name per line; the name on line N (0-origined) belongs to badge N.
+    with open(names_path) as names_file:
+        return [line.rstrip('\r\n') for line in names_file]
+
+def make_badge(flash, badge_id, badge_name, path, reference=None,
+               sector_size=None):
+    # Stamps flash (in place) and writes it out. If we have a reference image
+    #  of what's already on the badge, only the sectors that differ from it
+    #  are written. Returns the list of sectors written, or None for all.
+    stamp_badge(flash, badge_id, badge_name)
+    if reference is None:
+        write_image(flash, path)
+        return None
+
+    # The badge we're patching already has its own ID and name, so put those
+    #  into the reference too. That way they only count if they've moved.
+    old_flash = IntelHex(reference)
+    stamp_badge(old_flash, badge_id, badge_name)
+    sectors = dirty_sectors(flash, old_flash, sector_size)
+    write_image(sector_patch(flash, sectors, sector_size), path)
+    return sectors
+
+# The images shared by every badge in a batch. Each pool worker gets its
+#  own copy exactly once, when it starts up.
+game_image = None
+reference_image = None
+batch_sector_size = None
+
+def init_batch_worker(image, reference, sector_size):
+    global game_image, reference_image, batch_sector_size
+    game_image = image
+    reference_image = reference
+    batch_sector_size = sector_size
+
+def make_batch_badge(job):
+    badge_id, badge_name, path = job
+    # Copy the already-parsed game image, rather than loading it again.
+    flash = IntelHex(game_image)
+    sectors = make_badge(flash, badge_id, badge_name, path, reference_image,
+                         batch_sector_size)
+    return path, sectors
+
+def describe_sectors(sectors):
+    return '%d dirty sector(s): %s' % (
+        len(sectors), ' '.join('0x%06x' % start for start in sectors)
+    )
+
+def main():
+    parser = argparse.ArgumentParser("Create the flash data for a queercon 15 badge.")
+
+    parser.add_argument('-o', '--hexpath', action='store', type=str, default='a.bin', help='Output file path. In batch mode, this is a pattern that gets the badge ID, e.g. badge%%03d.hex')
+    parser.add_argument('-b', '--badge-name', action='store', type=str, default='Skippy')
+    parser.add_argument('-n', '--names', action='store', type=str, default='',
+                        help="File containing every badge's name, one per"
+                             " line, in badge ID order. Overrides"
+                             " --badge-name.")
+    parser.add_argument('--batch', action='store', type=int, nargs=2,
+                        metavar=('FIRST_ID', 'LAST_ID'),
+                        help="Make an image for every badge ID from FIRST_ID"
+                             " to LAST_ID, inclusive.")
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=None,
+                        help="Number of processes to use in batch mode."
+                             " Defaults to the number of CPUs.")
+    parser.add_argument('-r', '--reference', action='store', type=str,
+                        default='',
+                        help="Image (.hex or .bin) of the game already on the"
+                             " badges. Only the sectors that differ from it"
+                             " are written, as a sparse Intel HEX file.")
+    parser.add_argument('--sector-size', action='store', type=int,
+                        default=4096,
+                        help="Flash erase sector size, in bytes, for"
+                             " --reference.")
+    parser.add_argument('game_hex', type=str, action='store')
+    parser.add_argument('id', type=int, action='store', nargs='?')
+
+    args = parser.parse_args()
+
+    if args.batch is None and args.id is None:
+        parser.error("Either an id or --batch is required.")
+    if args.batch is not None and '%' not in args.hexpath:
+        parser.error("In batch mode, --hexpath must contain a %d for the badge ID.")
+    if args.reference and not args.hexpath.endswith('.hex'):
+        parser.error("With --reference, the output must be a .hex file.")
+
+    names = read_badge_names(args.names) if args.names else None
+
+    if args.batch is None:
+        badge_ids = [args.id]
     else:
-        flash.tobinfile(args.hexpath)
-    
+        badge_ids = range(args.batch[0], args.batch[1]+1)
+
+    jobs = []
+    for badge_id in badge_ids:
+        if names is None:
+            badge_name = args.badge_name
+        elif badge_id < len(names):
+            badge_name = names[badge_id]
+        else:
+            parser.error("No name for badge %d in %s" % (badge_id, args.names))
+        path = args.hexpath % badge_id if args.batch else args.hexpath
+        jobs.append((badge_id, badge_name, path))
+
+    flash = load_game_image(args.game_hex)
+    reference = None
+    if args.reference:
+        reference = load_game_image(args.reference)
+
+    if args.batch is None:
+        badge_id, badge_name, path = jobs[0]
+        sectors = make_badge(flash, badge_id, badge_name, path, reference,
+                             args.sector_size)
+        if sectors is not None:
+            print(describe_sectors(sectors))
+        return
+
+    pool = multiprocessing.Pool(args.jobs, init_batch_worker,
+                                (flash, reference, args.sector_size))
+    try:
+        for path, sectors in pool.imap_unordered(make_batch_badge, jobs):
+            if sectors is None:
+                print(path)
+            else:
+                print('%s: %s' % (path, describe_sectors(sectors)))
+    finally:
+        pool.close()
+        pool.join()
+
 if __name__ == "__main__":
     main()
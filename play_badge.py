@@ -0,0 +1,178 @@
+"""Tool to play a QC15 game image on the host, without a badge."""
+
+from __future__ import print_function
+
+import argparse
+import random
+import sys
+import timeit
+from collections import Counter
+
+from qc15_game.interpreter import GameImage, Badge, TICKS_PER_SECOND
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+def clock_str(ticks):
+    seconds = float(ticks) / TICKS_PER_SECOND
+    return '%d:%02d:%05.2f' % (seconds // 3600, seconds % 3600 // 60,
+                               seconds % 60)
+
+class Transcript(object):
+    # Listens to a badge, counting what it does, and maybe printing it.
+    def __init__(self, verbose):
+        self.verbose = verbose
+        self.state_visits = Counter()
+        self.text_frames = 0
+        self.others = Counter()
+
+    def __call__(self, badge, kind, detail):
+        if kind == 'enter':
+            self.state_visits[detail] += 1
+            detail = badge.image.state_name(detail)
+        elif kind == 'text':
+            self.text_frames += 1
+        elif kind == 'other':
+            self.others[detail] += 1
+        elif kind == 'close':
+            detail = badge.image.state_name(detail)
+        if self.verbose:
+            print('[%s] %-9s %s' % (clock_str(badge.clock), kind, detail))
+
+def play_randomly(badge, end, rng, think_min, think_max, net_rate):
+    # A player who, whenever the badge goes idle, waits a random while and
+    #  then picks a random input (starting over if the badge does something
+    #  in the meantime); and a world in which random NET events arrive
+    #  net_rate times an hour, on average.
+    net_types = sorted(badge.image.other_input_ids)
+    def next_net(now):
+        if not net_rate or not net_types:
+            return end + 1
+        return now + int(rng.expovariate(net_rate / 3600.0) * TICKS_PER_SECOND)
+
+    net_at = next_net(0)
+    choose_at = None
+    while badge.clock < end:
+        if badge.busy():
+            choose_at = None
+        elif choose_at is None and badge.available_inputs():
+            choose_at = badge.clock + rng.randint(think_min * TICKS_PER_SECOND,
+                                                  think_max * TICKS_PER_SECOND)
+        # Wake up for the badge's own next event too, so that the player
+        #  notices when it goes busy or idle.
+        wake_at = min(end, net_at)
+        for event_at in (choose_at, badge.next_event_time()):
+            if event_at is not None:
+                wake_at = min(wake_at, event_at)
+        badge.run_until(wake_at)
+        if badge.clock >= net_at:
+            badge.net_event(rng.choice(net_types))
+            net_at = next_net(badge.clock)
+        if choose_at is not None and badge.clock >= choose_at:
+            choose_at = None
+            inputs = badge.available_inputs()
+            if inputs:
+                badge.user_input(rng.choice(inputs)[0])
+
+def play_interactively(badge):
+    while True:
+        # Let the current action sequence (if any) play out.
+        while badge.busy():
+            badge.run_until(badge.next_event_time())
+        inputs = badge.available_inputs()
+        for index, text in inputs:
+            print('  %d. %s' % (index, text))
+        try:
+            line = raw_input('> ')
+        except NameError:
+            line = input('> ')
+        except EOFError:
+            return
+        command = line.strip().split(None, 1)
+        if not command:
+            # Wait for the next timer.
+            next_event = badge.next_event_time()
+            if next_event is None:
+                print("(Nothing will happen unless you do something.)")
+            else:
+                badge.run_until(next_event)
+        elif command[0] == 'q':
+            return
+        elif command[0] == 'n' and len(command) > 1:
+            if not badge.net_event(command[1]):
+                print("(Nothing handles %s here.)" % command[1].upper())
+        elif command[0] == 'w' and len(command) > 1:
+            badge.advance(int(float(command[1]) * TICKS_PER_SECOND))
+        elif command[0].isdigit() and badge.user_input(int(command[0])):
+            pass
+        else:
+            print("Enter an input's number, 'n NAME' for a NET event,"
+                  " 'w SECONDS' to wait, a blank line to wait for the next"
+                  " timer, or 'q' to quit.")
+
+def main():
+    parser = argparse.ArgumentParser("Play a queercon 15 game image on the host.")
+    parser.add_argument('game_image', type=str,
+                        help="The .hex or .bin file made by statemaker.")
+    parser.add_argument('header', type=str,
+                        help="The C header made by statemaker for the same"
+                             " build (-c).")
+    parser.add_argument('--text-loc', action='store', type=int, default=0x310000)
+    parser.add_argument('--state-loc', action='store', type=int, default=0x320000)
+    parser.add_argument('--action-loc', action='store', type=int, default=0x300000)
+    parser.add_argument('--choice-loc', action='store', type=int, default=0x330000,
+                        help="Where the choice table region is, if the image"
+                             " was built with --choice-table.")
+    parser.add_argument('-i', '--interactive', action='store_true',
+                        help="Play by hand, instead of randomly.")
+    parser.add_argument('--hours', type=float, default=8,
+                        help="Hours of badge time to play for.")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--think-min', type=int, default=2,
+                        help="Fewest seconds the random player waits before"
+                             " choosing an input.")
+    parser.add_argument('--think-max', type=int, default=60,
+                        help="Most seconds the random player waits before"
+                             " choosing an input.")
+    parser.add_argument('--net-rate', type=float, default=30,
+                        help="Average number of random NET events per hour.")
+    parser.add_argument('-b', '--badge-name', type=str, default='Skippy')
+    parser.add_argument('-u', '--user-name', type=str, default='human')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Print everything the badge does.")
+
+    args = parser.parse_args()
+
+    image = GameImage.load(args.game_image, args.header, args.text_loc,
+                           args.action_loc, args.state_loc, args.choice_loc)
+    transcript = Transcript(args.verbose or args.interactive)
+    badge = Badge(image, seed=args.seed, badge_name=args.badge_name,
+                  user_name=args.user_name, listener=transcript)
+
+    if args.interactive:
+        play_interactively(badge)
+        return
+
+    start = timeit.default_timer()
+    end = int(args.hours * 3600 * TICKS_PER_SECOND)
+    play_randomly(badge, end, random.Random(args.seed), args.think_min,
+                  args.think_max, args.net_rate)
+    elapsed = timeit.default_timer() - start
+
+    print("Played %s of badge time in %.2f s (%dx real time)." % (
+        clock_str(badge.clock), elapsed,
+        badge.clock / TICKS_PER_SECOND / max(elapsed, 1e-6)
+    ), file=sys.stderr)
+    print("%d text frames shown. State visits:" % transcript.text_frames,
+          file=sys.stderr)
+    for state_id, visits in transcript.state_visits.most_common():
+        print("  %6d %s" % (visits, image.state_name(state_id)),
+              file=sys.stderr)
+    closed = sorted(image.state_name(state) for state in badge.closed_states)
+    if closed:
+        print("Closed states: %s" % ', '.join(closed), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -40,4 +40,9 @@ ALLOWED_VARIABLES = {
 
 NULL = 0xFFFF
 
-warn_on_wrap = True
+# The badge's clock ticks, which all durations are packed in.
+TICKS_PER_SECOND = 32
+
+CHOICE_TABLE_TYPES = ['alias', 'cumulative']
+TEXT_FORMATS = ['fixed', 'pooled']
+STATE_FORMATS = ['fixed', 'indexed']
@@ -0,0 +1,102 @@
+"""An on-disk cache of statemaker outputs, for QC15's Statemaker tool.
+
+A build is identified by a hash of everything that can change its outputs:
+the contents of the statefile, the options that affect the outputs, and the
+source code of statemaker itself. If we've already done a build with the
+same hash, its outputs can be copied straight out of the cache.
+"""
+
+from __future__ import print_function
+
+import os
+import glob
+import shutil
+import hashlib
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+def source_files():
+    # All of statemaker's own code, so that changing it invalidates the cache.
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    sources = sorted(glob.glob(os.path.join(package_dir, '*.py')))
+    sources.append(os.path.join(os.path.dirname(package_dir), 'statemaker.py'))
+    return sources
+
+class BuildCache(object):
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(input_files, options):
+        # input_files is a list of paths (missing ones are allowed, e.g. an
+        #  ID map that hasn't been created yet). options is a dict of every
+        #  setting that can affect the outputs.
+        digest = hashlib.sha256()
+        for path in list(input_files) + source_files():
+            digest.update(path.encode('utf-8') + b'\0')
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+            digest.update(b'\0')
+        for name in sorted(options):
+            digest.update(('%s=%r\0' % (name, options[name])).encode('utf-8'))
+        return digest.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def fetch(self, key, artifacts):
+        # Returns {artifact: contents} if every one of the artifacts is
+        #  cached for this key, or None if any of them aren't.
+        entry = self.entry_dir(key)
+        contents = dict()
+        for artifact in artifacts:
+            path = os.path.join(entry, artifact)
+            if not os.path.isfile(path):
+                return None
+            with open(path, 'rb') as f:
+                contents[artifact] = f.read()
+        # Mark this entry as recently used, for eviction.
+        os.utime(entry, None)
+        return contents
+
+    def store(self, key, contents):
+        # contents is {artifact: contents}. Artifacts are written to a
+        #  temporary name first, so that a concurrent fetch() never sees a
+        #  partial file.
+        entry = self.entry_dir(key)
+        if not os.path.isdir(entry):
+            os.makedirs(entry)
+        for artifact, data in contents.items():
+            path = os.path.join(entry, artifact)
+            temp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.rename(temp_path, path)
+        os.utime(entry, None)
+        self.evict()
+
+    def evict(self):
+        # Throw out the least recently used entries until we're under
+        #  max_bytes.
+        entries = []
+        total = 0
+        for key in os.listdir(self.directory):
+            entry = self.entry_dir(key)
+            if not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, name))
+                       for name in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+            total += size
+        entries.sort()
+        while total > self.max_bytes and entries:
+            mtime, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
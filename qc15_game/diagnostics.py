@@ -0,0 +1,182 @@
+"""Error and warning collection for QC15's Statemaker tool.
+
+Rather than stopping at the first mistake in a statefile, a build records
+every error and warning that it finds in a Diagnostics, keeps checking as
+much of the statefile as it safely can, and then reports them all at once,
+either as text or as JSON.
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+from collections import namedtuple
+from contextlib import contextmanager
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+class GameBuildError(Exception):
+    """Raised when a statefile has a FATAL error and can't be compiled."""
+    pass
+
+# errtype is 'FATAL' or 'WARNING'. row is the line number in the statefile
+#  (0 if it's about the whole thing), and col is the offset of the problem in
+#  that line, or None to work it out from badtext (if given).
+Diagnostic = namedtuple('Diagnostic', ['errtype', 'row', 'col', 'badtext',
+                                       'message'])
+
+def cell_positions(line):
+    # Splits one line of CSV into its cells, the same way the csv module
+    #  does, and returns [(cell, positions)], where positions[i] is the
+    #  offset in line of the cell's i-th character.
+    cells = []
+    cell = []
+    positions = []
+    quoted = False
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if quoted:
+            if c == '"' and line[i+1:i+2] == '"':
+                # An escaped quote.
+                cell.append(c)
+                positions.append(i)
+                i += 1
+            elif c == '"':
+                quoted = False
+            else:
+                cell.append(c)
+                positions.append(i)
+        elif c == '"' and not cell:
+            quoted = True
+        elif c == ',':
+            cells.append((''.join(cell), positions))
+            cell = []
+            positions = []
+        else:
+            cell.append(c)
+            positions.append(i)
+        i += 1
+    cells.append((''.join(cell), positions))
+    return cells
+
+def find_column(line, badtext):
+    # The offset in line of the first cell that is badtext, or else the first
+    #  one that contains it, or None.
+    badtext = badtext.upper()
+    cells = cell_positions(line)
+    for cell, positions in cells:
+        if cell.upper() == badtext:
+            return positions[0] if positions else 0
+    for cell, positions in cells:
+        index = cell.upper().find(badtext)
+        if index >= 0:
+            return positions[index] if positions else 0
+    return None
+
+class Diagnostics(object):
+    """Every error and warning from a build, without duplicates.
+
+    source_lines is called with a list of line numbers, and returns a dict
+    of line number -> the text of that line, which is used to show where
+    each problem is.
+    """
+    def __init__(self, statefile, source_lines):
+        self.statefile = statefile
+        self.source_lines = source_lines
+        self.clear()
+
+    def clear(self):
+        self.diagnostics = []
+        self.counts = dict() # Diagnostic -> number of times it was recorded
+        self.fatal_count = 0
+
+    def add(self, errtype, row, col, badtext, message):
+        diagnostic = Diagnostic(errtype, row, col, badtext, message)
+        if diagnostic in self.counts:
+            self.counts[diagnostic] += 1
+            return
+        self.counts[diagnostic] = 1
+        self.diagnostics.append(diagnostic)
+        if errtype != 'WARNING':
+            self.fatal_count += 1
+
+    @property
+    def warning_count(self):
+        return len(self.diagnostics) - self.fatal_count
+
+    @contextmanager
+    def recover(self):
+        """Carry on after a FATAL error in the with block, which has already
+        been recorded, so that we can find any more. Anything else that goes
+        wrong after there's been a FATAL error is most likely fallout from
+        it, so that's skipped too."""
+        try:
+            yield
+        except GameBuildError:
+            pass
+        except Exception:
+            if not self.fatal_count:
+                raise
+
+    def check(self):
+        """Raise GameBuildError if there have been any FATAL errors."""
+        if self.fatal_count:
+            raise GameBuildError("%d errors in %s" % (self.fatal_count,
+                                                      self.statefile))
+
+    def located(self):
+        # [(Diagnostic, source line, column)] in the order of the statefile,
+        #  with the ones about the whole thing last, fetching all of the lines
+        #  in one go.
+        lines = self.source_lines(sorted(set(
+            diagnostic.row for diagnostic in self.diagnostics if diagnostic.row
+        )))
+        located = []
+        for diagnostic in sorted(self.diagnostics, key=lambda diagnostic: (
+                not diagnostic.row, diagnostic.row)):
+            line = lines.get(diagnostic.row, '') if diagnostic.row else ''
+            col = diagnostic.col
+            if col is None and diagnostic.badtext != '' and line:
+                col = find_column(line, diagnostic.badtext)
+            located.append((diagnostic, line, col))
+        return located
+
+    def print_report(self, outfile=sys.stderr):
+        for diagnostic, line, col in self.located():
+            print("%s: %s:%d:" % (diagnostic.errtype, self.statefile,
+                                  diagnostic.row), file=outfile)
+            if diagnostic.row:
+                print(line, file=outfile)
+                if col is not None:
+                    print(' ' * col + '^', file=outfile)
+            print('   ' + diagnostic.message, file=outfile)
+            print(file=outfile)
+        if self.diagnostics:
+            print("%d errors, %d warnings." % (self.fatal_count,
+                                               self.warning_count),
+                  file=outfile)
+
+    def as_json(self):
+        """Everything, as a dict that can be dumped as JSON. Columns are
+        0-origined, and lines 1-origined (with null for the whole file)."""
+        return dict(
+            statefile=self.statefile,
+            errors=self.fatal_count,
+            warnings=self.warning_count,
+            diagnostics=[dict(
+                severity=diagnostic.errtype,
+                line=diagnostic.row or None,
+                column=col,
+                source=line or None,
+                message=diagnostic.message,
+                count=self.counts[diagnostic],
+            ) for diagnostic, line, col in self.located()],
+        )
+
+    def write_json(self, path):
+        with open(path, 'w') as outfile:
+            json.dump(self.as_json(), outfile, indent=1, sort_keys=True)
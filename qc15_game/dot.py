@@ -0,0 +1,60 @@
+"""GraphViz dot output for QC15's Statemaker tool.
+
+The state and action graphs are written straight out of a GameBuild, one
+line at a time, without building a graph object first. Nodes are named by
+their integer IDs (s<state ID> and a<action ID>), and labelled the same way
+that they always have been.
+"""
+
+from __future__ import print_function
+
+from qc15_game.game_state import GameState, escape_action
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+def quote(text):
+    return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
+
+def node_name(node):
+    if isinstance(node, GameState):
+        return 's%d' % node.id
+    return 'a%d' % node.id()
+
+def write_edge(outfile, source, target, label):
+    if label is None:
+        outfile.write('%s -> %s;\n' % (node_name(source), node_name(target)))
+    else:
+        outfile.write('%s -> %s [label=%s];\n' % (
+            node_name(source), node_name(target), quote(label)
+        ))
+
+def write_state_dot(build, outfile):
+    """Write the state graph (see GameBuild.state_edges()) to outfile."""
+    outfile.write('digraph states {\n')
+    for state in build.state_table:
+        if state is not None:
+            outfile.write('%s [label=%s];\n' % (node_name(state),
+                                                quote(str(state))))
+    for source, target, label in build.state_edges():
+        write_edge(outfile, source, target, label)
+    outfile.write('}\n')
+
+def write_action_dot(build, outfile):
+    """Write the action graph (see GameBuild.action_edges()) to outfile."""
+    outfile.write('digraph actions {\n')
+    for state in build.state_table:
+        if state is not None:
+            outfile.write('%s [label=%s, shape=%s];\n' % (
+                node_name(state), quote(str(state)),
+                'star' if state.id == 0 else 'box'
+            ))
+    for action in build.action_table:
+        if action is not None:
+            outfile.write('%s [label=%s];\n' % (node_name(action),
+                                                quote(escape_action(action))))
+    for source, target, label in build.action_edges():
+        write_edge(outfile, source, target, label)
+    outfile.write('}\n')
@@ -7,38 +7,20 @@ import sys
 import csv
 import textwrap
 import struct
-
-import networkx as nx
-from chardet.universaldetector import UniversalDetector
+from collections import namedtuple
 
 from qc15_game import *
+from qc15_game.diagnostics import Diagnostics, GameBuildError
+from qc15_game.graph import StateGraph
 
 __author__ = "George Louthan @duplico"
 __copyright__ = "(c) 2018, George Louthan"
 __license__ = "MIT"
 __email__ = "duplico@dupli.co"
 
-all_actions = []
-main_actions = []
-aux_actions = []
-all_states = []
-main_text = [] # Lives in FRAM
-aux_text = [] # Lives in flash
-
-def text_addr(text):
-    if text in main_text:
-        return main_text.index(text)
-    else:
-        return len(main_text) + aux_text.index(text)
-
-state_name_ids = dict()
-closable_states = set()
-
-max_inputs = 0
-max_timers = 0
-max_others = 0
-
-all_other_input_descs = [
+# The built-in OTHER inputs, outputs, and animations. Each GameBuild starts
+#  with its own copy of these, and appends any new ones that the statefile uses.
+DEFAULT_OTHER_INPUT_DESCS = [
     'BADGESNEARBY0',
     'BADGESNEARBYSOME',
     'NAME_NOT_FOUND',
@@ -48,7 +30,7 @@ all_other_input_descs = [
     'CONNECT_FAILURE'
 ]
 
-all_other_output_descs = [
+DEFAULT_OTHER_OUTPUT_DESCS = [
     'CUSTOMSTATEUSERNAME', # User name entry
     'NAMESEARCH',
     'SET_CONNECTABLE',
@@ -56,7 +38,7 @@ all_other_output_descs = [
     'STATUS_MENU',
 ]
 
-all_animations = [
+DEFAULT_ANIMATIONS = [
     'flag_rainbow',
     'flag_bi',
     'flag_pan',
@@ -94,15 +76,23 @@ all_animations = [
     'animSolidWhite'
 ]
 
-row_number = 0
-row_lines = []
-statefile = ''
+# One row of the statefile. extra_details holds the contents of the unnamed
+#  columns to the right of Result_detail (alternative TEXT choices).
+StateRow = namedtuple('StateRow', ['line', 'input_type', 'input_detail',
+                                   'choice_share', 'result_duration',
+                                   'result_type', 'result_detail',
+                                   'extra_details'])
 
 class GameTimer(object):
-    def __init__(self, duration, recurring, result):
+    record = struct.Struct('<LBxH')
+    
+    def __init__(self, duration, recurring, result, row=0, detail=''):
         self.duration = duration
         self.recurring = recurring
         self.result = result
+        # Where the timer's event is in the statefile, for warnings.
+        self.row = row
+        self.detail = detail
         
     def sort_key(self):
         # We want all one-time timers to go before recurring,
@@ -114,6 +104,7 @@ class GameTimer(object):
         if not self.recurring:
             # Remember, key is negative.
             key = key * 1000000
+        return key
 
     def pack(self):
         """
@@ -125,10 +116,13 @@ class GameTimer(object):
             uint16_t result_action_id;
         } game_timer_t;
         """
-        return struct.pack(
-            '<LBxH',
-            *self.as_int_sequence()
-        )
+        packed = bytearray(GameTimer.record.size)
+        self.pack_into(packed, 0)
+        return bytes(packed)
+    
+    def pack_into(self, buf, offset):
+        GameTimer.record.pack_into(buf, offset, *self.as_int_sequence())
+        return offset + GameTimer.record.size
             
     def as_int_sequence(self):
         return (
@@ -149,16 +143,16 @@ class GameTimer(object):
         return str(self)
 
 class GameInput(object):
-    def __init__(self, text, result):
+    record = struct.Struct('<HH')
+    
+    def __init__(self, build, state_name, text, result):
+        self.build = build
         if len(text) > 23:
-            error(statefile, "Input text too long.", badtext=text)
+            build.error("Input text too long.", badtext=text)
         if '$' in text:
-            error(statefile, "Variables not allowed in inputs, treating as literal.",
-                  errtype="WARNING")
-        if text not in main_text:
-            main_text.append(text)
-            if text in aux_text:
-                aux_text.remove(text)
+            build.error("Variables not allowed in inputs, treating as literal.",
+                        errtype="WARNING")
+        build.register(state_name, 'input', text)
         self.result = result
         self.text = text
     
@@ -169,14 +163,17 @@ class GameInput(object):
             uint16_t result_action_id;
         } game_user_in_t;
         """
-        return struct.pack(
-            '<HH',
-            *self.as_int_sequence()
-        )
+        packed = bytearray(GameInput.record.size)
+        self.pack_into(packed, 0)
+        return bytes(packed)
+    
+    def pack_into(self, buf, offset):
+        GameInput.record.pack_into(buf, offset, *self.as_int_sequence())
+        return offset + GameInput.record.size
             
     def as_int_sequence(self):
         return (
-            text_addr(self.text),
+            self.build.text_addr(self.text),
             self.result.id()
         )
             
@@ -187,14 +184,13 @@ class GameInput(object):
         return struct_text
         
 class GameOther(object):
-    def __init__(self, desc, result):
+    record = struct.Struct('<HH')
+    
+    def __init__(self, build, state_name, desc, result):
         self.result = result
         self.desc = desc.upper()
-        if self.desc in all_other_input_descs:
-            self.id = all_other_input_descs.index(self.desc)
-        else:
-            self.id = len(all_other_input_descs)
-            all_other_input_descs.append(self.desc)
+        build.register(state_name, 'other_input', self.desc)
+        self.id = build.all_other_input_descs.index(self.desc)
     
     def pack(self):
         """
@@ -203,14 +199,17 @@ class GameOther(object):
             uint16_t result_action_id;
         } game_other_in_t;
         """
-        return struct.pack(
-            '<HH',
-            *self.as_int_sequence()
-        )
+        packed = bytearray(GameOther.record.size)
+        self.pack_into(packed, 0)
+        return bytes(packed)
+    
+    def pack_into(self, buf, offset):
+        GameOther.record.pack_into(buf, offset, *self.as_int_sequence())
+        return offset + GameOther.record.size
             
     def as_int_sequence(self):
         return (
-            all_other_input_descs.index(self.desc),
+            self.id,
             self.result.id()
         )
             
@@ -221,23 +220,25 @@ class GameOther(object):
         return struct_text
         
 class GameAction(object):
-    max_extra_details = 0
+    record = struct.Struct('<HHHHHHH')
     
-    def __init__(self, input_tuple, state_name, prev_action, prev_choice,
+    def __init__(self, build, input_tuple, state_name, prev_action, prev_choice,
                  action_type=None, detail=None, 
                  duration=0, choice_share=1, row=None, aux=False):
         if row:
-            action_type = row['Result_type']
-            detail = row['Result_detail']
+            action_type = row.result_type
+            detail = row.result_detail
             # TODO: default duration per result type
-            duration = float(row['Result_duration']) if row['Result_duration'] else 0.0
-            choice_share = int(row['Choice_share']) if row['Choice_share'] else 1
+            duration = float(row.result_duration) if row.result_duration else 0.0
+            choice_share = int(row.choice_share) if row.choice_share else 1
             
-        all_actions.append(self)
+        self.build = build
+        self.aux = aux
+        build.all_actions.append(self)
         if (aux):
-            aux_actions.append(self)
+            build.aux_actions.append(self)
         else:
-            main_actions.append(self)
+            build.main_actions.append(self)
         self.action_type = action_type
         self.state_name = state_name
         self.detail = detail
@@ -256,16 +257,12 @@ class GameAction(object):
         # If we're text, we need to load the text into the master text list:        
         if self.action_type.startswith("TEXT"):
             self.detail = self.detail.replace('`', '\x96')
-            if aux and self.detail not in aux_text and self.detail not in main_text:
-                    aux_text.append(self.detail)
-            elif self.detail not in main_text:
-                main_text.append(self.detail)
+            build.register(state_name, 'aux' if aux else 'main', self.detail)
             
         if self.action_type == 'OTHER':
             self.detail = self.detail.upper().replace(' ', '_')
             self.detail = self.detail.replace('.', '')
-            if self.detail not in all_other_output_descs:
-                all_other_output_descs.append(self.detail)
+            build.register(state_name, 'other_output', self.detail)
             
         if self.action_type in ('PREVIOUS', 'PUSH', 'POP'):
             # Detail and duration are ignored.
@@ -277,26 +274,26 @@ class GameAction(object):
             pass
             
         if self.action_type.startswith("SET_ANIM"):
-            global all_animations
             if self.detail.upper().strip() == 'NONE':
                 self.detail = None
-            elif self.detail not in all_animations:
-                all_animations.append(self.detail)
+            else:
+                build.register(state_name, 'animation', self.detail)
             
         if self.action_type == 'STATE_TRANSITION':
             self.detail = self.detail.upper()
-            if self.detail not in state_name_ids:
+            if self.detail not in build.state_name_ids:
                 # ERROR! Unless we're allowing implicit state declaration.
-                if GameState.allow_implicit:
+                if build.allow_implicit:
                     # Create a new game state for this transition.
-                    error(statefile, "Implicitly creating undefined state '%s'" % self.detail, badtext=self.detail, errtype='WARNING')
-                    new_state = GameState(self.detail)
+                    build.error("Implicitly creating undefined state '%s'" % self.detail, badtext=self.detail, errtype='WARNING')
+                    new_state = GameState(build, self.detail)
                     
                     # The state will display its name (truncated to 24 chars),
                     #  then return to the current state (the one that called it)
                     # TODO: use pop instead
                     
                     new_state_first_action = GameAction(
+                        build,
                         ('ENTER', ''),
                         self.detail[:24], 
                         None, 
@@ -307,6 +304,7 @@ class GameAction(object):
                     )
                     new_state.insert_event(('ENTER', ''), new_state_first_action)
                     GameAction(
+                        build,
                         ('ENTER', ''),
                         self.detail[:24], 
                         new_state_first_action, 
@@ -316,8 +314,8 @@ class GameAction(object):
                     )
                 else:
                     # ERROR.                    
-                    error(statefile, "Transition to undefined state '%s'" % self.detail, badtext=self.detail)
-            self.detail = all_states[state_name_ids[self.detail]]
+                    build.error("Transition to undefined state '%s'" % self.detail, badtext=self.detail)
+            self.detail = build.all_states[build.state_name_ids[self.detail]]
         
         # Finally, handle wiring up our linked-list structure:
         
@@ -343,7 +341,9 @@ class GameAction(object):
             self.prev_action.next_action = self
             
     def id(self):
-        return all_actions.index(self)
+        # Assigned by assign_ids(), after all actions have been created and
+        #  any NOPs have been culled.
+        return self.action_id
     
     def get_previous_action(self):
         if self.prev_action:
@@ -367,9 +367,9 @@ class GameAction(object):
         return last_choice.prev_action
         
     @staticmethod
-    def create_from_row(input_tuple, state, prev_action, prev_choice, row):        
-        if row['Result_type'] != 'TEXT':
-            action =  GameAction(input_tuple, state.name, prev_action, 
+    def create_from_row(build, input_tuple, state, prev_action, prev_choice, row):        
+        if row.result_type != 'TEXT':
+            action =  GameAction(build, input_tuple, state.name, prev_action, 
                                  prev_choice, row=row)
             if input_tuple not in state.events:
                 state.insert_event(input_tuple, action)
@@ -377,17 +377,18 @@ class GameAction(object):
         # If we've gotten to this point, that means ... drumroll...
         # We're dealing with a TEXT row!
         
-        duration = float(row['Result_duration']) if row['Result_duration'] else None
-        choice_share = int(row['Choice_share']) if row['Choice_share'] else 1
+        duration = float(row.result_duration) if row.result_duration else None
+        choice_share = int(row.choice_share) if row.choice_share else 1
         
         # This means there's a couple of extra things we need to do.
         # We definitely need to generate the first action series. 
         first_action, last_action = GameAction.create_text_action_seq(
+            build,
             input_tuple, 
             state.name, 
             prev_action, 
             prev_choice, 
-            row['Result_detail'],
+            row.result_detail,
             duration,
             choice_share,
             aux=False
@@ -402,7 +403,7 @@ class GameAction(object):
             if input_tuple not in state.events:
                 state.insert_event(input_tuple, first_action)
         
-        if (0 not in row) or (not row[0]):
+        if not row.extra_details or not row.extra_details[0]:
             # If this is the only column, we're done. Time to return
             #  last_action, which is what additional actions will need to
             #  link to.
@@ -419,17 +420,18 @@ class GameAction(object):
         #  it, as needed.
         choices_generated = [(first_action, last_action)]
                 
-        for i in range(GameAction.max_extra_details):
-            if not row[i]:
+        for i, extra_detail in enumerate(row.extra_details):
+            if not extra_detail:
                 break
             # i = index of previous choice in choices_generated
             # Each choice should link its first action to the previous choice
             f, l = GameAction.create_text_action_seq(
+                build,
                 input_tuple, 
                 state.name, 
                 None, # Previous action is reached through the choice set.
                 choices_generated[i][0], # Wire the first actions together.
-                row[i],
+                extra_detail,
                 duration,
                 choice_share,
                 aux=True
@@ -445,7 +447,7 @@ class GameAction(object):
         # We leave the prev_action (which this will have as a stand-in) out of
         #  the constructor, because we don't want to trigger the automatic
         #  linking logic.
-        nop_aggregator = GameAction(input_tuple, state.name, None, None,
+        nop_aggregator = GameAction(build, input_tuple, state.name, None, None,
                                     action_type='NOP', detail='', duration=0,
                                     choice_share=1)
         # Link it to the LAST one, so that our assertion in the
@@ -461,7 +463,7 @@ class GameAction(object):
         return nop_aggregator
         
     @staticmethod
-    def create_text_action_seq(input_tuple, state_name, prev_action,
+    def create_text_action_seq(build, input_tuple, state_name, prev_action,
                                prev_choice, detail, duration, choice_share,
                                aux=False):
         first_action = None
@@ -471,16 +473,16 @@ class GameAction(object):
             text_frames.append(' ')
 
         if input_tuple[0] == 'TIMER_R' and len(text_frames) > 1:
-            error(statefile, "Text wrap in recurring timer at marker, which causes unsatisfactory behavior.",
-                  badtext=text_frames[1], errtype="WARNING")
+            build.error("Text wrap in recurring timer at marker, which causes unsatisfactory behavior.",
+                        badtext=text_frames[1], errtype="WARNING")
 
         for frame in text_frames:
             action_type = 'TEXT'
             frame_text = frame
             
-            if warn_on_wrap and len(text_frames) > 1 and frame_text.count(' ') == 0:
-                error(statefile, "Detected single-word wrap. Consider revising.",
-                      badtext=frame_text, errtype="WARNING")
+            if build.warn_on_wrap and len(text_frames) > 1 and frame_text.count(' ') == 0:
+                build.error("Detected single-word wrap. Consider revising.",
+                            badtext=frame_text, errtype="WARNING")
 
             frame_dur = duration
             if frame_dur is None:
@@ -491,7 +493,7 @@ class GameAction(object):
             
             variable_count = sum(frame_text.count('$%s' % variable) for variable in ALLOWED_VARIABLES)
             if variable_count > 1:
-                error(statefile, "Only one variable allowed in TEXT frame '%s'." % frame_text)
+                build.error("Only one variable allowed in TEXT frame '%s'." % frame_text)
             
             for variable in ALLOWED_VARIABLES:
                 fullvar = '$%s'%variable
@@ -502,10 +504,10 @@ class GameAction(object):
                     
             if '$' in frame and variable_count == 0:
                 fakevar = frame.split('$')[1].split()[0].split(',')[0].strip()
-                error(statefile, "Unrecognized variable '$%s', interpreting as literal." % fakevar,
-                      badtext=fakevar, errtype="WARNING")
+                build.error("Unrecognized variable '$%s', interpreting as literal." % fakevar,
+                            badtext=fakevar, errtype="WARNING")
             
-            new_action = GameAction(input_tuple, state_name, prev_action,
+            new_action = GameAction(build, input_tuple, state_name, prev_action,
                                     prev_choice, action_type=action_type,
                                     detail=frame_text, duration=frame_dur,
                                     choice_share=choice_share, aux=aux)
@@ -552,20 +554,23 @@ class GameAction(object):
             uint16_t choice_total;
         } game_action_t;
         """
-        return struct.pack(
-            '<HHHHHHH',
-            *self.as_int_sequence()
-        )
+        packed = bytearray(GameAction.record.size)
+        self.pack_into(packed, 0)
+        return bytes(packed)
+    
+    def pack_into(self, buf, offset):
+        GameAction.record.pack_into(buf, offset, *self.as_int_sequence())
+        return offset + GameAction.record.size
     
     def detail_addr(self):
         if self.action_type.startswith('TEXT'):
-            detail_addr = text_addr(self.detail)
+            detail_addr = self.build.text_addr(self.detail)
         elif self.action_type.startswith('SET_ANIM'):
-            detail_addr = all_animations.index(self.detail) if self.detail else NULL
+            detail_addr = self.build.animation_ids[self.detail] if self.detail else NULL
         elif self.action_type == 'STATE_TRANSITION':
-            detail_addr = all_states.index(self.detail)
+            detail_addr = self.detail.id
         elif self.action_type == 'OTHER':
-            detail_addr = all_other_output_descs.index(self.detail.upper())
+            detail_addr = self.build.other_output_ids[self.detail.upper()]
         else:
             # TODO: OTHER TYPES
             # TODO: PUSH
@@ -589,53 +594,175 @@ class GameAction(object):
         struct_text = "(game_action_t){%d, %d, %d, %d, %d, %d, %d}" % self.as_int_sequence()
         return struct_text
         
+class GameChoiceSet(object):
+    """A whole choice set, as a table that the badge can pick from directly.
+    
+    The linked layout makes the badge walk the next_choice list to make a
+    weighted choice. These tables let it pick with a single random number
+    instead. The table is one of:
+    
+    'alias': a Walker alias table. Draw r in [0, count * total); the bucket
+             is i = r / total; choose action_id[i] if r % total < threshold[i],
+             and alias_id[i] otherwise.
+    'cumulative': running totals of the choice shares. Draw r in [0, total),
+                  and choose the first entry whose threshold is greater than r.
+    """
+    header = struct.Struct('<BxH')
+    records = dict(alias=struct.Struct('<HHH'),
+                   cumulative=struct.Struct('<HH'))
+    
+    def __init__(self, first_action):
+        self.members = []
+        action = first_action
+        while action:
+            self.members.append(action)
+            action = action.next_choice
+        self.total = first_action.choice_total
+    
+    def alias_table(self):
+        # [(threshold, action, alias action)], by Vose's method, in integers
+        #  so that every choice gets exactly its share: each bucket holds
+        #  total, and every share is scaled up by the number of buckets.
+        count = len(self.members)
+        scaled = [action.choice_share * count for action in self.members]
+        thresholds = [self.total] * count
+        aliases = list(range(count))
+        small = [i for i in range(count) if scaled[i] < self.total]
+        large = [i for i in range(count) if scaled[i] >= self.total]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            thresholds[less] = scaled[less]
+            aliases[less] = more
+            scaled[more] -= self.total - scaled[less]
+            if scaled[more] < self.total:
+                small.append(more)
+            else:
+                large.append(more)
+        return [(thresholds[i], self.members[i], self.members[aliases[i]])
+                for i in range(count)]
+    
+    def cumulative_table(self):
+        # [(threshold, action)]
+        table = []
+        threshold = 0
+        for action in self.members:
+            threshold += action.choice_share
+            table.append((threshold, action))
+        return table
+    
+    def packed_len(self, table_type):
+        return GameChoiceSet.header.size + \
+               len(self.members) * GameChoiceSet.records[table_type].size
+    
+    def pack_into(self, buf, offset, table_type):
+        """
+        typedef struct {
+            /// The number of choices in this choice set.
+            uint8_t count;
+            /// The total choice shares of all choices in this choice set.
+            uint16_t choice_total;
+            /// Followed by count of these, for CHOICE_TABLE_ALIAS:
+            // struct {
+            //     uint16_t threshold;
+            //     uint16_t action_id;
+            //     uint16_t alias_action_id;
+            // }
+            /// or count of these, for CHOICE_TABLE_CUMULATIVE:
+            // struct {
+            //     uint16_t threshold;
+            //     uint16_t action_id;
+            // }
+        } game_choice_set_t;
+        """
+        GameChoiceSet.header.pack_into(buf, offset, len(self.members),
+                                       self.total)
+        offset += GameChoiceSet.header.size
+        record = GameChoiceSet.records[table_type]
+        if table_type == 'alias':
+            entries = [(threshold, action.id(), alias.id()) for
+                       threshold, action, alias in self.alias_table()]
+        else:
+            entries = [(threshold, action.id()) for
+                       threshold, action in self.cumulative_table()]
+        for entry in entries:
+            record.pack_into(buf, offset, *entry)
+            offset += record.size
+        return offset
+
 class GameState(object):
-    next_id = 0
-    allow_implicit = False
-    def __init__(self, name):
+    header = struct.Struct('<HBBBx')
+    def __init__(self, build, name):
+        self.build = build
         self.events = dict()
         self.name = name
-        self.id = GameState.next_id
-        GameState.next_id += 1
+        self.id = len(build.all_states)
         
-        all_states.append(self)
-        state_name_ids[self.name] = self.id
+        build.all_states.append(self)
+        build.state_name_ids[self.name] = self.id
         
         self.entry_sequence_start = None
+        self.entry_row = 0
+        self.timers = []
+        self.inputs = []
+        self.other_ins = []
+    
+    def reset(self):
+        # Forget all of our events, so that they can be read in again.
+        self.events = dict()
+        self.entry_sequence_start = None
+        self.entry_row = 0
         self.timers = []
         self.inputs = []
         self.other_ins = []
     
     def insert_event(self, input_tuple, first_action):
         if input_tuple in self.events:
-            error(statefile, "Duplicate event insertion. This is likely a bug in this script. Alert george@queercon.org.",
-                  badtext=input_tuple[1])
+            self.build.error("Duplicate event insertion. This is likely a bug in this script. Alert george@queercon.org.",
+                             badtext=input_tuple[1])
         self.events[input_tuple] = first_action
         if input_tuple[0] == 'ENTER':
             # This is the handle to our Enter event!
             self.entry_sequence_start = first_action
+            self.entry_row = self.build.row_number
         
         if input_tuple[0] in ('TIMER', 'TIMER_R'):
-            # This is a new timer event.
-            # TODO: sort the timers.
+            # This is a new timer event. (The timers are sorted once they've
+            #  all been read in; see sort_timers().)
             try:
                 dur = int(input_tuple[1])
                 if dur <=0:
                     raise "PROBLEM"
             except:
-                error(statefile, "Could not convert '%s' to positive integer" % input_tuple[1],
-                      row_number, badtext=input_tuple[1])
+                self.build.error("Could not convert '%s' to positive integer" % input_tuple[1],
+                                 badtext=input_tuple[1])
             
             self.timers.append(GameTimer(dur, input_tuple[0] == 'TIMER_R', 
-                                         first_action))
-            self.timers.sort(key=GameTimer.sort_key) # Always in order.
+                                         first_action,
+                                         row=self.build.row_number,
+                                         detail=input_tuple[1]))
             
         if input_tuple[0] == 'USER_IN':
-            self.inputs.append(GameInput(input_tuple[1], first_action))
+            self.inputs.append(GameInput(self.build, self.name, input_tuple[1],
+                                         first_action))
             
         if input_tuple[0] == 'NET':
-            self.other_ins.append(GameOther(input_tuple[1], first_action))
+            self.other_ins.append(GameOther(self.build, self.name, input_tuple[1],
+                                            first_action))
         
+    def sort_timers(self):
+        # When more than one timer could fire at once, the badge goes with
+        #  the first one, so they're stored in the order of GameTimer.sort_key.
+        self.timers.sort(key=GameTimer.sort_key)
+    
+    def deadline_order(self):
+        # The indices of our timers, in the order that they first come due
+        #  (soonest first). Ties go to the one that's stored first, same as
+        #  the badge. Once a recurring timer has fired, this says nothing
+        #  about where its next deadline goes.
+        return sorted(range(len(self.timers)),
+                      key=lambda i: (self.timers[i].duration, i))
+    
     def __str__(self):
         return '%d %s' % (self.id, self.name)
         
@@ -651,31 +778,57 @@ class GameState(object):
             uint8_t other_series_len;
 
             game_timer_t timer_series[X];
+            uint8_t timer_deadline_order[X]; // Only with TIMER_DEADLINE_ORDER
             game_user_in_t input_series[X];
             game_other_in_t other_series[X];
         } game_state_t;
         """
-        bytes = ''
-        bytes += struct.pack('<HBBBx', *self.as_int_sequence())
-
+        packed = bytearray(self.build.state_record_len())
+        self.pack_into(packed, 0)
+        return bytes(packed)
+    
+    def packed_len(self):
+        # The size of this state's record without any padding.
+        return GameState.header.size + \
+               len(self.timers) * GameTimer.record.size + \
+               self.build.timer_order_len(len(self.timers)) + \
+               len(self.inputs) * GameInput.record.size + \
+               len(self.other_ins) * GameOther.record.size
+    
+    def pack_into(self, buf, offset, padded=True):
+        # buf must already be zero-filled; the unused timer, input and other
+        #  slots are skipped over rather than written. Unless padded is
+        #  False, in which case there aren't any unused slots.
+        build = self.build
+        if padded:
+            end = offset + build.state_record_len()
+        else:
+            end = offset + self.packed_len()
+        GameState.header.pack_into(buf, offset, *self.as_int_sequence())
+        offset += GameState.header.size
+        
+        slots_start = offset
         for timer in self.timers:
-            bytes += timer.pack()
-        # TODO: This is a dumb way to multiply:
-        for i in range(max_timers - len(self.timers)):
-            bytes += '\x00'*8
-
+            offset = timer.pack_into(buf, offset)
+        if padded:
+            offset = slots_start + build.max_timers * GameTimer.record.size
+        
+        if build.timer_order:
+            order = self.deadline_order()
+            buf[offset:offset + len(order)] = bytearray(order)
+            offset += build.timer_order_len(build.max_timers if padded
+                                            else len(order))
+        
+        slots_start = offset
         for input in self.inputs:
-            bytes += input.pack()
-        for i in range(max_inputs - len(self.inputs)):
-            bytes += '\x00'*4
+            offset = input.pack_into(buf, offset)
+        if padded:
+            offset = slots_start + build.max_inputs * GameInput.record.size
         
         for other in self.other_ins:
-            bytes += other.pack()
-        for i in range(max_others - len(self.other_ins)):
-            bytes += '\x00'*4
-
-        return bytes
-
+            offset = other.pack_into(buf, offset)
+        
+        return end
             
     def as_int_sequence(self):
         return (
@@ -687,419 +840,1185 @@ class GameState(object):
             
     def as_struct_text(self):
         struct_text = "(game_state_t){.entry_series_id=%d, .timer_series_len=%d, .input_series_len=%d, .other_series_len=%d, " % self.as_int_sequence()
-        struct_text += ".timer_series=%s, .input_series=%s, .other_series=%s}" %\
+        struct_text += ".timer_series=%s, " % (
+            '{%s}' % (','.join(map(GameTimer.as_struct_text, self.timers)),),
+        )
+        if self.build.timer_order:
+            struct_text += ".timer_deadline_order={%s}, " % (
+                ','.join(map(str, self.deadline_order())),
+            )
+        struct_text += ".input_series=%s, .other_series=%s}" %\
             (
-                '{%s}' % (','.join(map(GameTimer.as_struct_text, self.timers)),),
                 '{%s}' % (','.join(map(GameInput.as_struct_text, self.inputs)),),
                 '{%s}' % (','.join(map(GameOther.as_struct_text, self.other_ins)),),
             )
         
         return struct_text
         
-def error(statefile, message, row=None, col=None, badtext='', errtype='FATAL'):
-    if row is None:
-        row = row_number
-    if col is None and badtext != '' and row:
-        col = row_lines[row].upper().find(badtext.upper())
-    print("%s: %s:%d:" % (errtype, statefile, row), file=sys.stderr)
-    if row:
-        print(row_lines[row], file=sys.stderr)
-        if col is not None:
-            pad = ' ' * col
-            print(pad + '^')
-    print('   ' + message, file=sys.stderr)
-    print()
-    if errtype != 'WARNING':
-        exit(1)
-        
-def read_states_and_validate(statefile):
-    with open(statefile) as csvfile:
-        global row_number
-        global row_lines
-        row_number = 1
-        state_is_set = False
+def _track_lines(lines, line_offsets):
+    # Record the offset of every line as the CSV reader pulls it through.
+    offset = 0
+    for line in lines:
+        line_offsets.append(offset)
+        offset += len(line)
+        yield line
+
+TEXT_RECORD_LEN = 25
+
+def pack_text(text):
+    packed = bytearray(TEXT_RECORD_LEN)
+    pack_text_into(packed, 0, text)
+    return bytes(packed)
+
+def pack_text_into(buf, offset, text):
+    t = text.strip()
+    assert len(t)<TEXT_RECORD_LEN # Need at least one null term
+    # buf is zero-filled, which takes care of the null padding.
+    buf[offset:offset+len(t)] = t
+    return offset + TEXT_RECORD_LEN
+
+def unpack_text_pool(data, count):
+    # Decode a pooled text region (see GameBuild.pack_text_pool()) back into
+    #  a list of count strings, indexed by text ID, with None for holes.
+    texts = []
+    for offset in struct.unpack_from('<%dH' % count, data, 0):
+        if offset == NULL:
+            texts.append(None)
+        else:
+            texts.append(data[offset:data.index(b'\0', offset)])
+    return texts
+
+def text_pool_hosts(texts):
+    # For each of the distinct strings in texts, the string that it's stored
+    #  as the end of in a text pool (which is often itself).
+    # Sorted by their reversals, any string that another string ends
+    #  with comes right before one that ends with it.
+    by_ending = sorted(set(texts), key=lambda text: text[::-1])
+    host = dict()
+    for i in reversed(range(len(by_ending))):
+        text = by_ending[i]
+        if i + 1 < len(by_ending) and by_ending[i + 1].endswith(text):
+            host[text] = host[by_ending[i + 1]]
+        else:
+            host[text] = text
+    return host
+
+def split_blocks(rows):
+    # Returns the rows before the first START_STATE, and a list of 
+    #  (state name, rows) for every START_STATE and the rows that follow it.
+    prelude = []
+    blocks = []
+    for row in rows:
+        if row.input_type == 'START_STATE':
+            blocks.append((row.input_detail.upper(), [row]))
+        elif blocks:
+            blocks[-1][1].append(row)
+        else:
+            prelude.append(row)
+    return prelude, blocks
+
+def row_contents(rows):
+    # Everything about some rows except for where they are in the file.
+    return [row[1:] for row in rows]
+
+def escape_action(action):
+    return str(action).replace(':', ' ').replace('\\', '/').replace('\x96', '`')
+
+class GameBuild(object):
+    """All of the state involved in compiling a single statefile.
     
-        csvreader = csv.DictReader(csvfile)
+    Every action, state, and piece of text belongs to exactly one GameBuild,
+    so any number of statefiles can be compiled in the same process (or at
+    the same time, from different threads).
+    """
+    def __init__(self, statefile, allow_implicit=False, warn_on_wrap=True,
+                 choice_table=None, text_format='fixed', state_format='fixed',
+                 timer_order=False):
+        self.statefile = statefile
+        self.allow_implicit = allow_implicit
+        self.warn_on_wrap = warn_on_wrap
+        # None, or one of CHOICE_TABLE_TYPES to also pack a choice table
+        #  region (see GameChoiceSet).
+        self.choice_table = choice_table
+        # One of TEXT_FORMATS: 'fixed' records, or a 'pooled' region (see
+        #  pack_text_pool()).
+        self.text_format = text_format
+        # One of STATE_FORMATS: 'fixed' (padded) records, or 'indexed' (see
+        #  pack_indexed_states()).
+        self.state_format = state_format
+        # Whether every state also gets the order that its timers come due in
+        #  (see GameState.deadline_order()).
+        self.timer_order = timer_order
         
-        for required_heading in REQUIRED_HEADINGS:
-            if required_heading not in csvreader.fieldnames:
-                error(statefile, 
-                      "Required heading '%s' not found." % required_heading)
+        self.all_actions = []
+        self.main_actions = []
+        self.aux_actions = []
+        self.all_states = []
+        self.main_text = [] # Lives in FRAM
+        self.aux_text = [] # Lives in flash
+        
+        # Symbol tables, filled in by assign_ids() once parsing is finished.
+        #  The *_table lists are indexed by ID, and may contain None for IDs
+        #  that aren't in use (only when using an IdMap).
+        self.action_table = []
+        self.state_table = []
+        self.main_text_table = []
+        self.text_table = []
+        # The packed text pool, once pack_text_pool() has built it for the
+        #  current text_table.
+        self.text_pool = None
+        self.text_ids = dict()
+        self.animation_ids = dict()
+        self.other_output_ids = dict()
+        
+        self.state_name_ids = dict()
+        self.closable_states = set()
+        
+        # Every text string, animation and OTHER type that each state asked
+        #  for, in order, so that the lists of them can be put back together
+        #  the same way after update().
+        self.symbol_log = dict()
+        self.main_text_set = set()
+        self.aux_text_set = set()
+        
+        # The statefile's rows, split up by state, as of the last build.
+        self.prelude = ()
+        self.blocks = []
+        self.updated_states = []
+        
+        self.max_inputs = 0
+        self.max_timers = 0
+        self.max_others = 0
+        self.max_extra_details = 0
+        
+        self.merged_actions = 0 # Number of actions removed by merge_actions()
+        # What strip_unreachable() removed: state names, the numbers of
+        #  actions and text strings, and how many bytes that saved.
+        self.stripped_states = []
+        self.stripped_actions = 0
+        self.stripped_text = 0
+        self.stripped_bytes = 0
+        
+        self.all_other_input_descs = list(DEFAULT_OTHER_INPUT_DESCS)
+        self.all_other_output_descs = list(DEFAULT_OTHER_OUTPUT_DESCS)
+        self.all_animations = list(DEFAULT_ANIMATIONS)
+        
+        self.row_number = 0
+        self.line_offsets = [] # File offset of the start of each line
+        # Every error and warning so far; see error(). Rows with a FATAL
+        #  error in read_states_and_validate() are skipped by read_actions().
+        self.diagnostics = Diagnostics(statefile, self.source_lines)
+        self.invalid_rows = set()
+    
+    def register(self, state_name, kind, value):
+        self.symbol_log.setdefault(state_name, []).append((kind, value))
+        self.add_symbol(kind, value)
+    
+    def add_symbol(self, kind, value):
+        if kind == 'animation':
+            if value not in self.all_animations:
+                self.all_animations.append(value)
+        elif kind == 'other_output':
+            if value not in self.all_other_output_descs:
+                self.all_other_output_descs.append(value)
+        elif kind == 'other_input':
+            if value not in self.all_other_input_descs:
+                self.all_other_input_descs.append(value)
+        elif (kind == 'aux' and value not in self.aux_text_set and 
+              value not in self.main_text_set):
+            # New aux text goes in aux_text.
+            self.aux_text.append(value)
+            self.aux_text_set.add(value)
+        elif value not in self.main_text_set:
+            # Everything else goes in main_text. Inputs need their text there
+            #  even if it's already in aux_text.
+            self.main_text.append(value)
+            self.main_text_set.add(value)
+            if kind == 'input' and value in self.aux_text_set:
+                self.aux_text.remove(value)
+                self.aux_text_set.remove(value)
+    
+    def replay_symbols(self):
+        # Put the text, animation and OTHER lists back together in the same
+        #  order that a full build would have.
+        self.main_text = []
+        self.aux_text = []
+        self.main_text_set = set()
+        self.aux_text_set = set()
+        self.all_other_input_descs = list(DEFAULT_OTHER_INPUT_DESCS)
+        self.all_other_output_descs = list(DEFAULT_OTHER_OUTPUT_DESCS)
+        self.all_animations = list(DEFAULT_ANIMATIONS)
+        for state in self.all_states:
+            for kind, value in self.symbol_log.get(state.name, ()):
+                self.add_symbol(kind, value)
+        for state in self.all_states:
+            for other in state.other_ins:
+                other.id = self.all_other_input_descs.index(other.desc)
+    
+    def text_addr(self, text):
+        return self.text_ids[text]
+    
+    def state_record_len(self):
+        # Every state is padded out to the same size, so that the badge can
+        #  index directly into the state region.
+        return GameState.header.size + \
+               self.max_timers * GameTimer.record.size + \
+               self.timer_order_len(self.max_timers) + \
+               self.max_inputs * GameInput.record.size + \
+               self.max_others * GameOther.record.size
+    
+    def timer_order_len(self, timers):
+        # Bytes of deadline order for that many timer slots: one each, plus
+        #  a padding byte if need be, so that everything after it stays
+        #  16-bit aligned.
+        if not self.timer_order:
+            return 0
+        return timers + (timers & 1)
+    
+    def error(self, message, row=None, col=None, badtext='', errtype='FATAL'):
+        # Record the problem in diagnostics, to be reported along with all the
+        #  others at the end. A FATAL error also stops whatever we were doing,
+        #  although the passes over the statefile's rows carry on with the
+        #  next row (see Diagnostics.recover()).
+        if row is None:
+            row = self.row_number
+        self.diagnostics.add(errtype, row, col, badtext, message)
+        if errtype != 'WARNING':
+            raise GameBuildError(message)
+        
+    def source_lines(self, rows):
+        # We don't keep the text of the statefile around, just where each line
+        #  starts, so go back and fetch the lines we're complaining about.
+        lines = dict()
+        with open(self.statefile) as f:
+            for row in rows:
+                if row < len(self.line_offsets):
+                    f.seek(self.line_offsets[row])
+                    lines[row] = f.readline().strip()
+        return lines
+
+    def read_rows(self):
+        # The one and only pass over the statefile itself. Everything after this
+        #  works from the StateRow tuples we return.
+        self.line_offsets = [0] # Line numbers are 1-origined.
+        self.row_number = 1
+        rows = []
+    
+        with open(self.statefile) as csvfile:
+            csvreader = csv.reader(_track_lines(csvfile, self.line_offsets))
+        
+            try:
+                fieldnames = next(csvreader)
+            except StopIteration:
+                fieldnames = []
+        
+            for required_heading in REQUIRED_HEADINGS:
+                if required_heading not in fieldnames:
+                    with self.diagnostics.recover():
+                        self.error("Required heading '%s' not found." % required_heading)
+            self.diagnostics.check()
 
-        result_detail_index = csvreader.fieldnames.index('Result_detail')
-        for i in range(result_detail_index+1, len(csvreader.fieldnames)):
-            if (csvreader.fieldnames[i]):
-                error(statefile, "Expected only blank or no headings after Result_detail", 
-                      row=row_number, badtext=csvreader.fieldnames[i])
+            result_detail_index = fieldnames.index('Result_detail')
+            for i in range(result_detail_index+1, len(fieldnames)):
+                if (fieldnames[i]):
+                    with self.diagnostics.recover():
+                        self.error("Expected only blank or no headings after Result_detail", 
+                                   row=self.row_number, badtext=fieldnames[i])
+            self.diagnostics.check()
         
+            # We want to be able to accept multiple text options in a single row.
+            #  So users are allowed to add as many extra columns as they want.
+            #  Earlier, we already validated that Result_detail is the last named
+            #  column, so everything after it is an extra.
+            self.max_extra_details = len(fieldnames) - 1 - result_detail_index
+        
+            columns = [fieldnames.index(heading) for heading in 
+                       ('Input_type', 'Input_detail', 'Choice_share', 
+                        'Result_duration', 'Result_type', 'Result_detail')]
+            width = len(fieldnames)
+        
+            line = csvreader.line_num + 1
+            for cells in csvreader:
+                if cells:
+                    if len(cells) < width:
+                        cells.extend([''] * (width - len(cells)))
+                    rows.append(StateRow(
+                        line, 
+                        *[cells[column] for column in columns],
+                        extra_details=tuple(cells[result_detail_index+1:width])
+                    ))
+                line = csvreader.line_num + 1
+    
+        return rows
+
+    def read_states_and_validate(self, rows, define_states=True):
+        # With define_states=False, we only validate; the states in rows
+        #  must already exist (this is how update() re-checks a block).
+        state_is_set = False
+
         no_contd_allowed = 1
-        for row in csvreader:
-            row_number += 1
-            if row['Input_type'] == '':
-                for field in csvreader.fieldnames:
-                    if row[field]:
-                        error(statefile, "Blank input type, but line has more contents.",
-                              badtext=row[field], errtype="WARNING")
-            if row['Input_type'] in IGNORE_INPUT_TYPES:
-                continue # Skip blank and ignored (comment/action) lines
-            if not state_is_set and row['Input_type'] != 'START_STATE':
-                error(statefile, "Input type '%s' not allowed before START_STATE" % row['Input_type'], 
-                      badtext=row['Input_type'])
-            if row['Input_type'] == 'START_STATE':
-                state_is_set = True
-                # New state.
-                if row['Input_detail'].upper() in state_name_ids:
-                    error(statefile, "Duplicate state definition '%s'" % row['Input_detail'],
-                          badtext=row['Input_detail'])
-                # TODO: Validate that other columns are empty.
-                GameState(row['Input_detail'].upper())
-                continue
-                
-            # TODO: Validate that the columns that should be numbers are 
-            #       numbers.
-                
-            # If we're here, it's an action/event:
-            if row['Input_type'] not in VALID_INPUT_TYPES:
-                error(statefile, "Unknown input type '%s'" % row['Input_type'],
-                          badtext=row['Input_type'])
-            
-            if row['Result_type'] not in VALID_RESULT_TYPES:
-                error(statefile, "Unknown result type '%s'" % row['Result_type'],
-                          badtext=row['Result_type'])
-            
-            if no_contd_allowed and row['Input_type'] == 'CONTD':
-                error(statefile, "CONTD not allowed after state transitions.")
-                          
-            if row['Result_type'] == 'STATE_TRANSITION':
-                no_contd_allowed = 1
-            else:
-                no_contd_allowed = 0
-                
-            
-            if row['Result_type'] not in VALID_RESULT_TYPES:
-                error(statefile, "Unknown result type '%s'" % row['Result_type'],
-                          badtext=row['Result_type'])
+        for row in rows:
+            self.row_number = row.line
+            # A mistake in one row stops us checking that row, but not the
+            #  rest of them.
+            errors = self.diagnostics.fatal_count
+            with self.diagnostics.recover():
+                if row.input_type == '':
+                    for field in row[1:-1] + row.extra_details:
+                        if field:
+                            self.error("Blank input type, but line has more contents.",
+                                       badtext=field, errtype="WARNING")
+                if row.input_type in IGNORE_INPUT_TYPES:
+                    continue # Skip blank and ignored (comment/action) lines
+                if not state_is_set and row.input_type != 'START_STATE':
+                    self.error("Input type '%s' not allowed before START_STATE" % row.input_type, 
+                               badtext=row.input_type)
+                if row.input_type == 'START_STATE':
+                    state_is_set = True
+                    if not define_states:
+                        continue
+                    # New state.
+                    if row.input_detail.upper() in self.state_name_ids:
+                        self.error("Duplicate state definition '%s'" % row.input_detail,
+                                   badtext=row.input_detail)
+                    # TODO: Validate that other columns are empty.
+                    GameState(self, row.input_detail.upper())
+                    continue
             
-            if row['Input_type'] == 'ENTER' and row['Input_detail']:
-                error(statefile, "Input_detail not allowed for ENTER input types",
-                      badtext=row['Input_detail'])
-            
-            # TODO: Enforce STATE TRANSITION must be last in an action sequence.
+                # TODO: Validate that the columns that should be numbers are 
+                #       numbers.
             
+                # If we're here, it's an action/event:
+                if row.input_type not in VALID_INPUT_TYPES:
+                    self.error("Unknown input type '%s'" % row.input_type,
+                                   badtext=row.input_type)
+        
+                if row.result_type not in VALID_RESULT_TYPES:
+                    self.error("Unknown result type '%s'" % row.result_type,
+                                   badtext=row.result_type)
         
-def read_actions(statefile_param):
-    global statefile
-    statefile = statefile_param
-    
-    with open(statefile) as csvfile:
-        csvreader = csv.DictReader(csvfile)
-        
-        # We want to be able to accept multiple text options in a single row.
-        #  So users are allowed to add as many extra columns as they want.
-        #  Here, we are assigning them numbers, starting with 0.
-        # First, determine where the Result_detail column is:
-        result_detail_index = csvreader.fieldnames.index('Result_detail')
-        # Earlier, we already validated that this is the last named column.
-        #  Now, check whether there are additional unnamed columns. If so,
-        #  count them.
-        if len(csvreader.fieldnames) > result_detail_index+1:
-            GameAction.max_extra_details = len(csvreader.fieldnames) - 1 - result_detail_index
+                if no_contd_allowed and row.input_type == 'CONTD':
+                    self.error("CONTD not allowed after state transitions.")
+                      
+                if row.result_type == 'STATE_TRANSITION':
+                    no_contd_allowed = 1
+                else:
+                    no_contd_allowed = 0
             
-        # Now, for every extra column, assign it a numeric key, starting with 0.
-        #  This is nice because all the other keys are always strings, so this
-        #  should not ever conflict with existing columns:
-        for i in range(result_detail_index+1, len(csvreader.fieldnames)):
-            csvreader.fieldnames[i] = i-result_detail_index-1 # 0-origined
         
+                if row.result_type not in VALID_RESULT_TYPES:
+                    self.error("Unknown result type '%s'" % row.result_type,
+                                   badtext=row.result_type)
+        
+                if row.input_type == 'ENTER' and row.input_detail:
+                    self.error("Input_detail not allowed for ENTER input types",
+                               badtext=row.input_detail)
+        
+                # TODO: Enforce STATE TRANSITION must be last in an action sequence.
+            
+            if self.diagnostics.fatal_count > errors:
+                self.invalid_rows.add(row.line)
+    
+    def read_actions(self, rows):
         # Now let's get going.
         current_state = None
+        read_states = []
+
+        for row in rows:
+            self.row_number = row.line
+            # As in read_states_and_validate(), carry on to the next row after
+            #  a mistake. Rows that it already found a mistake in are skipped,
+            #  and if that's a START_STATE, so is everything up to the next
+            #  one (current_state is None until then, which stops them).
+            with self.diagnostics.recover():
+                if row.line in self.invalid_rows:
+                    if row.input_type == 'START_STATE':
+                        current_state = None
+                    continue
+                if row.input_type in IGNORE_INPUT_TYPES:
+                    continue # Skip blank and ignored (comment/action) lines
+                if row.input_type == 'START_STATE':
+                    # New state.
+                    current_state = self.all_states[self.state_name_ids[row.input_detail.upper()]]
+                    read_states.append(current_state)
+                    current_action = None
+                    continue
+                
+                # If we're here, it means that the line is an action, not a state
+                #  definition. We're ready to process the action definition.
+                # There are a few possibilities:
+                #  1. This could be a new event, meaning it is an Input tuple we
+                #     have never seen before in the current state.
+                #  2. This could be a new action choice for an existing event,
+                #     meaning it's a repeat of a Input tuple that already exists
+                #     in the current state.
+                #  3. It's a continuation of an action sequence, meaning it is a
+                #     CONTD Input_type.
         
-        global row_number
-        global row_lines
-        row_number = 1
-    
-        for row in csvreader:
-            row_number += 1
-            if row['Input_type'] in IGNORE_INPUT_TYPES:
-                continue # Skip blank and ignored (comment/action) lines
-            if row['Input_type'] == 'START_STATE':
-                # New state.
-                current_state = all_states[state_name_ids[row['Input_detail'].upper()]]
-                current_action = None
-                continue
-                    
-            # If we're here, it means that the line is an action, not a state
-            #  definition. We're ready to process the action definition.
-            # There are a few possibilities:
-            #  1. This could be a new event, meaning it is an Input tuple we
-            #     have never seen before in the current state.
-            #  2. This could be a new action choice for an existing event,
-            #     meaning it's a repeat of a Input tuple that already exists
-            #     in the current state.
-            #  3. It's a continuation of an action sequence, meaning it is a
-            #     CONTD Input_type.
+                # We check for case 3 first.
+                if row.input_type == "CONTD":
+                    # This is a continuation of the current action sequence.
+                    # previous action is current_action, previous choice is None
+                    next_action = GameAction.create_from_row(
+                        self,
+                        current_action.input_tuple,
+                        current_state,
+                        current_action, None,
+                        row
+                    )
             
-            # We check for case 3 first.
-            if row['Input_type'] == "CONTD":
-                # This is a continuation of the current action sequence.
-                # previous action is current_action, previous choice is None
-                next_action = GameAction.create_from_row(
-                    current_action.input_tuple,
-                    current_state,
-                    current_action, None,
-                    row
-                )
-                
+                    current_action = next_action
+                    continue
+        
+                # Now we know we're in case 1 or 2.            
+                input_tuple = (row.input_type, row.input_detail)
+        
+                # If the input tuple already exists for this state, we know we're
+                #  in case 2. If not, it's case 1.
+            
+                if input_tuple in current_state.events:
+                    # Find the last action node in the choice set associated with
+                    #  the current input tuple.
+                    current_choice = current_state.events[input_tuple]
+                    while True:
+                        if current_choice.next_choice:
+                            current_choice = current_choice.next_choice
+                        else:
+                            # current_choice.next_choice = None, so we are at
+                            #  the choice - where we need to hook our new choice up.
+                            break
+                    # Previous action is None, previous choice is current_choice.
+                    next_action = GameAction.create_from_row(
+                        self,
+                        input_tuple,
+                        current_state,
+                        None, current_choice,
+                        row
+                    )
+                else:
+                    # No previous action, no previous choice:
+                    next_action = GameAction.create_from_row(
+                        self,
+                        input_tuple, 
+                        current_state, 
+                        None, None, 
+                        row
+                    )
                 current_action = next_action
+        
+        self.diagnostics.check()
+        
+        # Every timer in these states has been read in now.
+        for state in read_states:
+            state.sort_timers()
+        
+    def pack_structs(self):
+        # Every region is a fixed number of fixed-size records, so we know how
+        #  big each one is before we start, and can pack straight into a single
+        #  preallocated (and zeroed) buffer per region.
+        #  Unused IDs are left as all zeroes.
+        if self.text_format == 'pooled':
+            packed_text = self.pack_text_pool()
+        else:
+            packed_text = bytearray(len(self.text_table) * TEXT_RECORD_LEN)
+            offset = 0
+            for s in self.text_table:
+                if s is None:
+                    offset += TEXT_RECORD_LEN
+                else:
+                    offset = pack_text_into(packed_text, offset, s)
+    
+        packed_actions = bytearray(len(self.action_table) * GameAction.record.size)
+        offset = 0
+        for a in self.action_table:
+            if a is None:
+                offset += GameAction.record.size
+            else:
+                offset = a.pack_into(packed_actions, offset)
+
+        if self.state_format == 'indexed':
+            packed_states = self.pack_indexed_states()
+        else:
+            state_record_len = self.state_record_len()
+            packed_states = bytearray(len(self.state_table) * state_record_len)
+            offset = 0
+            for s in self.state_table:
+                if s is None:
+                    offset += state_record_len
+                else:
+                    offset = s.pack_into(packed_states, offset)
+    
+        packed = dict(text=bytes(packed_text), actions=bytes(packed_actions),
+                      states=bytes(packed_states))
+        if self.choice_table:
+            packed['choices'] = self.pack_choice_tables()
+        return packed
+    
+    def region_lengths(self):
+        # The lengths of the text, action, state and choice table (0 if there
+        #  isn't one) regions, packed in the formats in use, for the states, actions and text strings that we
+        #  have right now (not counting any unused IDs). This works before
+        #  any IDs are assigned.
+        texts = [text.strip() for text in self.main_text + self.aux_text]
+        if self.text_format == 'pooled':
+            text_len = len(texts) * 2 + sum(
+                len(host) + 1 for host in set(text_pool_hosts(texts).values())
+            )
+        else:
+            text_len = len(texts) * TEXT_RECORD_LEN
+        if self.state_format == 'indexed':
+            state_len = len(self.all_states) * 2 + sum(
+                state.packed_len() for state in self.all_states
+            )
+        else:
+            # state_record_len(), with the largest of each thing that we have.
+            most = lambda things: max([len(things(state))
+                                       for state in self.all_states] or [0])
+            max_timers = most(lambda state: state.timers)
+            state_len = len(self.all_states) * (
+                GameState.header.size +
+                max_timers * GameTimer.record.size +
+                self.timer_order_len(max_timers) +
+                most(lambda state: state.inputs) * GameInput.record.size +
+                most(lambda state: state.other_ins) * GameOther.record.size
+            )
+        choice_len = 0
+        if self.choice_table:
+            choice_len = len(self.all_actions) * 2 + sum(
+                GameChoiceSet(action).packed_len(self.choice_table)
+                for action in self.all_actions
+                if action.next_choice and not action.prev_choice
+            )
+        return (text_len, len(self.all_actions) * GameAction.record.size,
+                state_len, choice_len)
+    
+    def indexed_states_len(self):
+        return len(self.state_table) * 2 + sum(
+            state.packed_len() for state in self.state_table if state
+        )
+    
+    def pack_indexed_states(self):
+        # The indexed state region starts with a uint16_t for every state ID,
+        #  which is the offset (from the start of the region) of its record,
+        #  or NULL if the ID isn't in use. The records follow, each with only
+        #  as many timers, inputs and others as its state has.
+        packed = bytearray(self.indexed_states_len())
+        offset = len(self.state_table) * 2
+        for state_id, state in enumerate(self.state_table):
+            if state is None:
+                struct.pack_into('<H', packed, state_id * 2, NULL)
                 continue
-            
-            # Now we know we're in case 1 or 2.            
-            input_tuple = (row['Input_type'], row['Input_detail'])
-            
-            # If the input tuple already exists for this state, we know we're
-            #  in case 2. If not, it's case 1.
-                
-            if input_tuple in current_state.events:
-                # Find the last action node in the choice set associated with
-                #  the current input tuple.
-                current_choice = current_state.events[input_tuple]
-                while True:
-                    if current_choice.next_choice:
-                        current_choice = current_choice.next_choice
-                    else:
-                        # current_choice.next_choice = None, so we are at
-                        #  the choice - where we need to hook our new choice up.
-                        break
-                # Previous action is None, previous choice is current_choice.
-                next_action = GameAction.create_from_row(
-                    input_tuple,
-                    current_state,
-                    None, current_choice,
-                    row
-                )
+            if offset >= NULL:
+                self.error("The indexed state region is too big for 16-bit"
+                           " offsets. Use the fixed state format instead.")
+            struct.pack_into('<H', packed, state_id * 2, offset)
+            offset = state.pack_into(packed, offset, padded=False)
+        return packed
+    
+    def pack_text_pool(self):
+        # The pooled text region starts with a uint16_t for every text ID,
+        #  which is the offset (from the start of the region) of its string,
+        #  or NULL if the ID isn't in use. The strings follow, each
+        #  null-terminated. A string that's the end of another string isn't
+        #  stored again: its offset just points into the other one.
+        #  It's only built once for each assign_ids().
+        if self.text_pool is not None:
+            return self.text_pool
+        texts = [text.strip() if text is not None else None
+                 for text in self.text_table]
+        for text in texts:
+            assert text is None or len(text) < TEXT_RECORD_LEN
+        
+        host = text_pool_hosts(text for text in texts if text is not None)
+        
+        pool = bytearray(len(texts) * 2)
+        host_offsets = dict()
+        for text in texts:
+            if text is not None and host[text] not in host_offsets:
+                host_offsets[host[text]] = len(pool)
+                pool += host[text] + b'\0'
+        if len(pool) > NULL:
+            self.error("The pooled text region is too big for 16-bit"
+                       " offsets. Use the fixed text format instead.")
+        
+        for text_id, text in enumerate(texts):
+            if text is None:
+                offset = NULL
             else:
-                # No previous action, no previous choice:
-                next_action = GameAction.create_from_row(
-                    input_tuple, 
-                    current_state, 
-                    None, None, 
-                    row
-                )
-            current_action = next_action
+                offset = host_offsets[host[text]] + len(host[text]) - len(text)
+            struct.pack_into('<H', pool, text_id * 2, offset)
         
-def pack_text(text):
-    t = text.strip()
-    assert len(t)<25 # Need at least one null term
-    return t + '\x00'*(25-len(t))
-
-def pack_structs():
-    packed_text = ''
-    for s in main_text:
-        packed_text += pack_text(s)
-    for s in aux_text:
-        packed_text += pack_text(s)
-    
-    packed_actions = ''
-    for a in all_actions:
-        packed_actions += a.pack()
-
-    packed_states = ''
-    for s in all_states:
-        packed_states += s.pack()
+        assert unpack_text_pool(bytes(pool), len(texts)) == texts
+        self.text_pool = pool
+        return pool
     
-    return dict(text=packed_text, actions=packed_actions, states=packed_states)
+    def choice_sets(self):
+        # [(first action ID, GameChoiceSet)] for every choice set that has
+        #  more than one choice.
+        return [(action_id, GameChoiceSet(action)) for action_id, action in
+                enumerate(self.action_table) if action is not None and
+                action.next_choice and not action.prev_choice]
+    
+    def pack_choice_tables(self):
+        # The choice table region starts with a uint16_t for every action ID,
+        #  which for the first action of a choice set is the offset (from the
+        #  start of the region) of its game_choice_set_t, and otherwise NULL.
+        choice_sets = self.choice_sets()
+        index_len = len(self.action_table) * 2
+        packed = bytearray(index_len + sum(
+            choice_set.packed_len(self.choice_table)
+            for action_id, choice_set in choice_sets
+        ))
+        struct.pack_into('<%dH' % len(self.action_table), packed, 0,
+                         *([NULL] * len(self.action_table)))
+        offset = index_len
+        for action_id, choice_set in choice_sets:
+            if offset >= NULL:
+                self.error("The choice table region is too big for 16-bit"
+                           " offsets. Use the linked layout instead.")
+            struct.pack_into('<H', packed, action_id * 2, offset)
+            offset = choice_set.pack_into(packed, offset, self.choice_table)
+        return bytes(packed)
 
 
-def display_data_str(outfile=sys.stdout):
-    print("/// Definitions for the state game. GENERATED FILE: DO NOT EDIT DIRECTLY.\n\n", file=outfile)
-    print("#define ALL_ACTIONS_LEN %d" % len(all_actions), file=outfile)
-    print("#define ALL_TEXT_LEN %d" % len(main_text), file=outfile)
-    print("#define all_states_len %d" % len(all_states), file=outfile)
+    def display_data_str(self, outfile=sys.stdout):
+        print("/// Definitions for the state game. GENERATED FILE: DO NOT EDIT DIRECTLY.\n\n", file=outfile)
+        print("#define ALL_ACTIONS_LEN %d" % len(self.action_table), file=outfile)
+        print("#define ALL_TEXT_LEN %d" % len(self.main_text_table), file=outfile)
+        print("#define all_states_len %d" % len(self.state_table), file=outfile)
 
-    print("#define MAX_TIMERS %d" % max_timers, file=outfile)
-    print("#define MAX_INPUTS %d" % max_inputs, file=outfile)
-    print("#define MAX_OTHERS %d" % max_others, file=outfile)
+        print("#define MAX_TIMERS %d" % self.max_timers, file=outfile)
+        print("#define MAX_INPUTS %d" % self.max_inputs, file=outfile)
+        print("#define MAX_OTHERS %d" % self.max_others, file=outfile)
 
-    # TODO:
-    print("#define GAME_ANIMS_LEN %d" % len(all_animations), file=outfile)
-    print("", file=outfile)
-    print("// %s" % ", ".join(all_animations), file=outfile)
+        # TODO:
+        print("#define GAME_ANIMS_LEN %d" % len(self.all_animations), file=outfile)
+        print("", file=outfile)
+        print("// %s" % ", ".join(self.all_animations), file=outfile)
     
-    # print("uint8_t main_text[][25] = {%s};" % ','.join(map(lambda a: '"%s"' % a.replace('"', '\\"').strip(), main_text)), file=outfile)
-    # print("", file=outfile)
+        # print("uint8_t main_text[][25] = {%s};" % ','.join(map(lambda a: '"%s"' % a.replace('"', '\\"').strip(), self.main_text)), file=outfile)
+        # print("", file=outfile)
     
-    # print("uint8_t aux_text[][25] = {%s};" % ','.join(map(lambda a: '"%s"' % a.replace('"', '\\"').strip(), aux_text)), file=outfile)
-    # print("", file=outfile)
+        # print("uint8_t aux_text[][25] = {%s};" % ','.join(map(lambda a: '"%s"' % a.replace('"', '\\"').strip(), self.aux_text)), file=outfile)
+        # print("", file=outfile)
 
-    # main_actions_structs = map(GameAction.as_struct_text, main_actions)
-    # print("game_action_t main_actions[] = {%s};" % ', '.join(main_actions_structs), file=outfile)
-    # print("", file=outfile)
+        # main_actions_structs = map(GameAction.as_struct_text, self.main_actions)
+        # print("game_action_t main_actions[] = {%s};" % ', '.join(main_actions_structs), file=outfile)
+        # print("", file=outfile)
 
-    # aux_actions_structs = map(GameAction.as_struct_text, aux_actions)
-    # print("game_action_t aux_actions[] = {%s};" % ', '.join(aux_actions_structs), file=outfile)
-    # print("", file=outfile)
+        # aux_actions_structs = map(GameAction.as_struct_text, self.aux_actions)
+        # print("game_action_t aux_actions[] = {%s};" % ', '.join(aux_actions_structs), file=outfile)
+        # print("", file=outfile)
     
-    # all_states_structs = map(GameState.as_struct_text, all_states)
-    # print("game_state_t all_states[] = {%s};" % ', '.join(all_states_structs), file=outfile)
-    # print("", file=outfile)
+        # all_states_structs = map(GameState.as_struct_text, self.all_states)
+        # print("game_state_t all_states[] = {%s};" % ', '.join(all_states_structs), file=outfile)
+        # print("", file=outfile)
     
-    i=0
-    for other_type in all_other_input_descs:
-        print("#define SPECIAL_%s %d" % (other_type, i), file=outfile)
-        i += 1
+        i=0
+        for other_type in self.all_other_input_descs:
+            print("#define SPECIAL_%s %d" % (other_type, i), file=outfile)
+            i += 1
         
-    for state in all_states:
-        print("#define STATE_ID_%s %d" % (state.name.replace(' ', '_'), state.id), file=outfile)
-
-    i=0
-    for other_type in all_other_output_descs:
-        print("#define OTHER_ACTION_%s %d" % (other_type, i), file=outfile)
-        i += 1
-        
-    print("#define CLOSABLE_STATES %d" % len(closable_states), file=outfile)
-    
-def read_state_data(statefile, allow_implicit, do_cull_nops):
-    GameState.allow_implicit = allow_implicit
-    
-    # We do an initial pass to load the contents of the text into a buffer.
-    global row_lines
-    row_lines = [line.strip() for line in open(statefile)]
-    row_lines = [''] + row_lines
-    # Then a general validation pass with State definitions.
-    # Then we do a final pass to add actions.
-    
-    # Lex/Syntax pass:
-    read_states_and_validate(statefile)
-    
-    # Now, all the explicit states have been loaded, so they all have IDs.
-    # Time to process the results.
-    try:
-        read_actions(statefile)
-    except Exception as e:
-        error(statefile, "PYTHON ERROR: %s" % e.message)
-        
-    # Get rid of any no-ops that we can delete.
-    if do_cull_nops:
-        cull_nops()
-        
-    # Now, build the state diagram.
-    # Now we're going to build our pretty graph.
-    state_graph = nx.MultiDiGraph()
-    
-    global max_inputs, max_others, max_timers
+        for state in self.all_states:
+            print("#define STATE_ID_%s %d" % (state.name.replace(' ', '_'), state.id), file=outfile)
 
-    for state in all_states:
-        state_graph.add_node(state)
-        if len(state.inputs) > max_inputs:
-            max_inputs = len(state.inputs)
-        if len(state.timers) > max_timers:
-            max_timers = len(state.timers)
-        if len(state.other_ins) > max_others:
-            max_others = len(state.other_ins)
-        
-    for action in all_actions:
-        if action.action_type == 'STATE_TRANSITION':
-            state_graph.add_edge(all_states[state_name_ids[action.state_name]], 
-                                 action.detail, label=str(action.input_tuple))
+        i=0
+        for other_type in self.all_other_output_descs:
+            print("#define OTHER_ACTION_%s %d" % (other_type, i), file=outfile)
+            i += 1
+        
+        print("#define CLOSABLE_STATES %d" % len(self.closable_states), file=outfile)
+        
+        if self.text_format == 'pooled':
+            print("#define TEXT_POOLED 1", file=outfile)
+        if self.state_format == 'indexed':
+            print("#define STATE_RECORDS_INDEXED 1", file=outfile)
+            print("#define STATE_REGION_LEN %d" % self.indexed_states_len(),
+                  file=outfile)
+        if self.timer_order:
+            print("#define TIMER_DEADLINE_ORDER 1", file=outfile)
+        if self.choice_table:
+            print("#define CHOICE_TABLE_%s 1" % self.choice_table.upper(),
+                  file=outfile)
+            print("#define CHOICE_SETS_LEN %d" % len(self.choice_sets()),
+                  file=outfile)
+    
+    def read_state_data(self, do_cull_nops, id_map=None,
+                        do_merge_actions=False, do_strip_unreachable=False):
+        # We read the file exactly once, into a list of rows.
+        rows = self.read_rows()
+        # Then a general validation pass with State definitions.
+        # Then we do a final pass over the same rows to add actions.
+    
+        # Lex/Syntax pass:
+        self.read_states_and_validate(rows)
+        self.prelude, self.blocks = split_blocks(rows)
+    
+        # Now, all the explicit states have been loaded, so they all have IDs.
+        # Time to process the results.
+        try:
+            self.read_actions(rows)
+        except GameBuildError:
+            raise
+        except Exception as e:
+            self.error("PYTHON ERROR: %s" % e.message)
+        
+        # Get rid of any no-ops that we can delete.
+        if do_cull_nops:
+            self.cull_nops()
+        
+        # And anything that the badge can never get to.
+        if do_strip_unreachable:
+            self.strip_unreachable()
+        
+        # The state graph needs to know which state every action came from,
+        #  which stops being true once duplicate actions are merged.
+        state_graph = self.analyze_states()
+        if do_merge_actions:
+            self.merge_actions()
+    
+        # The set of actions, states and text is now final, so we can hand out
+        #  their IDs.
+        self.assign_ids(id_map)
+        
+        return state_graph
+    
+    def update(self, do_cull_nops, id_map=None, do_merge_actions=False,
+               do_strip_unreachable=False):
+        """Re-read the statefile, and rebuild only the states that changed.
+        
+        Only the actions of states whose START_STATE block has changed are
+        read in again; every other state keeps its actions, and transitions
+        into the rebuilt states still point at the same GameState objects.
+        The result is the same as a full build of the new statefile.
         
+        Returns the new state graph, or None if the change can't be handled
+        this way (states were added, removed or reordered, states are being
+        declared implicitly, actions are being merged across states, or
+        unreachable states are being stripped), in which case a new GameBuild
+        is needed. The names of the rebuilt states are left in
+        updated_states.
+        """
+        if self.allow_implicit or do_merge_actions or do_strip_unreachable:
+            return None
+        
+        # Only what this update finds is reported.
+        self.diagnostics.clear()
+        self.invalid_rows.clear()
+        rows = self.read_rows()
+        prelude, blocks = split_blocks(rows)
+        if [name for name, block in blocks] != \
+                [name for name, block in self.blocks] or \
+                row_contents(prelude) != row_contents(self.prelude):
+            return None
+        
+        changed = [(name, block) for (name, block), (old_name, old_block) in 
+                   zip(blocks, self.blocks)
+                   if row_contents(block) != row_contents(old_block)]
+        self.prelude, self.blocks = prelude, blocks
+        self.updated_states = [name for name, block in changed]
+        
+        changed_names = set(self.updated_states)
+        kept_actions = [action for action in self.all_actions 
+                        if action.state_name not in changed_names]
+        self.all_actions = []
+        self.main_actions = []
+        self.aux_actions = []
+        for name in self.updated_states:
+            self.all_states[self.state_name_ids[name]].reset()
+            self.symbol_log.pop(name, None)
+        
+        # All of the changed blocks go through each pass together, so that
+        #  every mistake in them is found at once.
+        changed_rows = [row for name, block in changed for row in block]
+        self.read_states_and_validate(changed_rows, define_states=False)
+        try:
+            self.read_actions(changed_rows)
+        except GameBuildError:
+            raise
+        except Exception as e:
+            self.error("PYTHON ERROR: %s" % e.message)
+        
+        # Culling is local to each action sequence, so only the new actions
+        #  need it.
+        if do_cull_nops:
+            self.cull_nops()
+        
+        # Put everything back in the order that a full build would have made
+        #  it in: state by state, in the order of the statefile.
+        state_actions = dict()
+        for action in kept_actions + self.all_actions:
+            state_actions.setdefault(action.state_name, []).append(action)
+        self.all_actions = [action for state in self.all_states
+                            for action in state_actions.get(state.name, ())]
+        self.main_actions = [action for action in self.all_actions 
+                             if not action.aux]
+        self.aux_actions = [action for action in self.all_actions 
+                            if action.aux]
+        self.replay_symbols()
+        
+        self.assign_ids(id_map)
+        return self.analyze_states()
+    
+    def analyze_states(self):
+        # Now, build the state diagram, and check it over. Returns the
+        #  StateGraph.
+        self.max_inputs = 0
+        self.max_timers = 0
+        self.max_others = 0
+        self.closable_states = set()
 
-    for action in all_actions:
-        if action.action_type == 'PREVIOUS':
-            node = all_states[state_name_ids[action.state_name]]
-            for predecessor in state_graph.predecessors(node):
-                state_graph.add_edge(
-                    node, predecessor, label=str(action.input_tuple)+' PREVIOUS'
-                )
+        for state in self.all_states:
+            if len(state.inputs) > self.max_inputs:
+                self.max_inputs = len(state.inputs)
+            if len(state.timers) > self.max_timers:
+                self.max_timers = len(state.timers)
+            if len(state.other_ins) > self.max_others:
+                self.max_others = len(state.other_ins)
+        
+        state_graph = StateGraph(self.all_states, self.state_edges())
 
-    undirected = state_graph.to_undirected()
-    if not nx.is_connected(undirected):
-        error(statefile, "Detected that the state graph may not be connected!",
-              row=0, col=0, errtype="WARNING")
+        if not state_graph.is_connected():
+            self.error("Detected that the state graph may not be connected!",
+                       row=0, col=0, errtype="WARNING")
 
     
-    for action in all_actions:
-        if action.action_type == 'CLOSE':
-            closable_states.add(action.state_name)
+        for action in self.all_actions:
+            if action.action_type == 'CLOSE':
+                self.closable_states.add(action.state_name)
+        closable = [state.name in self.closable_states
+                    for state in self.all_states]
 
-    for state in all_states:
-        bad_problem = True
-        for successor in state_graph.successors(state):
-            if successor not in closable_states:
-                bad_problem = False
-                break
-        if bad_problem:
-            error(statefile, "All successor states of %s are closable!" % state.name, 
-                  row=0, col=0, errtype="WARNING")
+        for node, state in enumerate(self.all_states):
+            successors = state_graph.successors(node)
+            if not successors:
+                self.error("%s is a dead end: it never transitions to another"
+                           " state." % state.name,
+                           row=0, col=0, errtype="WARNING")
+            elif all(closable[successor] for successor in successors):
+                self.error("All successor states of %s are closable!" % state.name, 
+                           row=0, col=0, errtype="WARNING")
 
-    return state_graph
+        return state_graph
 
-def cull_nops():
-    # Everything about action IDs are auto-computing.
-    
-    nops_to_delete = set()
-    
-    for before_nop in all_actions:
-        # This doesn't cover all POSSIBLE cases, but it does cover all
-        #  ALLOWED cases: (except that NOPs at the start of an action sequence
-        #  are not deleted. btw, those are the only ones that could be in a 
-        #  choice set.
-        if before_nop.next_action and before_nop.next_action.action_type == 'NOP':
-            nop = before_nop.next_action
-            after_nop = nop.next_action
-            if after_nop:
-                after_nop.prev_action = before_nop
-            before_nop.next_action = after_nop
-            nops_to_delete.add(nop)
-    
-    for action in nops_to_delete:
-        all_actions.remove(action)
-        if action in main_actions:
-            main_actions.remove(action)
-        else:
-            aux_actions.remove(action)
+    def cull_nops(self):
+        # Everything about action IDs are auto-computing.
+    
+        nops_to_delete = set()
+    
+        for before_nop in self.all_actions:
+            # This doesn't cover all POSSIBLE cases, but it does cover all
+            #  ALLOWED cases: (except that NOPs at the start of an action sequence
+            #  are not deleted. btw, those are the only ones that could be in a 
+            #  choice set.
+            if before_nop.next_action and before_nop.next_action.action_type == 'NOP':
+                nop = before_nop.next_action
+                after_nop = nop.next_action
+                if after_nop:
+                    after_nop.prev_action = before_nop
+                before_nop.next_action = after_nop
+                nops_to_delete.add(nop)
+    
+        # Filter each list once; removing the NOPs one at a time is quadratic.
+        self.all_actions = [action for action in self.all_actions
+                            if action not in nops_to_delete]
+        self.main_actions = [action for action in self.main_actions
+                             if action not in nops_to_delete]
+        self.aux_actions = [action for action in self.aux_actions
+                            if action not in nops_to_delete]
             
-def escape_action(action):
-    return str(action).replace(':', ' ').replace('\\', '/').replace('\x96', '`')
-
-def get_action_graph():
-    action_graph = nx.MultiDiGraph()
-    # for action in all_actions:
-        # action_graph.add_node(str(action))
-        
-    for state in all_states:
-        if state.id == 0:
-            action_graph.add_node(str(state).replace(':', ' '), shape='star')
+    def strip_unreachable(self):
+        """Remove every state, action and text string that the badge can't
+        ever get to.
+        
+        The badge starts in the first state. From any state it can get to,
+        it can run any of that state's events, and so any action in them,
+        and so any state that those actions transition to. (PREVIOUS and POP
+        only ever go back to a state that it has already been to.) Text is
+        kept if a reachable action or user input uses it. Animations and
+        OTHER types are left alone, because their IDs have to match the
+        badge's.
+        """
+        unstripped_len = sum(self.region_lengths())
+        reached_states = set([self.all_states[0]])
+        reached_actions = set()
+        states_to_visit = [self.all_states[0]]
+        while states_to_visit:
+            state = states_to_visit.pop()
+            actions_to_visit = [first_action for first_action in
+                                state.events.values() if first_action]
+            while actions_to_visit:
+                action = actions_to_visit.pop()
+                if action in reached_actions:
+                    continue
+                reached_actions.add(action)
+                if action.action_type == 'STATE_TRANSITION' and \
+                        action.detail not in reached_states:
+                    reached_states.add(action.detail)
+                    states_to_visit.append(action.detail)
+                for successor in (action.next_action, action.next_choice):
+                    if successor:
+                        actions_to_visit.append(successor)
+        
+        self.stripped_states = [unreached.name for unreached in
+                                self.all_states
+                                if unreached not in reached_states]
+        for name in self.stripped_states:
+            self.symbol_log.pop(name, None)
+        self.all_states = [reached for reached in self.all_states
+                           if reached in reached_states]
+        self.state_name_ids.clear()
+        for i, state in enumerate(self.all_states):
+            state.id = i
+            self.state_name_ids[state.name] = i
+        
+        count = len(self.all_actions)
+        self.all_actions = [reached for reached in self.all_actions
+                            if reached in reached_actions]
+        self.main_actions = [kept for kept in self.all_actions 
+                             if not kept.aux]
+        self.aux_actions = [kept for kept in self.all_actions 
+                            if kept.aux]
+        self.stripped_actions = count - len(self.all_actions)
+        
+        used_text = set(action.detail for action in self.all_actions
+                        if action.action_type.startswith('TEXT'))
+        used_text.update(user_input.text for state in self.all_states
+                         for user_input in state.inputs)
+        count = len(self.main_text) + len(self.aux_text)
+        self.main_text = [text for text in self.main_text if text in used_text]
+        self.aux_text = [text for text in self.aux_text if text in used_text]
+        self.main_text_set = set(self.main_text)
+        self.aux_text_set = set(self.aux_text)
+        self.stripped_text = count - len(self.main_text) - len(self.aux_text)
+        self.stripped_bytes = unstripped_len - sum(self.region_lengths())
+    
+    def merge_actions(self):
+        """Merge every set of identical actions into a single action.
+        
+        Two actions are identical if they have the same type, detail,
+        duration and choice share, and their next actions and next choices
+        are identical too, so shared tails of action sequences (and whole
+        identical choice sets) end up stored once. Whichever copy comes first
+        is kept, and everything that pointed at the others points at it
+        instead. Returns the number of actions removed.
+        """
+        # Number the classes of identical actions, successors first.
+        classes = dict()
+        class_of = dict()
+        for action in self.all_actions:
+            stack = [action]
+            while stack:
+                top = stack[-1]
+                if top in class_of:
+                    stack.pop()
+                    continue
+                pending = [successor for successor in 
+                           (top.next_action, top.next_choice)
+                           if successor and successor not in class_of]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                key = (top.action_type, top.detail, top.duration,
+                       top.choice_share, top.choice_total, top.aux,
+                       # The first choice of a choice set has to stay first.
+                       top.prev_choice is None,
+                       class_of.get(top.next_action),
+                       class_of.get(top.next_choice))
+                class_of[top] = classes.setdefault(key, len(classes))
+        
+        kept = dict()
+        for action in self.all_actions:
+            kept.setdefault(class_of[action], action)
+        def canonical(action):
+            return kept[class_of[action]] if action else action
+        
+        for action in self.all_actions:
+            action.next_action = canonical(action.next_action)
+            action.next_choice = canonical(action.next_choice)
+            action.prev_action = canonical(action.prev_action)
+            action.prev_choice = canonical(action.prev_choice)
+        for state in self.all_states:
+            for input_tuple in state.events:
+                state.events[input_tuple] = canonical(state.events[input_tuple])
+            state.entry_sequence_start = canonical(state.entry_sequence_start)
+            for event in state.timers + state.inputs + state.other_ins:
+                event.result = canonical(event.result)
+        
+        count = len(self.all_actions)
+        self.all_actions = [action for action in self.all_actions
+                            if kept[class_of[action]] is action]
+        self.main_actions = [action for action in self.all_actions 
+                             if not action.aux]
+        self.aux_actions = [action for action in self.all_actions 
+                            if action.aux]
+        self.merged_actions = count - len(self.all_actions)
+        return self.merged_actions
+    
+    def assign_ids(self, id_map=None):
+        # Build the symbol tables that map every action, state, text string,
+        #  animation and OTHER output to its integer ID. This has to run
+        #  after anything that adds or removes actions (e.g. cull_nops()), and
+        #  before anything that packs or prints them.
+        # Without an id_map, IDs are dense and in creation order. With one,
+        #  everything keeps the ID it had in the previous build if it can.
+        # Creation order is already the order that each action sequence runs
+        #  in (see action_locality()), so actions aren't reordered for the
+        #  sake of flash reads: every layout we've tried that groups choices,
+        #  or follows the action graph, comes out the same or worse.
+        if id_map is None:
+            self.action_table = list(self.all_actions)
+            self.state_table = list(self.all_states)
+            self.main_text_table = list(self.main_text)
+            self.text_table = self.main_text + self.aux_text
         else:
-            action_graph.add_node(str(state).replace(':', ' '), shape='box')
-        for input_tuple in state.events:
-            if not state.events[input_tuple]:
-                continue
-            action_graph.add_edge(
-                str(state).replace(':', ' '),
-                str(state.events[input_tuple]).replace(':', ' ').replace('\x96', '`'),
-                label=str(input_tuple)
-            )
-
-    for action in all_actions:
-        if action.next_action:
-            action_graph.add_edge(escape_action(action), escape_action(action.next_action),
-                                  label="next")
-        if action.next_choice:
-            action_graph.add_edge(escape_action(action), escape_action(action.next_choice),
-                                  label="alt")
-        if action.action_type == 'STATE_TRANSITION':
-            action_graph.add_edge(
-                escape_action(action),
-                str(action.detail).replace(':', ' ')
-            )
+            self.assign_stable_ids(id_map)
+        self.text_pool = None
+        
+        for i, action in enumerate(self.action_table):
+            if action is not None:
+                action.action_id = i
+        # (state_name_ids stays as the index into all_states, which is what
+        #  everything that looks states up by name expects.)
+        for i, state in enumerate(self.state_table):
+            if state is not None:
+                state.id = i
     
-    # TODO: Add PREVIOUS lines!
-
-    undirected = action_graph.to_undirected()
-    if not nx.is_connected(undirected):
-        error(statefile, "Detected that the action graph may not be connected!",
-              row=0, col=0, errtype="WARNING")
-
-    return action_graph
+        # Text that's in main_text wins over a copy in aux_text, same as always.
+        self.text_ids.clear()
+        for i, text in enumerate(self.text_table):
+            if text is not None:
+                self.text_ids.setdefault(text, i)
+    
+        self.animation_ids.clear()
+        for i, animation in enumerate(self.all_animations):
+            self.animation_ids.setdefault(animation, i)
+    
+        self.other_output_ids.clear()
+        for i, other_type in enumerate(self.all_other_output_descs):
+            self.other_output_ids.setdefault(other_type, i)
 
-    
\ No newline at end of file
+    def action_locality(self):
+        # The fraction of next_action links that go to the very next action
+        #  record, i.e. how contiguous the action sequences are in the packed
+        #  image. Most of the rest are where several choices join back into
+        #  one sequence, and (after merge_actions()) shared tails.
+        links = [(action.id(), action.next_action.id()) for action in
+                 self.all_actions if action.next_action]
+        if not links:
+            return 1.0
+        return sum(1 for action_id, next_id in links
+                   if next_id == action_id + 1) / float(len(links))
+    
+    def action_keys(self):
+        # An action is identified by where it is (its state, its event, and
+        #  how many actions for that event came before it) and what it does.
+        keys = []
+        ordinals = dict()
+        for action in self.all_actions:
+            position = (action.state_name,) + tuple(action.input_tuple)
+            ordinal = ordinals.get(position, 0)
+            ordinals[position] = ordinal + 1
+            
+            detail = action.detail
+            if isinstance(detail, GameState):
+                detail = detail.name
+            elif detail is None:
+                detail = ''
+            keys.append(position + (ordinal, action.action_type, detail))
+        return keys
+    
+    def assign_stable_ids(self, id_map):
+        self.action_table = id_map.allocate(
+            'actions', self.all_actions, self.action_keys(),
+            # If there's no exact match, first try to find the same action
+            #  somewhere else in its event (because a row was inserted or
+            #  deleted), then whatever used to be in its position (because
+            #  it was edited).
+            projections=(None, lambda key: key[:3] + key[4:], 
+                         lambda key: key[:4])
+        )
+        # The first state is always the initial state, so it has to be 0.
+        self.state_table = id_map.allocate(
+            'states', self.all_states, 
+            [(state.name,) for state in self.all_states], pin_first=True
+        )
+        
+        # Main text is addressed first, then aux text after it. Leave some
+        #  room between them so that new main text doesn't shift all the aux.
+        main_text = set(self.main_text)
+        aux_text = [text for text in self.aux_text if text not in main_text]
+        self.main_text_table = id_map.allocate(
+            'main_text', self.main_text, [(text,) for text in self.main_text]
+        )
+        aux_base = id_map.base('aux_text', len(self.main_text_table))
+        self.main_text_table += [None] * (aux_base - len(self.main_text_table))
+        self.text_table = self.main_text_table + id_map.allocate(
+            'aux_text', aux_text, [(text,) for text in aux_text]
+        )
+    
+    def state_edges(self):
+        # Every edge of the state graph, as (from state, to state, label):
+        #  one for every STATE_TRANSITION, and then one from every state with
+        #  a PREVIOUS action back to every state with an edge into it so far.
+        edges = []
+        predecessors = dict() # State -> states with an edge to it, in order
+        def add_edge(source, target, label):
+            edges.append((source, target, label))
+            if source not in predecessors.setdefault(target, []):
+                predecessors[target].append(source)
+        
+        for action in self.all_actions:
+            if action.action_type == 'STATE_TRANSITION':
+                add_edge(self.all_states[self.state_name_ids[action.state_name]],
+                         action.detail, str(action.input_tuple))
+        
+        for action in self.all_actions:
+            if action.action_type == 'PREVIOUS':
+                node = self.all_states[self.state_name_ids[action.state_name]]
+                for predecessor in list(predecessors.get(node, ())):
+                    add_edge(node, predecessor,
+                             str(action.input_tuple)+' PREVIOUS')
+        return edges
+    
+    def action_edges(self):
+        # Every edge of the action graph, as (from, to, label), where from
+        #  and to are GameStates or GameActions: from each state to the first
+        #  action of each of its events, from each action to its next action
+        #  and its next choice, and from each STATE_TRANSITION to its state.
+        for state in self.all_states:
+            for input_tuple, first_action in sorted(state.events.items()):
+                if first_action:
+                    yield (state, first_action, str(input_tuple))
+        
+        for action in self.all_actions:
+            if action.next_action:
+                yield (action, action.next_action, "next")
+            if action.next_choice:
+                yield (action, action.next_choice, "alt")
+            if action.action_type == 'STATE_TRANSITION':
+                yield (action, action.detail, None)
+        
+        # TODO: Add PREVIOUS lines!
+    
+    def check_action_graph(self):
+        # Warn if the action graph falls apart into more than one piece.
+        #  Every state and action starts out in a set of its own, and each
+        #  edge joins two sets together.
+        parents = dict()
+        def find(node):
+            while parents.get(node, node) is not node:
+                parents[node] = parents.get(parents[node], parents[node])
+                node = parents[node]
+            return node
+        
+        pieces = len(self.all_states) + len(self.all_actions)
+        for source, target, label in self.action_edges():
+            source, target = find(source), find(target)
+            if source is not target:
+                parents[source] = target
+                pieces -= 1
+        if pieces > 1:
+            self.error("Detected that the action graph may not be connected!",
+                       row=0, col=0, errtype="WARNING")
@@ -0,0 +1,193 @@
+"""State graph analysis for QC15's Statemaker tool.
+
+The state graph is kept as integer adjacency arrays (compressed sparse rows),
+with each state numbered by its place in the build's list of states, rather
+than as a graph of objects. That's all that the checks need, and it stays
+quick, and small, even with 100,000 states.
+"""
+
+from __future__ import print_function
+
+import sys
+from array import array
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+def compress(count, heads, tails):
+    # Sorts the edges heads[i] -> tails[i] (all numbered 0 to count-1) by
+    #  head, keeping each head's edges in their original order. Returns
+    #  (offsets, tails, order), where head h's edges go to
+    #  tails[offsets[h]:offsets[h+1]], and order[j] is the original number of
+    #  the j-th sorted edge.
+    offsets = array('l', [0]) * (count + 1)
+    for head in heads:
+        offsets[head + 1] += 1
+    for node in range(count):
+        offsets[node + 1] += offsets[node]
+    free = offsets[:-1]
+    sorted_tails = array('l', [0]) * len(heads)
+    order = array('l', [0]) * len(heads)
+    for edge, head in enumerate(heads):
+        slot = free[head]
+        free[head] += 1
+        sorted_tails[slot] = tails[edge]
+        order[slot] = edge
+    return offsets, sorted_tails, order
+
+class StateGraph(object):
+    """The states of a GameBuild, and the edges between them.
+
+    states is a list of GameStates, and edges is a list of (from state, to
+    state, label), such as GameBuild.state_edges() gives. State i's edges go
+    to targets[offsets[i]:offsets[i+1]], with their labels at the same
+    places in labels, and its edges in come from
+    sources[in_offsets[i]:in_offsets[i+1]].
+    """
+    def __init__(self, states, edges):
+        self.states = list(states)
+        number = dict((state, i) for i, state in enumerate(self.states))
+        heads = array('l', [number[source] for source, target, label in edges])
+        tails = array('l', [number[target] for source, target, label in edges])
+        count = len(self.states)
+        self.offsets, self.targets, order = compress(count, heads, tails)
+        self.labels = [edges[edge][2] for edge in order]
+        self.in_offsets, self.sources, order = compress(count, tails, heads)
+
+    def __len__(self):
+        return len(self.states)
+
+    def successors(self, node):
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def predecessors(self, node):
+        return self.sources[self.in_offsets[node]:self.in_offsets[node + 1]]
+
+    def edges(self):
+        """Every edge, as (from state, to state, label)."""
+        for node, state in enumerate(self.states):
+            for edge in range(self.offsets[node], self.offsets[node + 1]):
+                yield (state, self.states[self.targets[edge]],
+                       self.labels[edge])
+
+    def weak_components(self):
+        """The groups of states that are connected if the direction of the
+        edges is ignored, as lists of state numbers."""
+        component = array('l', [-1]) * len(self)
+        components = []
+        for root in range(len(self)):
+            if component[root] >= 0:
+                continue
+            component[root] = len(components)
+            members = [root]
+            # members grows as we go, so this visits all of them.
+            for node in members:
+                for neighbours in (self.successors(node),
+                                   self.predecessors(node)):
+                    for neighbour in neighbours:
+                        if component[neighbour] < 0:
+                            component[neighbour] = len(components)
+                            members.append(neighbour)
+            components.append(members)
+        return components
+
+    def is_connected(self):
+        return len(self.weak_components()) <= 1
+
+    def strong_components(self):
+        """The groups of states that can all get to each other, as lists of
+        state numbers. Each group can only get to the groups before it."""
+        # Tarjan's algorithm, without recursion, keeping our place in each
+        #  state's edges in next_edge.
+        count = len(self)
+        index = array('l', [-1]) * count
+        lowlink = array('l', [0]) * count
+        next_edge = self.offsets[:-1]
+        on_stack = bytearray(count)
+        stack = []
+        components = []
+        visited = 0
+        for root in range(count):
+            if index[root] >= 0:
+                continue
+            index[root] = lowlink[root] = visited
+            visited += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [root]
+            while work:
+                node = work[-1]
+                edge = next_edge[node]
+                if edge < self.offsets[node + 1]:
+                    next_edge[node] = edge + 1
+                    target = self.targets[edge]
+                    if index[target] < 0:
+                        index[target] = lowlink[target] = visited
+                        visited += 1
+                        stack.append(target)
+                        on_stack[target] = 1
+                        work.append(target)
+                    elif on_stack[target] and index[target] < lowlink[node]:
+                        lowlink[node] = index[target]
+                    continue
+                work.pop()
+                if work and lowlink[node] < lowlink[work[-1]]:
+                    lowlink[work[-1]] = lowlink[node]
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+        return components
+
+    def has_loop(self, node):
+        return node in self.successors(node)
+
+    def dead_ends(self):
+        """The numbers of the states with no edges out of them."""
+        return [node for node in range(len(self))
+                if self.offsets[node] == self.offsets[node + 1]]
+
+    def closed_components(self, components=None):
+        """The strong components that have no edges out of them, so that
+        once the badge gets to one, it can never leave."""
+        if components is None:
+            components = self.strong_components()
+        component = array('l', [0]) * len(self)
+        for i, members in enumerate(components):
+            for member in members:
+                component[member] = i
+        return [members for i, members in enumerate(components)
+                if all(component[target] == i for member in members
+                       for target in self.successors(member))]
+
+    def report(self, outfile=sys.stdout):
+        """Print the shape of the graph: its components, and any dead ends
+        and closed groups of states."""
+        components = self.strong_components()
+        names = lambda members: ', '.join(
+            self.states[member].name for member in sorted(members)
+        )
+        print("%d states, %d edges, %d weakly connected components, %d"
+              " strongly connected components (the largest has %d states)."
+              % (len(self), len(self.targets), len(self.weak_components()),
+                 len(components),
+                 max(len(members) for members in components)
+                 if components else 0), file=outfile)
+        dead_ends = self.dead_ends()
+        if dead_ends:
+            print("Dead ends (no way out): %s" % names(dead_ends),
+                  file=outfile)
+        for members in self.closed_components(components):
+            if 0 in members or (len(members) == 1 and
+                                not self.has_loop(members[0])):
+                # The first state's, or a dead end.
+                continue
+            print("Closed (no way out once entered): %s" % names(members),
+                  file=outfile)
@@ -0,0 +1,133 @@
+"""Stable ID allocation for QC15's Statemaker tool.
+
+Normally, actions, states and text get their IDs in the order that they're
+created, so adding one row near the top of the statefile renumbers almost
+everything after it. An IdMap remembers which thing had which ID in the
+previous build, so that it can hand out the same IDs again, and only the
+parts of the image that really changed have to change.
+"""
+
+from __future__ import print_function
+
+import os
+import json
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+def _to_json_text(value):
+    # The statefile is read as bytes, and TEXT can contain things (like \x96)
+    #  that aren't valid UTF-8, so go through latin-1, which round-trips.
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    return value
+
+def _from_json_text(value):
+    # On Python 2, json gives us back unicode, but the statefile is str.
+    if isinstance(value, type(u'')) and not isinstance(value, str):
+        return value.encode('latin-1')
+    return value
+
+class IdMap(object):
+    def __init__(self, tables=None, bases=None):
+        # Table name -> {id: key}, where a key is a tuple of strings and ints.
+        self.tables = tables if tables is not None else dict()
+        # Table name -> the first ID of a table that lives after another one.
+        self.bases = bases if bases is not None else dict()
+
+    @staticmethod
+    def load(path):
+        # A missing map is fine; it just means this is the first build.
+        if not os.path.isfile(path):
+            return IdMap()
+        with open(path) as map_file:
+            contents = json.load(map_file)
+        bases = dict((str(name), int(base)) for name, base in 
+                     contents.pop('bases', dict()).items())
+        tables = dict()
+        for name, entries in contents.items():
+            tables[str(name)] = dict(
+                (int(entry[0]), tuple(map(_from_json_text, entry[1:])))
+                for entry in entries
+            )
+        return IdMap(tables, bases)
+
+    def save(self, path):
+        contents = dict()
+        for name, table in self.tables.items():
+            contents[name] = [
+                [item_id] + list(map(_to_json_text, table[item_id]))
+                for item_id in sorted(table)
+            ]
+        contents['bases'] = self.bases
+        with open(path, 'w') as map_file:
+            json.dump(contents, map_file, indent=1, sort_keys=True)
+
+    def allocate(self, name, items, keys, projections=(None,),
+                 pin_first=False):
+        """Return a table of items, indexed by their stable IDs.
+
+        ``keys`` holds the key of each item. Items are matched up with the
+        previous build's IDs first by their whole key, then by each of the
+        ``projections`` of it in turn, so that (for example) an action whose
+        text was edited can keep the ID of the action that used to be in the
+        same position. Anything left over gets the lowest free ID. Unused
+        IDs in the table are None.
+        """
+        unclaimed = dict(self.tables.get(name, dict()))
+        ids = [None] * len(items)
+
+        if pin_first and items:
+            # The first item always gets ID 0, whatever used to have it.
+            ids[0] = 0
+            unclaimed.pop(0, None)
+
+        for project in projections:
+            if project is None:
+                project = lambda key: key
+            candidates = dict()
+            for old_id in sorted(unclaimed):
+                candidates.setdefault(project(unclaimed[old_id]), []).append(old_id)
+
+            for i, key in enumerate(keys):
+                if ids[i] is not None:
+                    continue
+                matches = candidates.get(project(key))
+                while matches and matches[0] not in unclaimed:
+                    matches.pop(0)
+                if matches:
+                    ids[i] = matches.pop(0)
+                    del unclaimed[ids[i]]
+
+        # Everything that's left gets the lowest ID nobody else is using.
+        used = set(item_id for item_id in ids if item_id is not None)
+        next_free = 0
+        for i in range(len(items)):
+            if ids[i] is not None:
+                continue
+            while next_free in used:
+                next_free += 1
+            ids[i] = next_free
+            used.add(next_free)
+
+        table = [None] * (max(used) + 1 if used else 0)
+        for item, item_id in zip(items, ids):
+            table[item_id] = item
+        self.tables[name] = dict(zip(ids, keys))
+        return table
+
+    def base(self, name, minimum, slack=16):
+        """Return the first ID for a table that comes after another one.
+
+        The base only moves when the table before it has grown past it, and
+        then it leaves some room to grow (up to the next multiple of slack
+        after minimum, so always at least one ID), so that the following
+        table doesn't shift every time one entry is added ahead of it.
+        """
+        base = self.bases.get(name)
+        if base is None or base < minimum:
+            base = minimum + slack - minimum % slack
+        self.bases[name] = base
+        return base
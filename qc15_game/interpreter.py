@@ -0,0 +1,442 @@
+"""Host-side interpreter for QC15 game images.
+
+Runs the text, action and state regions that statemaker packs, the same way
+the badge does, so that game logic can be tested without a badge. Time is
+virtual, in the badge's 1/32 second ticks, and the interpreter jumps straight
+from one event to the next, so hours of badge time take seconds.
+"""
+
+from __future__ import print_function
+
+import re
+import random
+import struct
+
+from intelhex import IntelHex
+
+from qc15_game.game_state import GameAction, GameState, GameTimer, \
+                                 GameInput, GameOther, GameChoiceSet, \
+                                 TEXT_RECORD_LEN
+from qc15_game.timing import timer_due
+from qc15_game import *
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+RESULT_TYPE_NAMES = dict((number, name) for name, number in
+                         RESULT_TYPE_OUTPUT.items())
+
+def read_defines(header):
+    # All of the #defines in a header generated by statemaker, plus the
+    #  animation names, which are in a comment.
+    defines = dict()
+    animations = []
+    for line in header:
+        match = re.match(r'#define (\w+) (\d+)', line)
+        if match:
+            defines[match.group(1)] = int(match.group(2))
+        elif line.startswith('// ') and not animations:
+            animations = line[3:].strip().split(', ')
+    return defines, animations
+
+class GameImage(object):
+    """A packed game, decoded into plain tuples for the interpreter."""
+    def __init__(self, flash, defines, animations=(), text_loc=0x310000,
+                 action_loc=0x300000, state_loc=0x320000, choice_loc=None):
+        self.flash = flash
+        self.defines = defines
+        self.animations = list(animations)
+        self.text_loc = text_loc
+        self.texts = dict()
+
+        # Each action is (type, detail, duration, next_action, next_choice,
+        #  choice_share, choice_total).
+        record = GameAction.record
+        data = flash.tobinstr(start=action_loc,
+                              size=defines['ALL_ACTIONS_LEN'] * record.size)
+        self.actions = [record.unpack_from(data, offset) for offset in
+                        range(0, len(data), record.size)]
+
+        # Each state is (entry_series_id, timers, inputs, others), where
+        #  timers are (duration, recurring, result_action_id), inputs are
+        #  (text_addr, result_action_id), and others are (type_id,
+        #  result_action_id). If the image has them, each state's timer
+        #  indices in deadline order are in timer_orders.
+        state_count = defines['all_states_len']
+        timer_order = 'TIMER_DEADLINE_ORDER' in defines
+        def order_len(timers):
+            # The deadline order is padded to an even number of bytes.
+            return timers + (timers & 1) if timer_order else 0
+        if 'STATE_RECORDS_INDEXED' in defines:
+            # Records are found through the offset index, and have no
+            #  unused slots.
+            data = flash.tobinstr(start=state_loc,
+                                  size=defines['STATE_REGION_LEN'])
+            offsets = struct.unpack_from('<%dH' % state_count, data, 0)
+            slots = None
+        else:
+            slots = (defines['MAX_TIMERS'], defines['MAX_INPUTS'],
+                     defines['MAX_OTHERS'])
+            state_record_len = GameState.header.size + \
+                               slots[0] * GameTimer.record.size + \
+                               order_len(slots[0]) + \
+                               slots[1] * GameInput.record.size + \
+                               slots[2] * GameOther.record.size
+            data = flash.tobinstr(start=state_loc,
+                                  size=state_count * state_record_len)
+            offsets = range(0, len(data), state_record_len)
+        self.states = []
+        self.timer_orders = []
+        for offset in offsets:
+            if offset == NULL:
+                self.states.append((NULL, [], [], []))
+                self.timer_orders.append([])
+                continue
+            header = GameState.header.unpack_from(data, offset)
+            offset += GameState.header.size
+            series = []
+            for i, record in enumerate((GameTimer.record, GameInput.record,
+                                        GameOther.record)):
+                count = header[i + 1]
+                series.append([record.unpack_from(data, offset + j * record.size)
+                               for j in range(count)])
+                offset += (slots[i] if slots else count) * record.size
+                if i == 0 and timer_order:
+                    self.timer_orders.append(
+                        list(bytearray(data[offset:offset + count])))
+                    offset += order_len(slots[0] if slots else count)
+            if not timer_order:
+                self.timer_orders.append(range(header[1]))
+            self.states.append((header[0],) + tuple(series))
+
+        # If the image has a choice table region (and we know where), the
+        #  first action ID of each choice set -> (count, total, entries),
+        #  where entries are the (threshold, action ID[, alias action ID])
+        #  records.
+        self.choice_table = None
+        self.choice_sets = dict()
+        for table_type in CHOICE_TABLE_TYPES:
+            if 'CHOICE_TABLE_%s' % table_type.upper() in defines:
+                self.choice_table = table_type
+        if self.choice_table and choice_loc is not None:
+            self.read_choice_sets(choice_loc)
+
+        self.state_names = dict()
+        self.other_input_ids = dict()
+        self.other_output_names = dict()
+        for name, value in defines.items():
+            if name.startswith('STATE_ID_'):
+                self.state_names[value] = name[len('STATE_ID_'):]
+            elif name.startswith('SPECIAL_'):
+                self.other_input_ids[name[len('SPECIAL_'):]] = value
+            elif name.startswith('OTHER_ACTION_'):
+                self.other_output_names[value] = name[len('OTHER_ACTION_'):]
+
+    def read_choice_sets(self, choice_loc):
+        action_count = self.defines['ALL_ACTIONS_LEN']
+        data = self.flash.tobinstr(start=choice_loc, size=action_count * 2)
+        offsets = struct.unpack('<%dH' % action_count, data)
+        header = GameChoiceSet.header
+        record = GameChoiceSet.records[self.choice_table]
+        for action_id, offset in enumerate(offsets):
+            if offset == NULL:
+                continue
+            count, total = header.unpack(self.flash.tobinstr(
+                start=choice_loc + offset, size=header.size))
+            data = self.flash.tobinstr(start=choice_loc + offset + header.size,
+                                       size=count * record.size)
+            entries = [record.unpack_from(data, i * record.size)
+                       for i in range(count)]
+            self.choice_sets[action_id] = (count, total, entries)
+
+    @staticmethod
+    def load(image_path, header_path, text_loc=0x310000, action_loc=0x300000,
+             state_loc=0x320000, choice_loc=None):
+        flash = IntelHex()
+        if image_path.endswith('.hex'):
+            flash.loadhex(image_path)
+        else:
+            # A .bin image starts at the lowest address that statemaker wrote.
+            locs = [text_loc, action_loc, state_loc]
+            if choice_loc is not None:
+                locs.append(choice_loc)
+            flash.loadbin(image_path, offset=min(locs))
+        with open(header_path) as header:
+            defines, animations = read_defines(header)
+        return GameImage(flash, defines, animations, text_loc, action_loc,
+                         state_loc, choice_loc)
+
+    def text(self, text_addr):
+        if text_addr not in self.texts:
+            start = self.text_loc + text_addr * TEXT_RECORD_LEN
+            if 'TEXT_POOLED' in self.defines:
+                # Look the string up in the offset table instead.
+                start = self.text_loc + struct.unpack(
+                    '<H', self.flash.tobinstr(start=self.text_loc + text_addr * 2,
+                                              size=2))[0]
+            record = self.flash.tobinstr(start=start, size=TEXT_RECORD_LEN)
+            self.texts[text_addr] = record.split(b'\0', 1)[0]
+        return self.texts[text_addr]
+
+    def state_name(self, state_id):
+        return self.state_names.get(state_id, str(state_id))
+
+    def animation_name(self, animation_id):
+        if animation_id == NULL:
+            return 'NONE'
+        if animation_id < len(self.animations):
+            return self.animations[animation_id]
+        return str(animation_id)
+
+class Badge(object):
+    """One virtual badge, running a GameImage.
+
+    The badge is either busy, running an action sequence, or idle. Timers
+    count from the end of the current state's ENTER sequence, and one that
+    comes due while a sequence is running pre-empts it (see
+    qc15_game.timing.timer_due()). Inputs and NET events are only accepted
+    while the badge is idle.
+
+    listener, if given, is called as listener(badge, kind, detail) for
+    everything visible that the badge does. kind is one of 'enter' (detail is
+    the state ID), 'text' (the text), 'anim_temp' and 'anim_bg' (the
+    animation name), 'other' (the OTHER output name), and 'close' (the state
+    ID).
+    """
+    def __init__(self, image, seed=None, badge_name='Skippy',
+                 user_name='human', connected_name='Skippy', badges_nearby=0,
+                 listener=None):
+        self.image = image
+        self.random = random.Random(seed)
+        self.listener = listener
+        self.variables = {
+            'TEXT_BADGENAME' : badge_name,
+            'TEXT_USER_NAME' : user_name,
+            'TEXT_CNCTDNAME' : connected_name,
+            'TEXT_CNT' : badges_nearby,
+        }
+
+        self.clock = 0
+        self.state = None
+        self.previous_state = None
+        self.pushed_state = None
+        self.closed_states = set()
+        self.locked_out = dict() # First action ID -> locked out?
+
+        # While we're busy, next_action is the next choice set to run, at
+        #  resume_at (NULL meaning that the sequence is done). While we're
+        #  idle, resume_at is None.
+        self.next_action = NULL
+        self.resume_at = None
+
+        # The clock time at which this state's ENTER sequence finished (None
+        #  until it has), and when the last timer to fire came due, counting
+        #  from then.
+        self.timer_start = None
+        self.timer_floor = 0
+
+        self.enter_state(0)
+
+    def busy(self):
+        return self.resume_at is not None
+
+    def notify(self, kind, detail):
+        if self.listener:
+            self.listener(self, kind, detail)
+
+    def enter_state(self, state_id):
+        self.previous_state = self.state
+        self.state = state_id
+        self.timer_start = None
+        self.timer_floor = 0
+        self.notify('enter', state_id)
+        self.start_sequence(self.image.states[state_id][0])
+
+    def start_sequence(self, action_id):
+        # Anything that was still running is abandoned.
+        self.next_action = action_id
+        self.resume_at = self.clock
+
+    def is_locked_out(self, action_id):
+        # The badge locks out an event if its first action sequence (following
+        #  only the first choice of each choice set) transitions to a closed
+        #  state.
+        if action_id not in self.locked_out:
+            locked = False
+            next_action = action_id
+            while next_action != NULL:
+                action = self.image.actions[next_action]
+                if action[0] == RESULT_TYPE_OUTPUT['STATE_TRANSITION'] and \
+                        action[1] in self.closed_states:
+                    locked = True
+                    break
+                next_action = action[3]
+            self.locked_out[action_id] = locked
+        return self.locked_out[action_id]
+
+    def choose(self, action_id):
+        # Pick one action out of the choice set that starts at action_id.
+        action = self.image.actions[action_id]
+        if action[4] == NULL:
+            return action_id, action
+        if not action[6]:
+            # None of the choices has a share, so they're all as likely as
+            #  each other, as in qc15_game.timing.TimingAnalysis.combine().
+            members = [action_id]
+            while self.image.actions[members[-1]][4] != NULL:
+                members.append(self.image.actions[members[-1]][4])
+            choice_id = members[self.random.randrange(len(members))]
+            return choice_id, self.image.actions[choice_id]
+        if action_id in self.image.choice_sets:
+            # One draw, and no walking the list, just like the badge does
+            #  with a choice table.
+            count, total, entries = self.image.choice_sets[action_id]
+            if self.image.choice_table == 'alias':
+                bucket, pick = divmod(self.random.randrange(count * total),
+                                      total)
+                threshold, choice_id, alias_id = entries[bucket]
+                if pick >= threshold:
+                    choice_id = alias_id
+            else:
+                pick = self.random.randrange(total)
+                choice_id = next(choice_id for threshold, choice_id in entries
+                                 if pick < threshold)
+            return choice_id, self.image.actions[choice_id]
+        pick = self.random.randrange(action[6])
+        while True:
+            pick -= action[5]
+            if pick < 0 or action[4] == NULL:
+                return action_id, action
+            action_id = action[4]
+            action = self.image.actions[action_id]
+
+    def step(self):
+        # Run the next action in the current sequence.
+        if self.next_action == NULL:
+            # The sequence is over.
+            self.resume_at = None
+            if self.timer_start is None:
+                # It was the ENTER sequence, so the timers start now.
+                self.timer_start = self.clock
+            return
+
+        action_id, action = self.choose(self.next_action)
+        action_type, detail, duration, next_action = action[:4]
+        type_name = RESULT_TYPE_NAMES.get(action_type, 'NOP')
+        self.next_action = next_action
+        self.resume_at = self.clock
+
+        if type_name.startswith('TEXT'):
+            text = self.image.text(detail)
+            if type_name in self.variables:
+                placeholder = '%d' if type_name == 'TEXT_CNT' else '%s'
+                text = text.replace(placeholder, str(self.variables[type_name]),
+                                    1)
+            self.notify('text', text)
+            self.resume_at += duration
+        elif type_name == 'SET_ANIM_TEMP':
+            self.notify('anim_temp', self.image.animation_name(detail))
+        elif type_name == 'SET_ANIM_BG':
+            self.notify('anim_bg', self.image.animation_name(detail))
+        elif type_name == 'OTHER':
+            self.notify('other', self.image.other_output_names.get(
+                detail, str(detail)))
+        elif type_name == 'CLOSE':
+            self.closed_states.add(self.state)
+            self.locked_out.clear()
+            self.notify('close', self.state)
+        elif type_name == 'PUSH':
+            self.pushed_state = self.state
+        elif type_name in ('STATE_TRANSITION', 'PREVIOUS', 'POP'):
+            if type_name == 'STATE_TRANSITION':
+                target = detail
+            elif type_name == 'PREVIOUS':
+                target = self.previous_state
+            else:
+                target = self.pushed_state
+            # A transition to a closed state has no effect.
+            if target is not None and target not in self.closed_states:
+                self.enter_state(target)
+
+    def next_timer(self):
+        # Returns (clock time, time since the end of ENTER, result action ID)
+        #  of the next timer to fire in the current state, or (None, None,
+        #  None) if there aren't any (or ENTER is still running). When more
+        #  than one is due at once, the first one stored wins.
+        if self.timer_start is None:
+            return (None, None, None)
+        best = None # (due, index, result)
+        timers = self.image.states[self.state][1]
+        for index in self.image.timer_orders[self.state]:
+            duration, recurring, result = timers[index]
+            due = timer_due(duration, recurring, self.timer_floor)
+            if due is None:
+                continue
+            if (best is None or (due, index) < best[:2]) and \
+                    not self.is_locked_out(result):
+                best = (due, index, result)
+        if best is None:
+            return (None, None, None)
+        return (self.timer_start + best[0], best[0], best[2])
+
+    def next_event_time(self):
+        # The clock time of the next thing that the badge will do on its own,
+        #  or None if it will sit idle forever.
+        at = self.next_timer()[0]
+        if self.busy() and (at is None or self.resume_at <= at):
+            return self.resume_at
+        return at
+
+    def run_until(self, end):
+        # Run everything that happens up to (and including) clock time end.
+        #  When the next step of a sequence and a timer are due at the same
+        #  time, the step goes first.
+        while True:
+            at, due, result = self.next_timer()
+            if self.busy() and (at is None or self.resume_at <= at):
+                if self.resume_at > end:
+                    break
+                self.clock = self.resume_at
+                self.step()
+                continue
+            if at is None or at > end:
+                break
+            self.clock = at
+            self.timer_floor = due
+            self.start_sequence(result)
+        self.clock = max(self.clock, end)
+
+    def advance(self, ticks):
+        self.run_until(self.clock + ticks)
+
+    def available_inputs(self):
+        # [(index, text)] of the user inputs on offer right now.
+        if self.busy():
+            return []
+        return [(index, self.image.text(text_addr)) for index,
+                (text_addr, result) in enumerate(self.image.states[self.state][2])
+                if not self.is_locked_out(result)]
+
+    def user_input(self, index):
+        # Select a user input. Returns False if it isn't available.
+        if self.busy():
+            return False
+        text_addr, result = self.image.states[self.state][2][index]
+        if self.is_locked_out(result):
+            return False
+        self.start_sequence(result)
+        return True
+
+    def net_event(self, name):
+        # Deliver a NET event, by name (e.g. 'BADGESNEARBY0'). Returns False
+        #  if the current state doesn't handle it right now.
+        type_id = self.image.other_input_ids.get(name.upper())
+        if self.busy() or type_id is None:
+            return False
+        for other_type, result in self.image.states[self.state][3]:
+            if other_type == type_id and not self.is_locked_out(result):
+                self.start_sequence(result)
+                return True
+        return False
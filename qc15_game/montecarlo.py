@@ -0,0 +1,366 @@
+"""Monte Carlo playthroughs of QC15 game images, for game balance.
+
+Plays many independent virtual badges at once, with the same rules as the
+interpreter in qc15_game.interpreter, but with every badge's state held in
+NumPy arrays, so that tens of thousands of badges can be played together.
+Every badge has its own clock, and each pass through the main loop moves
+every badge on to its own next event.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+from qc15_game import *
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+NEVER = np.iinfo(np.int64).max
+
+TEXT_TYPES = [number for name, number in RESULT_TYPE_OUTPUT.items()
+              if name.startswith('TEXT')]
+
+class GameTables(object):
+    """The actions and states of a GameImage, as NumPy arrays."""
+    def __init__(self, image):
+        self.image = image
+        actions = np.array(image.actions, dtype=np.int64).reshape(-1, 7)
+        (self.action_type, self.action_detail, self.action_duration,
+         self.next_action, self.next_choice, self.choice_share,
+         self.choice_total) = actions.T
+
+        # Every action's choice set, as a run of members (starting with the
+        #  action itself) with the running total of their choice shares.
+        members = []
+        cumulative = []
+        self.choice_start = np.zeros(len(image.actions), dtype=np.int64)
+        self.choice_count = np.zeros(len(image.actions), dtype=np.int64)
+        for action_id in range(len(image.actions)):
+            self.choice_start[action_id] = len(members)
+            total = 0
+            choice = action_id
+            while choice != NULL:
+                total += image.actions[choice][5]
+                members.append(choice)
+                cumulative.append(total)
+                choice = image.actions[choice][4]
+            self.choice_count[action_id] = len(members) - \
+                                           self.choice_start[action_id]
+        self.choice_members = np.array(members, dtype=np.int64)
+        self.choice_cumulative = np.array(cumulative, dtype=np.int64)
+        self.max_choices = int(self.choice_count.max()) if members else 1
+
+        # The state that each action's first sequence transitions to, or -1.
+        #  This is what the badge locks events out by, once states close.
+        self.lock_target = np.full(len(image.actions), -1, dtype=np.int64)
+        transition = RESULT_TYPE_OUTPUT['STATE_TRANSITION']
+        for action_id in range(len(image.actions)):
+            next_action = action_id
+            while next_action != NULL:
+                action = image.actions[next_action]
+                if action[0] == transition:
+                    self.lock_target[action_id] = action[1]
+                    break
+                next_action = action[3]
+        self.can_close = bool(
+            (self.action_type == RESULT_TYPE_OUTPUT['CLOSE']).any()
+        )
+
+        state_count = len(image.states)
+        max_timers = max([len(state[1]) for state in image.states] + [1])
+        max_inputs = max([len(state[2]) for state in image.states] + [1])
+        max_others = max([len(state[3]) for state in image.states] + [1])
+        self.entry = np.full(state_count, NULL, dtype=np.int64)
+        # Absent timers have a duration of 0.
+        self.timer_duration = np.zeros((state_count, max_timers), np.int64)
+        self.timer_recurring = np.zeros((state_count, max_timers), bool)
+        self.timer_result = np.zeros((state_count, max_timers), np.int64)
+        self.input_count = np.zeros(state_count, np.int64)
+        self.input_result = np.zeros((state_count, max_inputs), np.int64)
+        self.other_count = np.zeros(state_count, np.int64)
+        self.other_type = np.full((state_count, max_others), -1, np.int64)
+        self.other_result = np.zeros((state_count, max_others), np.int64)
+        for state_id, (entry, timers, inputs, others) in \
+                enumerate(image.states):
+            self.entry[state_id] = entry
+            for i, (duration, recurring, result) in enumerate(timers):
+                self.timer_duration[state_id, i] = duration
+                self.timer_recurring[state_id, i] = recurring
+                self.timer_result[state_id, i] = result
+            self.input_count[state_id] = len(inputs)
+            for i, (text_addr, result) in enumerate(inputs):
+                self.input_result[state_id, i] = result
+            self.other_count[state_id] = len(others)
+            for i, (type_id, result) in enumerate(others):
+                self.other_type[state_id, i] = type_id
+                self.other_result[state_id, i] = result
+
+        text_details = self.action_detail[np.isin(self.action_type,
+                                                  TEXT_TYPES)]
+        self.text_count = int(text_details.max()) + 1 if len(text_details) \
+                          else 0
+
+class Simulation(object):
+    """A batch of badges, played by random players.
+
+    As in play_badge.py, each player waits between think_min and think_max
+    seconds after their badge goes idle, and then picks a random input, and
+    random NET events arrive net_rate times an hour, on average.
+    """
+    def __init__(self, tables, badges, seed=None, think_min=2, think_max=60,
+                 net_rate=30):
+        self.tables = tables
+        self.badges = badges
+        self.random = np.random.RandomState(seed)
+        self.think_min = think_min * TICKS_PER_SECOND
+        self.think_max = think_max * TICKS_PER_SECOND
+        self.net_rate = net_rate
+        self.net_types = np.array(sorted(tables.image.other_input_ids.values()),
+                                  dtype=np.int64)
+
+        state_count = len(tables.entry)
+        self.clock = np.zeros(badges, np.int64)
+        self.state = np.zeros(badges, np.int64)
+        self.previous_state = np.full(badges, -1, np.int64)
+        self.pushed_state = np.full(badges, -1, np.int64)
+        self.closed = np.zeros((badges, state_count if tables.can_close else 1),
+                               bool)
+        self.busy = np.zeros(badges, bool)
+        self.pending = np.full(badges, NULL, np.int64)
+        self.resume_at = np.zeros(badges, np.int64)
+        self.timer_start = np.full(badges, NEVER, np.int64)
+        self.timer_floor = np.zeros(badges, np.int64)
+        self.choose_at = np.full(badges, NEVER, np.int64)
+        self.net_at = self.next_net(np.arange(badges), self.clock)
+
+        # Results.
+        self.state_visits = np.zeros(state_count, np.int64)
+        self.first_visit = np.full((badges, state_count), -1, np.int64)
+        self.text_shown = np.zeros(tables.text_count, np.int64)
+        self.events = 0
+
+        self.enter_state(np.arange(badges), np.zeros(badges, np.int64))
+
+    def next_net(self, badges, now):
+        if not self.net_rate or not len(self.net_types):
+            return np.full(len(badges), NEVER, np.int64)
+        waits = self.random.exponential(3600.0 / self.net_rate, len(badges))
+        return now + (waits * TICKS_PER_SECOND).astype(np.int64)
+
+    def is_locked_out(self, badges, action_ids):
+        # badges and action_ids are broadcast against each other, so for a
+        #  2D array of action IDs (one row per badge), pass badges[:, None].
+        if not self.tables.can_close:
+            return np.zeros(np.broadcast(badges, action_ids).shape, bool)
+        targets = self.tables.lock_target[action_ids]
+        return (targets >= 0) & self.closed[badges, np.maximum(targets, 0)]
+
+    def enter_state(self, badges, targets):
+        np.add.at(self.state_visits, targets, 1)
+        first = self.first_visit[badges, targets]
+        self.first_visit[badges, targets] = np.where(first < 0,
+                                                     self.clock[badges], first)
+        self.previous_state[badges] = self.state[badges]
+        self.state[badges] = targets
+        self.timer_start[badges] = NEVER
+        self.timer_floor[badges] = 0
+        self.choose_at[badges] = NEVER
+        self.busy[badges] = True
+        self.pending[badges] = self.tables.entry[targets]
+        self.resume_at[badges] = self.clock[badges]
+
+    def start_sequence(self, badges, action_ids):
+        # Anything that these badges were still running is abandoned.
+        self.busy[badges] = True
+        self.pending[badges] = action_ids
+        self.resume_at[badges] = self.clock[badges]
+        self.choose_at[badges] = NEVER
+
+    def choose(self, heads):
+        # Pick one member of each choice set, weighted by choice share. If
+        #  none of a set's choices has a share, they're all equally likely.
+        tables = self.tables
+        totals = tables.choice_total[heads]
+        counts = tables.choice_count[heads]
+        uniform = totals == 0
+        picks = (self.random.random_sample(len(heads)) *
+                 np.where(uniform, counts, totals)).astype(np.int64)
+        index = tables.choice_start[heads]
+        last = index + counts - 1
+        for i in range(tables.max_choices - 1):
+            index = np.where((index < last) &
+                             (picks >= tables.choice_cumulative[index]),
+                             index + 1, index)
+        index = np.where(uniform, tables.choice_start[heads] + picks, index)
+        return tables.choice_members[index]
+
+    def step(self, badges):
+        # Run the next action for each of these (busy) badges.
+        tables = self.tables
+        done = self.pending[badges] == NULL
+        finished = badges[done]
+        self.busy[finished] = False
+        # The ones that just finished their ENTER sequences start their timers.
+        entered = finished[self.timer_start[finished] == NEVER]
+        self.timer_start[entered] = self.clock[entered]
+
+        badges = badges[~done]
+        if not len(badges):
+            return
+        actions = self.choose(self.pending[badges])
+        action_type = tables.action_type[actions]
+        detail = tables.action_detail[actions]
+        self.pending[badges] = tables.next_action[actions]
+        self.resume_at[badges] = self.clock[badges]
+
+        text = np.isin(action_type, TEXT_TYPES)
+        np.add.at(self.text_shown, detail[text], 1)
+        self.resume_at[badges[text]] += tables.action_duration[actions[text]]
+
+        close = action_type == RESULT_TYPE_OUTPUT['CLOSE']
+        if close.any():
+            self.closed[badges[close], self.state[badges[close]]] = True
+
+        push = action_type == RESULT_TYPE_OUTPUT['PUSH']
+        self.pushed_state[badges[push]] = self.state[badges[push]]
+
+        targets = np.full(len(badges), -1, np.int64)
+        transition = action_type == RESULT_TYPE_OUTPUT['STATE_TRANSITION']
+        targets[transition] = detail[transition]
+        previous = action_type == RESULT_TYPE_OUTPUT['PREVIOUS']
+        targets[previous] = self.previous_state[badges[previous]]
+        pop = action_type == RESULT_TYPE_OUTPUT['POP']
+        targets[pop] = self.pushed_state[badges[pop]]
+        # A transition to a closed state has no effect.
+        moving = targets >= 0
+        if tables.can_close:
+            moving &= ~self.closed[badges, np.maximum(targets, 0)]
+        if moving.any():
+            self.enter_state(badges[moving], targets[moving])
+
+    def next_timers(self, badges):
+        # When (counting from the end of ENTER) the next timer for each of
+        #  these badges comes due, and its result, or NEVER if there isn't
+        #  one. Ties go to the first stored.
+        #  This is qc15_game.timing.timer_due(), for every timer at once.
+        tables = self.tables
+        states = self.state[badges]
+        durations = tables.timer_duration[states]
+        floor = self.timer_floor[badges][:, None]
+        safe_durations = np.maximum(durations, 1)
+        due = np.where(tables.timer_recurring[states],
+                       (floor // safe_durations + 1) * safe_durations,
+                       np.where(durations > floor, durations, NEVER))
+        due[durations == 0] = NEVER
+        results = tables.timer_result[states]
+        due[self.is_locked_out(badges[:, None], results)] = NEVER
+        first = due.argmin(axis=1)
+        rows = np.arange(len(badges))
+        return due[rows, first], results[rows, first]
+
+    def available_inputs(self, badges):
+        # A mask of which inputs each of these (idle) badges has on offer.
+        tables = self.tables
+        states = self.state[badges]
+        available = np.arange(tables.input_result.shape[1])[None, :] < \
+                    tables.input_count[states][:, None]
+        available &= ~self.is_locked_out(badges[:, None],
+                                         tables.input_result[states])
+        return available
+
+    def run(self, hours):
+        end = int(hours * 3600 * TICKS_PER_SECOND)
+        everyone = np.arange(self.badges)
+        while True:
+            # When does each badge do something next, and what? A timer
+            #  pre-empts whatever is running, but when it's due at the same
+            #  time as the next step, the step goes first.
+            step_at = np.where(self.busy, self.resume_at, NEVER)
+            timed = everyone[self.timer_start != NEVER]
+            timer_due, timer_result = self.next_timers(timed)
+            timer_at = np.full(self.badges, NEVER, np.int64)
+            timer_at[timed] = np.where(timer_due == NEVER, NEVER,
+                                       self.timer_start[timed] + timer_due)
+            internal = np.minimum(step_at, timer_at)
+            idle = everyone[~self.busy]
+
+            # Idle players with something to choose from start thinking.
+            thinking = idle[self.choose_at[idle] == NEVER]
+            if len(thinking):
+                has_inputs = self.available_inputs(thinking).any(axis=1)
+                thinking = thinking[has_inputs]
+                self.choose_at[thinking] = self.clock[thinking] + \
+                    self.random.randint(self.think_min, self.think_max + 1,
+                                        len(thinking))
+
+            next_at = np.minimum(internal, np.minimum(self.net_at,
+                                                      self.choose_at))
+            active = next_at <= end
+            if not active.any():
+                break
+            self.events += int(active.sum())
+            self.clock[active] = next_at[active]
+
+            # Badges' own events come first, then NET events, then players.
+            is_internal = active & (internal == next_at)
+            is_net = active & ~is_internal & (self.net_at == next_at)
+            is_choice = active & ~is_internal & ~is_net
+
+            fires = is_internal & (timer_at < step_at)
+            timers = everyone[fires]
+            if len(timers):
+                positions = np.searchsorted(timed, timers)
+                self.timer_floor[timers] = timer_due[positions]
+                self.start_sequence(timers, timer_result[positions])
+            self.step(everyone[is_internal & ~fires])
+
+            self.deliver_net(everyone[is_net])
+            self.deliver_choice(everyone[is_choice])
+
+        self.clock[:] = end
+
+    def deliver_net(self, badges):
+        # A random NET event arrives at each of these badges, which only
+        #  matters to the ones that are idle, in a state that handles it.
+        if not len(badges):
+            return
+        tables = self.tables
+        types = self.net_types[self.random.randint(0, len(self.net_types),
+                                                   len(badges))]
+        self.net_at[badges] = self.next_net(badges, self.clock[badges])
+        idle = ~self.busy[badges]
+        badges = badges[idle]
+        types = types[idle]
+
+        states = self.state[badges]
+        results = tables.other_result[states]
+        handles = (tables.other_type[states] == types[:, None]) & \
+                  ~self.is_locked_out(badges[:, None], results)
+        handled = handles.any(axis=1)
+        first = handles.argmax(axis=1)
+        rows = np.arange(len(badges))[handled]
+        self.start_sequence(badges[handled], results[rows, first[handled]])
+
+    def deliver_choice(self, badges):
+        # Each of these (idle) badges' players picks a random input.
+        if not len(badges):
+            return
+        self.choose_at[badges] = NEVER
+        available = self.available_inputs(badges)
+        counts = available.sum(axis=1)
+        picks = (self.random.random_sample(len(badges)) * counts).astype(np.int64)
+        # The index of the picks'th available input.
+        choices = (available.cumsum(axis=1) <= picks[:, None]).sum(axis=1)
+        chosen = counts > 0
+        results = self.tables.input_result[self.state[badges[chosen]],
+                                           choices[chosen]]
+        self.start_sequence(badges[chosen], results)
+
+    def reach_times(self):
+        # For each state, the clock times at which the badges that reached it
+        #  first did.
+        return [self.first_visit[:, state_id][self.first_visit[:, state_id] >= 0]
+                for state_id in range(self.first_visit.shape[1])]
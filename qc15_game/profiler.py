@@ -0,0 +1,199 @@
+"""Build profiling for QC15's Statemaker tool.
+
+A BuildProfile times each phase of a build (reading, validating, the graph
+work, packing, writing dotfiles and images), notes the process's peak memory
+use after each one, and counts calls to a few methods that get called a lot.
+It does this by temporarily swapping timed (or counted) wrappers in for those
+methods while it's running, so nothing pays for it otherwise.
+"""
+
+from __future__ import print_function
+
+import json
+import platform
+import sys
+import timeit
+try:
+    import resource
+except ImportError:
+    # Not on Windows.
+    resource = None
+try:
+    from intelhex import IntelHex
+except ImportError:
+    # Only --binfile needs it, so there's nothing of it to time otherwise.
+    IntelHex = None
+
+from qc15_game import dot
+from qc15_game.game_state import GameAction, GameBuild
+from qc15_game.timing import TimingAnalysis
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+# (owner, attribute, phase name) of everything that's timed.
+PHASES = [
+    (GameBuild, 'read_rows', 'read_rows'),
+    (GameBuild, 'read_states_and_validate', 'read_states_and_validate'),
+    (GameBuild, 'read_actions', 'read_actions'),
+    (GameBuild, 'cull_nops', 'cull_nops'),
+    (GameBuild, 'strip_unreachable', 'strip_unreachable'),
+    (GameBuild, 'analyze_states', 'analyze_states'),
+    (GameBuild, 'merge_actions', 'merge_actions'),
+    (GameBuild, 'assign_ids', 'assign_ids'),
+    (GameBuild, 'check_action_graph', 'check_action_graph'),
+    (GameBuild, 'display_data_str', 'display_data_str'),
+    (GameBuild, 'pack_structs', 'pack_structs'),
+    (TimingAnalysis, 'check', 'timing_check'),
+    (dot, 'write_state_dot', 'write_state_dot'),
+    (dot, 'write_action_dot', 'write_action_dot'),
+]
+if IntelHex is not None:
+    PHASES += [
+        (IntelHex, 'write_hex_file', 'write_hex'),
+        (IntelHex, 'tobinfile', 'write_bin'),
+    ]
+
+# (owner, attribute, counter name) of everything that's counted.
+COUNTERS = [
+    (GameAction, 'id', 'GameAction.id'),
+    (GameBuild, 'text_addr', 'GameBuild.text_addr'),
+    (GameBuild, 'error', 'GameBuild.error'),
+]
+
+def peak_rss_kb():
+    # The most memory that this process has used so far, in KB, or None if
+    #  we can't tell.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024 # It's in bytes there.
+    return peak
+
+class BuildProfile(object):
+    """Phase timings, peak memory and call counts for one build.
+
+    Call start() before the build and stop() after it, then write() the
+    report. If cprofile_path is given, the whole build is also run under
+    cProfile, and its stats are dumped there.
+    """
+    def __init__(self, cprofile_path=''):
+        self.cprofile_path = cprofile_path
+        self.cprofiler = None
+        # Phase name -> dict(seconds, calls, peak_rss_kb, rss_growth_kb), and
+        #  the order that the phases first ran in.
+        self.phases = dict()
+        self.phase_order = []
+        self.counters = dict()
+        self.patches = [] # (owner, attribute, original)
+        self.depth = 0
+        self.start_time = None
+        self.seconds = None
+
+    def patch(self, owner, attribute, make_wrapper):
+        original = owner.__dict__[attribute]
+        setattr(owner, attribute, make_wrapper(original))
+        self.patches.append((owner, attribute, original))
+
+    def timed(self, name, function):
+        profile = self
+        def wrapper(*args, **kwargs):
+            # Only the outermost phase is timed, so that nothing is counted
+            #  twice.
+            if profile.depth:
+                return function(*args, **kwargs)
+            profile.depth += 1
+            rss_before = peak_rss_kb()
+            start = timeit.default_timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = timeit.default_timer() - start
+                profile.depth -= 1
+                profile.record(name, seconds, rss_before, peak_rss_kb())
+        return wrapper
+
+    def counted(self, name, function):
+        counters = self.counters
+        counters[name] = 0
+        def wrapper(*args, **kwargs):
+            counters[name] += 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    def record(self, name, seconds, rss_before, rss_after):
+        if name not in self.phases:
+            self.phases[name] = dict(seconds=0.0, calls=0, peak_rss_kb=None,
+                                     rss_growth_kb=None)
+            self.phase_order.append(name)
+        phase = self.phases[name]
+        phase['seconds'] += seconds
+        phase['calls'] += 1
+        if rss_after is not None:
+            phase['peak_rss_kb'] = rss_after
+            phase['rss_growth_kb'] = (phase['rss_growth_kb'] or 0) + \
+                                     rss_after - rss_before
+
+    def start(self):
+        for owner, attribute, name in PHASES:
+            self.patch(owner, attribute,
+                       lambda function, name=name: self.timed(name, function))
+        for owner, attribute, name in COUNTERS:
+            self.patch(owner, attribute,
+                       lambda function, name=name: self.counted(name,
+                                                                function))
+        if self.cprofile_path:
+            import cProfile
+            self.cprofiler = cProfile.Profile()
+            self.cprofiler.enable()
+        self.start_time = timeit.default_timer()
+
+    def stop(self):
+        self.seconds = timeit.default_timer() - self.start_time
+        if self.cprofiler:
+            self.cprofiler.disable()
+            self.cprofiler.dump_stats(self.cprofile_path)
+        while self.patches:
+            owner, attribute, original = self.patches.pop()
+            setattr(owner, attribute, original)
+
+    def report(self, build=None):
+        """The whole profile, as a dict that can be dumped as JSON."""
+        report = dict(
+            python=platform.python_version(),
+            seconds=self.seconds,
+            unprofiled_seconds=self.seconds - sum(
+                phase['seconds'] for phase in self.phases.values()
+            ),
+            peak_rss_kb=peak_rss_kb(),
+            phases=[dict(self.phases[name], name=name)
+                    for name in self.phase_order],
+            counters=self.counters,
+        )
+        if build is not None:
+            report.update(statefile=build.statefile,
+                          states=len(build.all_states),
+                          actions=len(build.all_actions),
+                          text=len(build.main_text) + len(build.aux_text))
+        return report
+
+    def write(self, path, build=None):
+        with open(path, 'w') as outfile:
+            json.dump(self.report(build), outfile, indent=1, sort_keys=True)
+
+    def print_summary(self, outfile=sys.stderr):
+        print("Build took %.3f s; peak memory %s." % (
+            self.seconds, '%d KB' % peak_rss_kb() if resource else 'unknown'
+        ), file=outfile)
+        for name in self.phase_order:
+            phase = self.phases[name]
+            print("  %-26s %8.3f s %5dx %10s" % (
+                name, phase['seconds'], phase['calls'],
+                '' if phase['peak_rss_kb'] is None else
+                '%d KB' % phase['peak_rss_kb']
+            ), file=outfile)
+        for name, count in sorted(self.counters.items()):
+            print("  %-26s %10d calls" % (name, count), file=outfile)
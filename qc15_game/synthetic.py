@@ -0,0 +1,159 @@
+"""Synthetic statefile generator for QC15's Statemaker tool.
+
+Makes statefiles of any size, shaped like the real one, for benchmarking.
+Everything is driven by a seeded random number generator, so the same
+arguments always give the same sheet.
+"""
+
+from __future__ import print_function
+
+import csv
+import random
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+DEFAULT_EVENT_MIX = dict(TIMER=2, TIMER_R=1, USER_IN=4, NET=1)
+
+WORDS = ('the', 'badge', 'file', 'queercon', 'you', 'see', 'other', 'bits',
+         'signal', 'nearby', 'hello', 'friend', 'wait', 'what', 'is', 'this',
+         'maybe', 'never', 'again', 'scan', 'code', 'light', 'dark', 'sing',
+         'cute', 'rude', 'strange', 'loop', 'circuit', 'lost', 'sigil', 'okay')
+
+NET_DESCS = ['SYNTH_NET_%d' % i for i in range(8)]
+OTHER_OUTPUTS = ['SYNTH_OUT_%d' % i for i in range(4)]
+ANIMATIONS = ['synthAnim%d' % i for i in range(6)]
+
+class SheetGenerator(object):
+    def __init__(self, rows, states=None, choice_width=2, extra_columns=2,
+                 event_mix=None, sequence_length=3, transition_rate=0.3,
+                 seed=0):
+        # rows is approximate; every state gets about rows/states rows.
+        if states is None:
+            states = max(1, rows // 20)
+        self.rows = rows
+        self.states = states
+        self.choice_width = choice_width
+        self.extra_columns = extra_columns
+        self.event_mix = event_mix or DEFAULT_EVENT_MIX
+        self.sequence_length = sequence_length
+        self.transition_rate = transition_rate
+        self.random = random.Random(seed)
+
+        self.state_names = ['SYNTH%06d' % i for i in range(states)]
+
+    def text(self, max_words=8):
+        words = [self.random.choice(WORDS)
+                 for i in range(self.random.randint(1, max_words))]
+        # Numbers keep most of the text unique, like the real thing.
+        words.append(str(self.random.randint(0, 9999)))
+        return ' '.join(words).capitalize()
+
+    def row(self, input_type, input_detail='', choice_share='', result_type='',
+            duration='', detail='', extra_details=()):
+        extras = list(extra_details)
+        extras += [''] * (self.extra_columns - len(extras))
+        return [input_type, input_detail, choice_share, result_type, duration,
+                detail] + extras
+
+    def text_row(self, input_type, input_detail, choice_share, single_frame):
+        # A TEXT row, sometimes with extra text choices in the extra columns.
+        max_words = 2 if single_frame else 8
+        extras = []
+        if self.extra_columns and self.random.random() < 0.25:
+            extras = [self.text(max_words) for i in
+                      range(self.random.randint(1, self.extra_columns))]
+        return self.row(input_type, input_detail, choice_share, 'TEXT', '',
+                        self.text(max_words), extras)
+
+    def choice_rows(self, input_tuple, target):
+        # One choice for an event: a row with the event's input tuple, then
+        #  some CONTD rows, maybe ending in a STATE_TRANSITION to target.
+        single_frame = input_tuple[0] == 'TIMER_R'
+        share = str(self.random.randint(1, 5)) if self.choice_width > 1 else ''
+        rows = [self.text_row(input_tuple[0], input_tuple[1], share,
+                              single_frame)]
+        for i in range(self.random.randint(0, self.sequence_length)):
+            kind = self.random.random()
+            if kind < 0.7:
+                rows.append(self.text_row('CONTD', '', '', single_frame))
+            elif kind < 0.85:
+                rows.append(self.row('CONTD', '', '', 'SET_ANIM_TEMP', '20',
+                                     self.random.choice(ANIMATIONS)))
+            else:
+                rows.append(self.row('CONTD', '', '', 'OTHER', '',
+                                     self.random.choice(OTHER_OUTPUTS)))
+        if target is not None:
+            rows.append(self.row('CONTD', '', '', 'STATE_TRANSITION', '',
+                                 target))
+        return rows
+
+    def event_type(self, available):
+        # Pick a random event type, weighted by event_mix, from the types
+        #  that this state can still have more of.
+        weights = [(input_type, self.event_mix.get(input_type, 0))
+                   for input_type in available]
+        total = sum(weight for input_type, weight in weights)
+        if not total:
+            return None
+        pick = self.random.uniform(0, total)
+        for input_type, weight in weights:
+            pick -= weight
+            if pick <= 0 and weight:
+                return input_type
+        return weights[-1][0]
+
+    def state_rows(self, index, row_budget):
+        name = self.state_names[index]
+        rows = [self.row('START_STATE', name)]
+        rows += self.choice_rows(('ENTER', ''), None)
+
+        timer = 0
+        net_descs = list(NET_DESCS)
+        user_ins = 0
+        first_event = True
+        while len(rows) < row_budget:
+            available = ['TIMER', 'TIMER_R', 'USER_IN']
+            if net_descs:
+                available.append('NET')
+            input_type = self.event_type(available)
+            if input_type is None:
+                break
+            if input_type in ('TIMER', 'TIMER_R'):
+                timer += self.random.randint(1, 60)
+                input_tuple = (input_type, str(timer))
+            elif input_type == 'USER_IN':
+                user_ins += 1
+                input_tuple = (input_type, 'Choice %d' % user_ins)
+            else:
+                input_tuple = (input_type, net_descs.pop(
+                    self.random.randrange(len(net_descs))))
+
+            for choice in range(self.choice_width):
+                if first_event:
+                    # Chain every state to the next, so that the state graph
+                    #  is connected.
+                    target = self.state_names[(index + 1) % self.states]
+                    first_event = False
+                elif self.random.random() < self.transition_rate:
+                    target = self.random.choice(self.state_names)
+                else:
+                    target = None
+                rows += self.choice_rows(input_tuple, target)
+        return rows
+
+    def write(self, outfile):
+        # outfile must be opened in binary mode.
+        writer = csv.writer(outfile, lineterminator='\r\n')
+        writer.writerow(['Input_type', 'Input_detail', 'Choice_share',
+                         'Result_type', 'Result_duration', 'Result_detail'] +
+                        [''] * self.extra_columns)
+        row_budget = max(2, self.rows // self.states)
+        for index in range(self.states):
+            writer.writerows(self.state_rows(index, row_budget))
+
+def write_sheet(path, rows, **kwargs):
+    with open(path, 'wb') as outfile:
+        SheetGenerator(rows, **kwargs).write(outfile)
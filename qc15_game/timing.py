@@ -0,0 +1,318 @@
+"""Timing analysis for QC15's Statemaker tool.
+
+Works out how long every event's action sequence can run (at least, at most,
+and on average, given the choice shares), and checks the timers against
+them: a recurring timer whose own sequence can outlast its period, a timer
+that comes due while a recurring timer's sequence is still running, a timer
+that never fires because another one always comes due at the same time, and
+ENTER sequences that can transition around a loop of states without taking
+any time at all, which would spin the badge's CPU forever.
+
+Only TEXT actions take any time; everything else runs immediately. A
+sequence ends when it transitions to another state (even one that's closed,
+to be safe), because the new state starts its ENTER sequence instead.
+
+The timers work as the statefile format documents them (see TIMER and
+TIMER_R in the README): they count from the end of the state's ENTER
+sequence, and keep counting whatever else is running. A timer that comes due
+while a sequence is still running pre-empts it, and the rest of that
+sequence never runs. When more than one timer comes due at once, the first
+one stored (one-time before recurring, longest first) fires, and the others
+skip that time. timer_due() is that model, and the interpreter uses it too.
+"""
+
+from __future__ import print_function, division
+
+import sys
+from collections import namedtuple
+
+from qc15_game.graph import StateGraph
+from qc15_game import TICKS_PER_SECOND
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+# How long a sequence runs, in seconds.
+SequenceTiming = namedtuple('SequenceTiming', ['min', 'mean', 'max'])
+
+NO_TIME = SequenceTiming(0.0, 0.0, 0.0)
+
+def action_seconds(action):
+    # Exactly as packed, in whole ticks.
+    if action.action_type.startswith('TEXT'):
+        return int(action.duration * TICKS_PER_SECOND) / TICKS_PER_SECOND
+    return 0.0
+
+def ends_sequence(action):
+    return action.action_type in ('STATE_TRANSITION', 'PREVIOUS', 'POP')
+
+def timer_due(duration, recurring, floor):
+    """When a timer next comes due, or None if it never will again, given
+    that the last timer to fire in this state did so at floor (0 if none has
+    yet). Both count from the end of the state's ENTER sequence, and
+    everything is in ticks.
+
+    A recurring timer comes due at every multiple of its duration, and a
+    one-time timer only at its duration. A timer that comes due at the same
+    time as one stored before it is skipped, because floor moves past it.
+    """
+    if recurring:
+        return (floor // duration + 1) * duration
+    if duration > floor:
+        return duration
+    return None
+
+def timer_ticks(timer):
+    # Exactly as packed.
+    return int(timer.duration * TICKS_PER_SECOND)
+
+def choices(first_action):
+    action = first_action
+    while action:
+        yield action
+        action = action.next_choice
+
+class TimingAnalysis(object):
+    """Timing of every action sequence in a GameBuild.
+
+    The build must have been read already. Call check() to warn about
+    problems, and report() for a table of every event's timing.
+    """
+    def __init__(self, build):
+        self.build = build
+        # First action of a choice set -> SequenceTiming of running it (and
+        #  everything after it).
+        self.timings = dict()
+        self.predecessors = self.state_predecessors()
+
+    def state_predecessors(self):
+        # State -> the states that can transition to it, for PREVIOUS.
+        predecessors = dict((state, set()) for state in self.build.all_states)
+        for state in self.build.all_states:
+            for first_action in self.event_actions(state):
+                for action in self.sequence_actions(first_action):
+                    if action.action_type == 'STATE_TRANSITION':
+                        predecessors[action.detail].add(state)
+        return predecessors
+
+    def event_actions(self, state):
+        return [action for action in state.events.values() if action]
+
+    def sequence_actions(self, first_action):
+        # Every action that running first_action can run.
+        seen = set()
+        to_visit = [first_action]
+        while to_visit:
+            action = to_visit.pop()
+            if action in seen:
+                continue
+            seen.add(action)
+            for successor in (action.next_action, action.next_choice):
+                if successor:
+                    to_visit.append(successor)
+        return seen
+
+    def timing(self, first_action):
+        """The SequenceTiming of the choice set starting at first_action."""
+        if first_action is None:
+            return NO_TIME
+        # The action graph has no cycles, but it can be very deep, so this
+        #  works through it with a stack instead of recursion.
+        stack = [first_action]
+        while stack:
+            head = stack[-1]
+            if head in self.timings:
+                stack.pop()
+                continue
+            pending = [choice.next_action for choice in choices(head)
+                       if choice.next_action and not ends_sequence(choice) and
+                       choice.next_action not in self.timings]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            self.timings[head] = self.combine(head)
+        return self.timings[first_action]
+
+    def combine(self, head):
+        members = list(choices(head))
+        total = sum(choice.choice_share for choice in members)
+        minimum = maximum = None
+        mean = 0.0
+        for choice in members:
+            rest = NO_TIME
+            if choice.next_action and not ends_sequence(choice):
+                rest = self.timings[choice.next_action]
+            own = action_seconds(choice)
+            if minimum is None or own + rest.min < minimum:
+                minimum = own + rest.min
+            if maximum is None or own + rest.max > maximum:
+                maximum = own + rest.max
+            if total:
+                weight = choice.choice_share / total
+            else:
+                weight = 1.0 / len(members)
+            mean += weight * (own + rest.mean)
+        return SequenceTiming(minimum, mean, maximum)
+
+    def event_timings(self, state):
+        # [(input_tuple, SequenceTiming)] for every event in state, in the
+        #  order that they're packed: ENTER, timers, user inputs, NET.
+        order = {'ENTER': 0, 'TIMER': 1, 'TIMER_R': 1, 'USER_IN': 2, 'NET': 3}
+        events = sorted(state.events.items(), key=lambda event: (
+            order.get(event[0][0], 4),
+            int(event[0][1]) if event[0][0].startswith('TIMER') else 0,
+            event[0][1]
+        ))
+        return [(input_tuple, self.timing(first_action))
+                for input_tuple, first_action in events if first_action]
+
+    def instant_transitions(self, state):
+        # The states that state's ENTER sequence can go to without any time
+        #  passing.
+        targets = set()
+        to_visit = [state.entry_sequence_start] if state.entry_sequence_start \
+                   else []
+        seen = set()
+        while to_visit:
+            head = to_visit.pop()
+            if head in seen:
+                continue
+            seen.add(head)
+            for choice in choices(head):
+                if action_seconds(choice):
+                    continue
+                if choice.action_type == 'STATE_TRANSITION':
+                    targets.add(choice.detail)
+                elif choice.action_type == 'PREVIOUS':
+                    targets.update(self.predecessors[state])
+                elif choice.next_action:
+                    to_visit.append(choice.next_action)
+        return targets
+
+    def zero_time_loops(self):
+        """Every loop of states that the badge can go around forever without
+        any time passing, as a list of lists of states."""
+        instant_graph = StateGraph(self.build.all_states, [
+            (state, target, None) for state in self.build.all_states
+            for target in sorted(self.instant_transitions(state),
+                                 key=lambda target: target.id)
+        ])
+        # Any strongly connected component with more than one state, or with
+        #  a state that goes straight back to itself, is a loop.
+        return [sorted((instant_graph.states[member] for member in component),
+                       key=lambda member: member.id)
+                for component in instant_graph.strong_components()
+                if len(component) > 1 or instant_graph.has_loop(component[0])]
+
+    def timer_conflicts(self, state):
+        # [(timer, recurring timer, its SequenceTiming)] for every timer in
+        #  state that comes due (counting from the end of the ENTER sequence)
+        #  while a recurring timer's sequence can still be running, including
+        #  its own, and so pre-empts it.
+        conflicts = []
+        for recurring in state.timers:
+            if not recurring.recurring:
+                continue
+            period = recurring.duration
+            timing = self.timing(recurring.result)
+            for timer in state.timers:
+                if timer is recurring:
+                    if timing.max >= period:
+                        conflicts.append((timer, recurring, timing))
+                    continue
+                if timer.recurring:
+                    # The pattern repeats every lcm of the two periods.
+                    horizon = min(period * timer.duration //
+                                  gcd(period, timer.duration), 1000 * period)
+                    due = range(timer.duration, horizon + 1, timer.duration)
+                else:
+                    due = [timer.duration]
+                # When both come due at once, only one of them fires, so
+                #  it's only a problem once the recurring one has started.
+                if any(when > period and 0 < when % period < timing.max
+                       for when in due):
+                    conflicts.append((timer, recurring, timing))
+        return conflicts
+
+    def silent_timers(self, state):
+        # [(timer, earlier timer)] for every timer in state that never fires,
+        #  because a timer stored before it comes due every time that it does
+        #  (see timer_due()). Being skipped now and then is how the badge
+        #  settles ties, so that's fine.
+        silent = []
+        for i, timer in enumerate(state.timers):
+            ticks = timer_ticks(timer)
+            for earlier in state.timers[:i]:
+                earlier_ticks = timer_ticks(earlier)
+                if earlier.recurring:
+                    always = earlier_ticks and ticks % earlier_ticks == 0
+                else:
+                    always = not timer.recurring and ticks == earlier_ticks
+                if always:
+                    silent.append((timer, earlier))
+                    break
+        return silent
+
+    def check(self):
+        """Warn about every timing problem in the build. Returns the number
+        of problems found."""
+        problems = 0
+        event_name = lambda timer: '%s %d' % (
+            'TIMER_R' if timer.recurring else 'TIMER', timer.duration)
+        for state in self.build.all_states:
+            for timer, recurring, timing in self.timer_conflicts(state):
+                problems += 1
+                if timer is recurring:
+                    message = "%s in %s can still be running its sequence" \
+                              " (up to %.2f s) when it comes due again," \
+                              " and pre-empts it." % (
+                                  event_name(timer), state.name, timing.max)
+                else:
+                    message = "%s in %s can come due while %s's sequence" \
+                              " (up to %.2f s) is still running, and" \
+                              " pre-empt it." % (
+                                  event_name(timer), state.name,
+                                  event_name(recurring), timing.max)
+                self.build.error(message, row=timer.row, col=None,
+                                 badtext=timer.detail, errtype="WARNING")
+            for timer, earlier in self.silent_timers(state):
+                problems += 1
+                other = event_name(earlier)
+                if other == event_name(timer):
+                    other = 'another ' + other
+                self.build.error("%s in %s never fires, because %s always"
+                                 " comes due at the same time, and goes"
+                                 " first." % (event_name(timer), state.name,
+                                              other),
+                                 row=timer.row, col=None,
+                                 badtext=timer.detail, errtype="WARNING")
+        for loop in self.zero_time_loops():
+            problems += 1
+            self.build.error("The ENTER sequences of %s can transition around"
+                             " a loop without taking any time, which would"
+                             " hang the badge." % ', '.join(
+                                 state.name for state in loop),
+                             row=loop[0].entry_row, col=None,
+                             badtext='ENTER', errtype="WARNING")
+        return problems
+
+    def report(self, outfile=sys.stdout):
+        """Print how long every event in every state can take."""
+        print("%-24s %-32s %8s %8s %8s" % ('State', 'Event', 'Min (s)',
+                                           'Mean (s)', 'Max (s)'),
+              file=outfile)
+        for state in self.build.all_states:
+            for input_tuple, timing in self.event_timings(state):
+                event = ' '.join(part for part in input_tuple if part)
+                print("%-24s %-32s %8.2f %8.2f %8.2f" % (
+                    state.name[:24], event[:32], timing.min, timing.mean,
+                    timing.max
+                ), file=outfile)
+
+def gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
@@ -0,0 +1,96 @@
+"""Tool to estimate how a QC15 game plays out, over many badges at once."""
+
+from __future__ import print_function
+
+import argparse
+import sys
+import timeit
+
+import numpy as np
+
+from qc15_game.interpreter import GameImage, TICKS_PER_SECOND
+from qc15_game.montecarlo import GameTables, Simulation
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+def minutes(ticks):
+    return float(ticks) / TICKS_PER_SECOND / 60
+
+def main():
+    parser = argparse.ArgumentParser("Simulate many queercon 15 badges playing a game image.")
+    parser.add_argument('game_image', type=str,
+                        help="The .hex or .bin file made by statemaker.")
+    parser.add_argument('header', type=str,
+                        help="The C header made by statemaker for the same"
+                             " build (-c).")
+    parser.add_argument('--text-loc', action='store', type=int, default=0x310000)
+    parser.add_argument('--state-loc', action='store', type=int, default=0x320000)
+    parser.add_argument('--action-loc', action='store', type=int, default=0x300000)
+    parser.add_argument('-n', '--badges', type=int, default=10000,
+                        help="Number of badges to simulate.")
+    parser.add_argument('--hours', type=float, default=8,
+                        help="Hours of badge time to play each badge for.")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--think-min', type=int, default=2,
+                        help="Fewest seconds a player waits before choosing"
+                             " an input.")
+    parser.add_argument('--think-max', type=int, default=60,
+                        help="Most seconds a player waits before choosing an"
+                             " input.")
+    parser.add_argument('--net-rate', type=float, default=30,
+                        help="Average number of random NET events per hour.")
+    parser.add_argument('--top-text', type=int, default=20,
+                        help="Number of most-shown text frames to list.")
+
+    args = parser.parse_args()
+
+    image = GameImage.load(args.game_image, args.header, args.text_loc,
+                           args.action_loc, args.state_loc)
+    simulation = Simulation(GameTables(image), args.badges, seed=args.seed,
+                            think_min=args.think_min,
+                            think_max=args.think_max, net_rate=args.net_rate)
+
+    start = timeit.default_timer()
+    simulation.run(args.hours)
+    elapsed = timeit.default_timer() - start
+    print("Played %d badges for %g hours (%d events) in %.2f s." % (
+        args.badges, args.hours, simulation.events, elapsed
+    ), file=sys.stderr)
+
+    badge_hours = float(args.badges * args.hours)
+    reach_times = simulation.reach_times()
+    print("%-24s %10s %9s %9s %9s %9s" % ('State', 'Visits/hr', 'Reached',
+                                          'Median', 'Mean', '90th pct'))
+    print("%-24s %10s %9s %9s %9s %9s" % ('', '', '', '(min)', '(min)',
+                                          '(min)'))
+    for state_id in np.argsort(-simulation.state_visits, kind='mergesort'):
+        times = reach_times[state_id]
+        if len(times):
+            timing = "%9.1f %9.1f %9.1f" % (
+                minutes(np.median(times)), minutes(times.mean()),
+                minutes(np.percentile(times, 90))
+            )
+        else:
+            timing = "%9s %9s %9s" % ('-', '-', '-')
+        print("%-24s %10.2f %8.1f%% %s" % (
+            image.state_name(state_id)[:24],
+            simulation.state_visits[state_id] / badge_hours,
+            100.0 * len(times) / args.badges, timing
+        ))
+
+    shown = simulation.text_shown
+    print()
+    print("%d text frames shown, %d of %d frames never shown." % (
+        shown.sum(), (shown == 0).sum(), len(shown)
+    ))
+    print("%10s  %s" % ('Shown/hr', 'Text'))
+    for text_addr in np.argsort(-shown, kind='mergesort')[:args.top_text]:
+        if shown[text_addr]:
+            print("%10.2f  %s" % (shown[text_addr] / badge_hours,
+                                  image.text(text_addr)))
+
+if __name__ == "__main__":
+    main()
@@ -5,19 +5,228 @@ from __future__ import print_function
 
 import argparse
 import os
+import sys
+import time
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
-import networkx as nx
-from intelhex import IntelHex
-
-import qc15_game.game_state
 from qc15_game.game_state import *
+from qc15_game.timing import TimingAnalysis
 from qc15_game import *
 
+# Everything else is only imported if an option needs it, so that a build
+#  that only validates the statefile starts quickly.
+
 __author__ = "George Louthan @duplico"
 __copyright__ = "(c) 2018, George Louthan"
 __license__ = "MIT"
 __email__ = "duplico@dupli.co"
 
+def requested_outputs(args):
+    # The name of each output under the build cache -> where it goes.
+    outputs = dict()
+    if args.output_dotfile:
+        outputs['state.dot'] = args.output_dotfile
+    if args.output_action_dotfile:
+        outputs['action.dot'] = args.output_action_dotfile
+    if args.output_cfile:
+        outputs['game.h'] = args.output_cfile
+    if args.binfile:
+        outputs['game.hex' if args.binfile.endswith('.hex') else 'game.bin'] =\
+            args.binfile
+    return outputs
+
+def state_graph_key(state_graph):
+    # Everything that goes into the state dotfile, but much quicker to get
+    #  than the dotfile itself.
+    return (sorted(str(state) for state in state_graph.states),
+            sorted((str(u), str(v), label) for u, v, label in 
+                   state_graph.edges()))
+
+def render_outputs(args, build, skip=()):
+    # Returns the contents of every requested output, by artifact name,
+    #  except for those in skip.
+    contents = dict()
+    if args.output_dotfile or args.output_action_dotfile:
+        from qc15_game import dot
+    if args.output_dotfile and 'state.dot' not in skip:
+        dotfile = StringIO()
+        dot.write_state_dot(build, dotfile)
+        contents['state.dot'] = dotfile.getvalue()
+    
+    if args.output_action_dotfile:
+        build.check_action_graph()
+        dotfile = StringIO()
+        dot.write_action_dot(build, dotfile)
+        contents['action.dot'] = dotfile.getvalue()
+    
+    if args.output_cfile:
+        header = StringIO()
+        build.display_data_str(header)
+        contents['game.h'] = header.getvalue()
+    
+    if args.binfile:
+        from intelhex import IntelHex
+        flash = IntelHex()
+
+        binary_data = build.pack_structs()
+
+        flash.puts(args.text_loc, binary_data['text'])
+        flash.puts(args.action_loc, binary_data['actions'])
+        flash.puts(args.state_loc, binary_data['states'])
+        if args.choice_table:
+            flash.puts(args.choice_loc, binary_data['choices'])
+        
+        image = StringIO()
+        if args.binfile.endswith('.hex'):
+            flash.write_hex_file(image)
+            contents['game.hex'] = image.getvalue()
+        else:
+            flash.tobinfile(image)
+            contents['game.bin'] = image.getvalue()
+    return contents
+
+def report_size(args, build, outfile=sys.stderr):
+    # Say how much the optional size optimizations saved.
+    if args.strip_unreachable:
+        print("Stripped %d unreachable states, %d actions and %d text strings,"
+              " saving %d bytes." % (
+            len(build.stripped_states), build.stripped_actions,
+            build.stripped_text, build.stripped_bytes
+        ), file=outfile)
+        if build.stripped_states:
+            print("  Unreachable states: %s" % 
+                  ', '.join(build.stripped_states), file=outfile)
+    if args.merge_actions:
+        print("Merged %d duplicate actions, saving %d bytes of action data." % (
+            build.merged_actions, build.merged_actions * GameAction.record.size
+        ), file=outfile)
+    if args.text_format == 'pooled':
+        fixed_len = len(build.text_table) * TEXT_RECORD_LEN
+        pooled_len = len(build.pack_text_pool())
+        print("Pooled text is %d bytes, instead of %d bytes of fixed records"
+              " (%d%%)." % (pooled_len, fixed_len,
+                            100 * pooled_len // max(fixed_len, 1)),
+              file=outfile)
+    if args.state_format == 'indexed':
+        fixed_len = len(build.state_table) * build.state_record_len()
+        indexed_len = build.indexed_states_len()
+        print("Indexed states are %d bytes, instead of %d bytes of padded"
+              " records (%d%%)." % (indexed_len, fixed_len,
+                                    100 * indexed_len // max(fixed_len, 1)),
+              file=outfile)
+
+def write_reports(args, build, timing, state_graph, outfile=sys.stderr):
+    # Everything that's printed after a successful build, apart from the
+    #  diagnostics.
+    report_size(args, build, outfile)
+    if args.timing_report:
+        timing.report(outfile)
+    if args.graph_report:
+        state_graph.report(outfile)
+
+def check_timing(build):
+    # Warn about timers and sequences that don't get along. Returns the
+    #  TimingAnalysis, for --timing-report.
+    timing = TimingAnalysis(build)
+    timing.check()
+    return timing
+
+def report_diagnostics(args, build):
+    # Everything that the build found wrong with the statefile, all at once.
+    build.diagnostics.print_report(sys.stderr)
+    if args.diagnostics_json:
+        build.diagnostics.write_json(args.diagnostics_json)
+
+def write_outputs(outputs, contents, previous=None):
+    # Write out every output, except those that are the same as they were
+    #  in previous. Returns the paths that were written.
+    written = []
+    for artifact, path in sorted(outputs.items()):
+        if previous and previous.get(artifact) == contents[artifact]:
+            continue
+        if path == '-':
+            sys.stdout.write(contents[artifact])
+            sys.stdout.flush()
+        else:
+            with open(path, 'wb') as outfile:
+                outfile.write(contents[artifact])
+        written.append(path)
+    return written
+
+def watch(args, outputs, id_map):
+    # Rebuild every time the statefile changes, only re-reading the states
+    #  that changed, and only writing the outputs that changed. Runs until
+    #  interrupted.
+    build = None
+    previous = None
+    previous_graph_key = None
+    mtime = None
+    while True:
+        try:
+            new_mtime = os.stat(args.statefile).st_mtime
+        except OSError:
+            new_mtime = None
+        if new_mtime is None or new_mtime == mtime:
+            time.sleep(args.watch_interval)
+            continue
+        mtime = new_mtime
+        
+        start = time.time()
+        state_graph = None
+        try:
+            if build is not None:
+                state_graph = build.update(args.cull_nops, id_map,
+                                           args.merge_actions,
+                                           args.strip_unreachable)
+                if state_graph is not None and not build.updated_states:
+                    # Only blank lines or line endings changed.
+                    continue
+                rebuilt = ', '.join(build.updated_states)
+            if state_graph is None:
+                build = GameBuild(args.statefile, 
+                                  allow_implicit=args.allow_implicit,
+                                  warn_on_wrap=not args.no_warn_wrap,
+                                  choice_table=args.choice_table,
+                                  text_format=args.text_format,
+                                  state_format=args.state_format,
+                                  timer_order=args.timer_order)
+                state_graph = build.read_state_data(args.cull_nops, id_map,
+                                                    args.merge_actions,
+                                                    args.strip_unreachable)
+                rebuilt = 'everything'
+            timing = check_timing(build)
+        except GameBuildError:
+            # Whatever we had is no good now, so start over next time.
+            report_diagnostics(args, build)
+            build = None
+            print("Build failed. Waiting for changes...", file=sys.stderr)
+            continue
+        
+        report_diagnostics(args, build)
+        if args.timing_report:
+            timing.report(sys.stderr)
+        if args.graph_report:
+            state_graph.report(sys.stderr)
+        if id_map is not None:
+            id_map.save(args.id_map)
+        # Most changes don't touch the state graph at all, so there's no
+        #  need to rewrite the state dotfile for them.
+        graph_key = state_graph_key(state_graph)
+        skip = ['state.dot'] if previous and graph_key == previous_graph_key\
+               else []
+        contents = render_outputs(args, build, skip)
+        for artifact in skip:
+            contents[artifact] = previous[artifact]
+        written = write_outputs(outputs, contents, previous)
+        previous = contents
+        previous_graph_key = graph_key
+        print("Rebuilt %s in %d ms. Wrote: %s" % (
+            rebuilt, (time.time() - start) * 1000, ', '.join(written) or 'nothing'
+        ), file=sys.stderr)
+
 def main():
     parser = argparse.ArgumentParser("Parse the state data for a qc15 badge.")
     parser.add_argument('--statefile', type=str, required=True, 
@@ -35,6 +244,30 @@ def main():
     parser.add_argument('--cull-nops', action='store_true',
                         help="Attempt to detect deletable NOP actions,"
                              " and remove them")
+    parser.add_argument('--merge-actions', action='store_true',
+                        help="Store identical action sequences (and choice"
+                             " sets) only once, even if they are in"
+                             " different states.")
+    parser.add_argument('--strip-unreachable', action='store_true',
+                        help="Leave out every state, action and text string"
+                             " that can't be reached from the first state.")
+    parser.add_argument('--diagnostics-json', type=str, default='',
+                        help="Path to also write every error and warning to,"
+                             " as JSON.")
+    parser.add_argument('--timing-report', action='store_true',
+                        help="Print how long (at least, on average, and at"
+                             " most) every event's action sequence takes.")
+    parser.add_argument('--graph-report', action='store_true',
+                        help="Print the shape of the state graph: how many"
+                             " states and edges it has, its connected"
+                             " components, and any states or groups of states"
+                             " that the badge can never leave.")
+    parser.add_argument('--id-map', type=str, default='',
+                        help="Path to a JSON file that records the ID of"
+                             " every action, state, and text string. It is"
+                             " created if it doesn't exist, and updated after"
+                             " every build, so that IDs stay the same from one"
+                             " build to the next.")
     parser.add_argument('-d', '--output-dotfile', type=str, default='', 
         help="Path to GraphViz dot file to generate.")  
     parser.add_argument('-a', '--output-action-dotfile', type=str, default='', 
@@ -48,44 +281,168 @@ def main():
     parser.add_argument('--text-loc', action='store', type=int, default=0x310000)
     parser.add_argument('--state-loc', action='store', type=int, default=0x320000)
     parser.add_argument('--action-loc', action='store', type=int, default=0x300000)
+    parser.add_argument('--choice-table', choices=CHOICE_TABLE_TYPES,
+                        default=None,
+                        help="Also pack a table for every choice set, so that"
+                             " the badge can make weighted choices without"
+                             " walking the choice list. The action region is"
+                             " unchanged either way.")
+    parser.add_argument('--choice-loc', action='store', type=int, default=0x330000)
+    parser.add_argument('--text-format', choices=TEXT_FORMATS, default='fixed',
+                        help="How to pack the text region: 'fixed' size"
+                             " records, or a 'pooled' offset table and string"
+                             " pool, which is smaller.")
+    parser.add_argument('--state-format', choices=STATE_FORMATS,
+                        default='fixed',
+                        help="How to pack the state region: 'fixed' records,"
+                             " all padded to the same size, or 'indexed'"
+                             " variable-length records with an offset index,"
+                             " which is smaller.")
+    parser.add_argument('--timer-order', action='store_true',
+                        help="Also store the order that every state's timers"
+                             " first come due in, right after its timers, so"
+                             " that the badge doesn't have to sort them on"
+                             " entering a state. After a recurring timer"
+                             " fires, the badge still has to compare its next"
+                             " deadline with the others'.")
+    parser.add_argument('--cache-dir', type=str, default='',
+                        help="Directory in which to cache outputs. If the"
+                             " statefile and options haven't changed since a"
+                             " previous build, its outputs (and reports, and"
+                             " --diagnostics-json) are copied from the cache"
+                             " instead of being rebuilt. (Warnings are not"
+                             " repeated.)")
+    parser.add_argument('--cache-size', type=int, default=256,
+                        help="Maximum size of the cache directory, in MB.")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running, and rebuild whenever the statefile"
+                             " changes. Only the states that changed are"
+                             " re-read, and only the outputs that changed are"
+                             " rewritten.")
+    parser.add_argument('--watch-interval', type=float, default=0.2,
+                        help="How often to check the statefile for changes in"
+                             " --watch mode, in seconds.")
+    parser.add_argument('--profile', type=str, default='',
+                        help="Path to write a JSON report of how long each"
+                             " phase of the build took, the peak memory use,"
+                             " and how many times some busy methods were"
+                             " called. A summary is also printed. The build"
+                             " cache isn't used.")
+    parser.add_argument('--profile-stats', type=str, default='',
+                        help="With --profile, also run the build under"
+                             " cProfile, and dump its stats to this path.")
 
     args = parser.parse_args()
+    if args.profile and args.watch:
+        parser.error("--profile can't be used with --watch.")
+    if args.profile_stats and not args.profile:
+        parser.error("--profile-stats needs --profile.")
     if not os.path.isfile(args.statefile):
         print("FATAL: %s" % (args.statefile))
         print(" File not found.")
         exit(1)
     
-    qc15_game.game_state.warn_on_wrap = not args.no_warn_wrap
+    outputs = requested_outputs(args)
+    if args.id_map:
+        from qc15_game.id_map import IdMap
     
-    state_graph = read_state_data(args.statefile, args.allow_implicit,
-                                  args.cull_nops)
-
-    if args.output_dotfile:
-        nx.drawing.nx_pydot.write_dot(state_graph, args.output_dotfile)
+    if args.watch:
+        id_map = IdMap.load(args.id_map) if args.id_map else None
+        try:
+            watch(args, outputs, id_map)
+        except KeyboardInterrupt:
+            pass
+        return
     
-    if args.output_action_dotfile:
-        nx.drawing.nx_pydot.write_dot(get_action_graph(), args.output_action_dotfile)
-        
-    if args.output_cfile and args.output_cfile == '-':
-        display_data_str() # stdout
-    elif args.output_cfile:
-        with open(args.output_cfile, 'w') as outfile:
-            display_data_str(outfile)
+    cache = None
+    if args.cache_dir and outputs and not args.profile:
+        from qc15_game.build_cache import BuildCache
+        cache = BuildCache(args.cache_dir, args.cache_size * 1024 * 1024)
+        # (--default-duration isn't here, because it doesn't do anything.)
+        cache_key = cache.key(
+            [args.statefile] + ([args.id_map] if args.id_map else []),
+            dict(allow_implicit=args.allow_implicit, cull_nops=args.cull_nops,
+                 merge_actions=args.merge_actions,
+                 strip_unreachable=args.strip_unreachable,
+                 no_warn_wrap=args.no_warn_wrap,
+                 timing_report=args.timing_report,
+                 graph_report=args.graph_report,
+                 text_loc=args.text_loc, state_loc=args.state_loc,
+                 action_loc=args.action_loc,
+                 choice_table=args.choice_table, choice_loc=args.choice_loc,
+                 text_format=args.text_format, state_format=args.state_format,
+                 timer_order=args.timer_order)
+        )
+        # The reports are cached along with the outputs, so that a build
+        #  from the cache still prints and writes them.
+        reports = ['report.txt']
+        if args.diagnostics_json:
+            reports.append('diagnostics.json')
+        cached = cache.fetch(cache_key, list(outputs) + reports)
+        if cached is not None:
+            for artifact, path in outputs.items():
+                if path == '-':
+                    sys.stdout.write(cached[artifact])
+                else:
+                    with open(path, 'wb') as outfile:
+                        outfile.write(cached[artifact])
+            if args.diagnostics_json:
+                with open(args.diagnostics_json, 'wb') as outfile:
+                    outfile.write(cached['diagnostics.json'])
+            sys.stderr.write(cached['report.txt'])
+            return
     
-    if args.binfile:
-        flash = IntelHex()
-
-        binary_data = pack_structs()
-
-        flash.puts(args.text_loc, binary_data['text'])
-        flash.puts(args.action_loc, binary_data['actions'])
-        flash.puts(args.state_loc, binary_data['states'])
+    profile = None
+    if args.profile:
+        from qc15_game.profiler import BuildProfile
+        profile = BuildProfile(args.profile_stats)
+        profile.start()
+    
+    build = None
+    try:
+        build = GameBuild(args.statefile, allow_implicit=args.allow_implicit,
+                          warn_on_wrap=not args.no_warn_wrap,
+                          choice_table=args.choice_table,
+                          text_format=args.text_format,
+                          state_format=args.state_format,
+                          timer_order=args.timer_order)
         
-        if args.binfile.endswith('.hex'):
-            flash.write_hex_file(args.binfile)
-        else:
-            flash.tobinfile(args.binfile)
+        id_map = IdMap.load(args.id_map) if args.id_map else None
+        
+        try:
+            state_graph = build.read_state_data(args.cull_nops, id_map,
+                                                args.merge_actions,
+                                                args.strip_unreachable)
+            timing = check_timing(build)
+            contents = render_outputs(args, build)
+        except GameBuildError:
+            report_diagnostics(args, build)
+            exit(1)
+        
+        report_diagnostics(args, build)
+        
+        if id_map is not None:
+            id_map.save(args.id_map)
+        
+        report = StringIO()
+        write_reports(args, build, timing, state_graph, report)
+        sys.stderr.write(report.getvalue())
+        
+        write_outputs(outputs, contents)
+    finally:
+        # Failed builds are profiled too.
+        if profile is not None:
+            profile.stop()
+            profile.write(args.profile, build)
+            profile.print_summary(sys.stderr)
+    
+    if cache is not None:
+        contents['report.txt'] = report.getvalue()
+        if args.diagnostics_json:
+            with open(args.diagnostics_json, 'rb') as infile:
+                contents['diagnostics.json'] = infile.read()
+        cache.store(cache_key, contents)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,40 @@
+"""Tests for QC15's Statemaker tool.
+
+Run them from the top of the repository with::
+
+    python -m unittest discover
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+__author__ = "George Louthan @duplico"
+__copyright__ = "(c) 2018, George Louthan"
+__license__ = "MIT"
+__email__ = "duplico@dupli.co"
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATEFILE = os.path.join(REPO_DIR, 'badge_states.csv')
+
+class TempDir(object):
+    """A temporary directory, for a with statement."""
+    def __enter__(self):
+        self.path = tempfile.mkdtemp()
+        return self.path
+
+    def __exit__(self, *exc_info):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def run_statemaker(*args):
+    # Run statemaker.py just as it would be from the command line, and
+    #  return its stderr. Fails the test if the build does.
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, 'statemaker.py')] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=REPO_DIR
+    )
+    out, err = process.communicate()
+    assert process.returncode == 0, err
+    return err
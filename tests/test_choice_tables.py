@@ -0,0 +1,73 @@
+"""Choice tables give every choice exactly its share."""
+
+import random
+import unittest
+
+from qc15_game.game_state import GameBuild, GameChoiceSet
+from tests import STATEFILE
+
+class Choice(object):
+    # Just enough of a GameAction for GameChoiceSet.
+    def __init__(self, choice_share, choice_total, next_choice=None):
+        self.choice_share = choice_share
+        self.choice_total = choice_total
+        self.next_choice = next_choice
+
+def choice_set(shares):
+    first = None
+    for share in reversed(shares):
+        first = Choice(share, sum(shares), first)
+    return GameChoiceSet(first)
+
+class ChoiceTableTest(unittest.TestCase):
+    def check_alias(self, choices):
+        # Every draw r in [0, count * total) picks one choice, so a choice's
+        #  share is how many of the draws pick it, over count.
+        count = len(choices.members)
+        table = choices.alias_table()
+        self.assertEqual(len(table), count)
+        draws = dict((member, 0) for member in choices.members)
+        for threshold, action, alias in table:
+            self.assertTrue(0 <= threshold <= choices.total)
+            draws[action] += threshold
+            draws[alias] += choices.total - threshold
+        for member in choices.members:
+            self.assertEqual(draws[member], member.choice_share * count)
+
+    def check_cumulative(self, choices):
+        table = choices.cumulative_table()
+        running = 0
+        for (threshold, action), member in zip(table, choices.members):
+            running += member.choice_share
+            self.assertEqual(threshold, running)
+            self.assertIs(action, member)
+        self.assertEqual(table[-1][0], choices.total)
+
+    def test_small_sets(self):
+        for shares in ([1, 1], [1, 2], [3, 1, 1], [1, 2, 3, 7], [5, 0, 5],
+                       [100, 1, 1, 1, 1, 1, 1, 1], [1] * 10):
+            choices = choice_set(shares)
+            self.check_alias(choices)
+            self.check_cumulative(choices)
+
+    def test_random_sets(self):
+        rng = random.Random(15)
+        for trial in range(200):
+            shares = [rng.randint(0, 50) for i in range(rng.randint(2, 12))]
+            if not sum(shares):
+                continue
+            choices = choice_set(shares)
+            self.check_alias(choices)
+            self.check_cumulative(choices)
+
+    def test_statefile(self):
+        build = GameBuild(STATEFILE, warn_on_wrap=False)
+        build.read_state_data(False)
+        choice_sets = build.choice_sets()
+        self.assertTrue(choice_sets)
+        for action_id, choices in choice_sets:
+            self.check_alias(choices)
+            self.check_cumulative(choices)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""The interpreter reads back every text and state format the same way."""
+
+import os
+import unittest
+
+from qc15_game import NULL, RESULT_TYPE_OUTPUT, STATE_FORMATS, \
+                      TEXT_FORMATS, TICKS_PER_SECOND
+from qc15_game.game_state import GameBuild
+from qc15_game.interpreter import GameImage
+from tests import STATEFILE, TempDir, run_statemaker
+
+TEXT_TYPES = set(number for name, number in RESULT_TYPE_OUTPUT.items()
+                 if name.startswith('TEXT'))
+
+def load_image(text_format, state_format, timer_order=False):
+    with TempDir() as out_dir:
+        image = os.path.join(out_dir, 'game.bin')
+        header = os.path.join(out_dir, 'game.h')
+        options = ['--text-format', text_format, '--state-format',
+                   state_format]
+        if timer_order:
+            options.append('--timer-order')
+        run_statemaker('--statefile', STATEFILE, '--binfile', image,
+                       '-c', header, *options)
+        return GameImage.load(image, header)
+
+def describe(image):
+    # Everything the interpreter decoded, with text addresses swapped for
+    #  the text itself, since those are all that differ between formats.
+    actions = [(action[0], image.text(action[1])
+                if action[0] in TEXT_TYPES else action[1]) + action[2:]
+               for action in image.actions]
+    states = [(image.state_name(state_id), entry, timers,
+               [(image.text(text_addr), result)
+                for text_addr, result in inputs], others)
+              for state_id, (entry, timers, inputs, others)
+              in enumerate(image.states)]
+    return actions, states
+
+class FormatTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.build = GameBuild(STATEFILE, warn_on_wrap=False)
+        cls.build.read_state_data(False)
+        cls.expected = describe(load_image('fixed', 'fixed'))
+
+    def test_fixed_matches_build(self):
+        image = load_image('fixed', 'fixed')
+        for text_id, text in enumerate(self.build.text_table):
+            self.assertEqual(image.text(text_id), text.strip())
+        self.assertEqual(len(image.states), len(self.build.state_table))
+        for state_id, state in enumerate(self.build.state_table):
+            entry, timers, inputs, others = image.states[state_id]
+            self.assertEqual(image.state_name(state_id), state.name)
+            if state.entry_sequence_start:
+                self.assertEqual(entry, state.entry_sequence_start.id())
+            else:
+                self.assertEqual(entry, NULL)
+            self.assertEqual([timer[0] for timer in timers],
+                             [int(timer.duration * TICKS_PER_SECOND)
+                              for timer in state.timers])
+            self.assertEqual(len(inputs), len(state.inputs))
+            self.assertEqual(len(others), len(state.other_ins))
+
+    def test_every_format(self):
+        for text_format in TEXT_FORMATS:
+            for state_format in STATE_FORMATS:
+                image = load_image(text_format, state_format)
+                self.assertEqual(describe(image), self.expected,
+                                 (text_format, state_format))
+
+    def test_timer_order(self):
+        for state_format in STATE_FORMATS:
+            image = load_image('fixed', state_format, timer_order=True)
+            self.assertEqual(describe(image), self.expected, state_format)
+            for (entry, timers, inputs, others), order in zip(
+                    image.states, image.timer_orders):
+                self.assertEqual(order, sorted(
+                    range(len(timers)), key=lambda i: (timers[i][0], i)
+                ))
+
+if __name__ == '__main__':
+    unittest.main()
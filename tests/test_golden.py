@@ -0,0 +1,50 @@
+"""Golden outputs for badge_states.csv.
+
+The speedups to reading and packing the statefile aren't meant to change a
+single byte of the image or the header, so these pin their hashes. (The
+packed timer order did change once, on purpose, when timers started being
+sorted the way the README says they are.) If an output is meant to change,
+check the new one over, and update its hash here in the same commit.
+"""
+
+import hashlib
+import os
+import unittest
+
+from tests import STATEFILE, TempDir, run_statemaker
+
+GOLDEN = {
+    # Default options.
+    ('plain.bin', ()):
+        '24daecdcebac67e63a9a3af70c378451e6033f81170745e61452002f276232bc',
+    ('plain.h', ()):
+        '36595b939d33df89e6406dc58cf5339e1f17ee6080c9d7511634b03b5333a23e',
+    # --cull-nops, to a .hex image.
+    ('cull.hex', ('--cull-nops',)):
+        '0c0ed07ca3be6183d198a5143451bc1ff15c36178064104eefba4f39e612f662',
+    ('cull.h', ('--cull-nops',)):
+        'c3413562e59ca4d99a0190d36374dc4d5d8923966e37b2632d8edcd298e74046',
+}
+
+def sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class GoldenOutputTest(unittest.TestCase):
+    def check_build(self, image_name, header_name, options):
+        with TempDir() as out_dir:
+            image = os.path.join(out_dir, image_name)
+            header = os.path.join(out_dir, header_name)
+            run_statemaker('--statefile', STATEFILE, '--binfile', image,
+                           '-c', header, *options)
+            self.assertEqual(sha256(image), GOLDEN[image_name, options])
+            self.assertEqual(sha256(header), GOLDEN[header_name, options])
+
+    def test_default(self):
+        self.check_build('plain.bin', 'plain.h', ())
+
+    def test_cull_nops(self):
+        self.check_build('cull.hex', 'cull.h', ('--cull-nops',))
+
+if __name__ == '__main__':
+    unittest.main()
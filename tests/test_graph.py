@@ -0,0 +1,107 @@
+"""Strongly connected components, and the rest of StateGraph, on small graphs."""
+
+import random
+import unittest
+
+from qc15_game.graph import StateGraph
+
+class Node(object):
+    def __init__(self, name):
+        self.name = name
+
+def make_graph(count, edges):
+    nodes = [Node('S%d' % i) for i in range(count)]
+    return StateGraph(nodes, [(nodes[u], nodes[v], None) for u, v in edges])
+
+def reachable(count, edges):
+    # reach[u] is the set of nodes that u can get to, including itself.
+    reach = [set([node]) for node in range(count)]
+    changed = True
+    while changed:
+        changed = False
+        for u, v in edges:
+            if not reach[v] <= reach[u]:
+                reach[u] |= reach[v]
+                changed = True
+    return reach
+
+def as_sets(components):
+    return sorted(sorted(component) for component in components)
+
+class StrongComponentTest(unittest.TestCase):
+    def check(self, count, edges):
+        components = make_graph(count, edges).strong_components()
+        reach = reachable(count, edges)
+        # Every node is in exactly one component.
+        self.assertEqual(sorted(node for component in components
+                                for node in component), list(range(count)))
+        # Nodes are in the same component iff they can reach each other.
+        for component in components:
+            for u in component:
+                self.assertEqual(set(component),
+                                 set(v for v in reach[u] if u in reach[v]))
+        # Each component can only get to the ones before it.
+        place = dict((node, i) for i, component in enumerate(components)
+                     for node in component)
+        for u, v in edges:
+            self.assertTrue(place[v] <= place[u])
+        return components
+
+    def test_empty(self):
+        self.assertEqual(make_graph(0, []).strong_components(), [])
+
+    def test_cycle(self):
+        self.assertEqual(as_sets(self.check(3, [(0, 1), (1, 2), (2, 0)])),
+                         [[0, 1, 2]])
+
+    def test_chain(self):
+        self.assertEqual(self.check(3, [(0, 1), (1, 2)]), [[2], [1], [0]])
+
+    def test_two_cycles(self):
+        components = self.check(4, [(0, 1), (1, 0), (1, 2), (2, 3), (3, 2)])
+        self.assertEqual([sorted(component) for component in components],
+                         [[2, 3], [0, 1]])
+
+    def test_self_loop(self):
+        graph = make_graph(2, [(0, 0), (0, 1)])
+        self.assertEqual(graph.strong_components(), [[1], [0]])
+        self.assertTrue(graph.has_loop(0))
+        self.assertFalse(graph.has_loop(1))
+
+    def test_long_chain(self):
+        # Far deeper than Python's recursion limit.
+        count = 5000
+        edges = [(i, i + 1) for i in range(count - 1)] + [(count - 1, 0)]
+        self.assertEqual(len(make_graph(count, edges).strong_components()), 1)
+
+    def test_random_graphs(self):
+        rng = random.Random(25)
+        for trial in range(300):
+            count = rng.randint(1, 12)
+            edges = [(rng.randrange(count), rng.randrange(count))
+                     for i in range(rng.randint(0, count * 2))]
+            self.check(count, edges)
+
+class StateGraphTest(unittest.TestCase):
+    def test_components_and_dead_ends(self):
+        # 0 <-> 1 -> 2, and 3 -> 4 on their own.
+        graph = make_graph(5, [(0, 1), (1, 0), (1, 2), (3, 4)])
+        self.assertEqual(as_sets(graph.weak_components()),
+                         [[0, 1, 2], [3, 4]])
+        self.assertFalse(graph.is_connected())
+        self.assertEqual(graph.dead_ends(), [2, 4])
+        self.assertEqual(as_sets(graph.closed_components()), [[2], [4]])
+        self.assertEqual(list(graph.successors(1)), [0, 2])
+        self.assertEqual(list(graph.predecessors(0)), [1])
+
+    def test_edges_keep_labels(self):
+        nodes = [Node('A'), Node('B')]
+        edges = [(nodes[1], nodes[0], 'back'), (nodes[0], nodes[1], 'go'),
+                 (nodes[0], nodes[0], 'stay')]
+        self.assertEqual(sorted((u.name, v.name, label) for u, v, label in
+                                StateGraph(nodes, edges).edges()),
+                         [('A', 'A', 'stay'), ('A', 'B', 'go'),
+                          ('B', 'A', 'back')])
+
+if __name__ == '__main__':
+    unittest.main()
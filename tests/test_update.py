@@ -0,0 +1,83 @@
+"""GameBuild.update() gives the same build as starting over."""
+
+import io
+import os
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from qc15_game.game_state import GameBuild
+from tests import STATEFILE, TempDir
+
+def read_statefile():
+    with io.open(STATEFILE, 'rb') as f:
+        return f.read()
+
+def write_statefile(path, contents):
+    with io.open(path, 'wb') as f:
+        f.write(contents)
+
+def outputs(build):
+    header = StringIO()
+    build.display_data_str(header)
+    packed = build.pack_structs()
+    return header.getvalue(), dict((region, bytes(data))
+                                   for region, data in packed.items())
+
+def full_build(path, cull_nops):
+    build = GameBuild(path, warn_on_wrap=False)
+    build.read_state_data(cull_nops)
+    return build
+
+class UpdateTest(unittest.TestCase):
+    def check_update(self, old, new, cull_nops=False, updated=None):
+        with TempDir() as temp_dir:
+            path = os.path.join(temp_dir, 'states.csv')
+            write_statefile(path, old)
+            build = full_build(path, cull_nops)
+            write_statefile(path, new)
+            state_graph = build.update(cull_nops)
+            self.assertIsNotNone(state_graph)
+            if updated is not None:
+                self.assertEqual(build.updated_states, updated)
+            self.assertEqual(outputs(build), outputs(full_build(path,
+                                                                cull_nops)))
+
+    def test_changed_text(self):
+        old = read_statefile()
+        new = old.replace(b"ENTER,,,TEXT,,I've lost control.,",
+                          b"ENTER,,,TEXT,,I've lost all control.,")
+        self.assertNotEqual(old, new)
+        self.check_update(old, new)
+        self.check_update(old, new, cull_nops=True)
+
+    def test_added_rows(self):
+        # A new line of text, and a new NOP to cull, in one state.
+        old = read_statefile()
+        new = old.replace(b"CONTD,,,TEXT,,And lost my goal.,",
+                          b"CONTD,,,TEXT,,And lost my way.,,,,,,,\r\n"
+                          b"CONTD,,,NOP,,,,,,,,,\r\n"
+                          b"CONTD,,,TEXT,,And lost my goal.,")
+        self.assertNotEqual(old, new)
+        self.check_update(old, new)
+        self.check_update(old, new, cull_nops=True)
+
+    def test_unchanged(self):
+        self.check_update(read_statefile(), read_statefile(), updated=[])
+
+    def test_new_state_needs_full_build(self):
+        old = read_statefile()
+        new = old.rstrip() + b"\r\nSTART_STATE,BRANDNEW,,,,,,,,,,,\r\n" \
+                             b"ENTER,,,TEXT,,Hello.,,,,,,,\r\n"
+        with TempDir() as temp_dir:
+            path = os.path.join(temp_dir, 'states.csv')
+            write_statefile(path, old)
+            build = full_build(path, False)
+            write_statefile(path, new)
+            self.assertIsNone(build.update(False))
+
+if __name__ == '__main__':
+    unittest.main()